@@ -1,4 +1,6 @@
+import copy
 import json
+import re
 
 
 crypto_url = 'https://localhost:27999/crypto/current-key'
@@ -6,10 +8,52 @@ connection_url = 'https://localhost:27902/jsonar/SonarConnections/1.0.0'
 assets_url = connection_url + '/assets'
 connections_url = connection_url + '/connections'
 
+# assets per page of a paginated GET when the client does not ask for a size, and at most
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+# method -> [(url pattern, name of the MockAssetsServer method handling it)], tried in order
+ROUTES = {
+    'GET': [
+        (re.compile(re.escape(crypto_url) + '$'), '_crypto_route'),
+        (re.compile(re.escape(assets_url) + '/?$'), '_assets_route'),
+        (re.compile(re.escape(assets_url) + r'/(?:.*/)?(?P<asset_id>[^/]*)$'), '_asset_route'),
+        (re.compile(re.escape(connections_url) + r'(?:/(?P<asset_id>[^/]*))?$'),
+         '_connection_route'),
+    ],
+    'PUT': [
+        (re.compile(re.escape(assets_url) + '(?:/.*)?$'), '_put_asset_route'),
+        (re.compile(re.escape(connections_url) + '(?:/.*)?$'), '_put_connection_route'),
+    ],
+    'POST': [
+        (re.compile(re.escape(assets_url) + '/?$'), '_post_assets_route'),
+        (re.compile(re.escape(connections_url) + '/?$'), '_post_connections_route'),
+    ],
+    'DELETE': [
+        (re.compile(re.escape(assets_url) + '/?$'), '_delete_assets_route'),
+        (re.compile(re.escape(assets_url) + r'/(?:.*/)?(?P<asset_id>[^/]+)$'),
+         '_delete_asset_route'),
+        (re.compile(re.escape(connections_url) + r'/(?P<asset_id>[^/]+)$'),
+         '_delete_connection_route'),
+    ],
+}
+
+
+def route(method, url):
+    ''' (name of the handler, match of its pattern) of a request, (None, None) for no route '''
+    for pattern, handler in ROUTES.get(method, ()):
+        match = pattern.match(url)
+        if match:
+            return handler, match
+    return None, None
+
 
 class MockAssetsServer:
     def __init__(self, data):
         self.db = MockedDB(data)
+        self._responses = {}
+        self._generation = self.db.generation
 
     def requests(self, method, url, **kwargs):
         if method == 'GET':
@@ -17,31 +61,116 @@ class MockAssetsServer:
         elif method == 'PUT':
             return self.put_endpoints(url, **kwargs)
         elif method == 'POST':
-            pass
+            return self.post_endpoints(url, **kwargs)
         elif method == 'DELETE':
-            pass
+            return self.delete_endpoints(url, **kwargs)
+
+    def _route(self, method, url, **kwargs):
+        handler, match = route(method, url)
+        if handler is None:
+            return MockResponse('Page not found', 404, 'NOT FOUND')
+        return getattr(self, handler)(match, **kwargs)
 
     def get_endpoints(self, url, **kwargs):
-        if url == crypto_url:
-            return self.get_current_crypto
-        elif assets_url in url:
-            asset_id = url.rsplit('/', 1)[1]
-            return self.get_asset(asset_id)
-        elif connections_url in url:
-            asset_id = kwargs['fields']['asset_id']
-            return self.get_connection(asset_id)
-        return MockResponse('Page not found', 404, 'NOT FOUND')
+        return self._route('GET', url, **kwargs)
 
     def put_endpoints(self, url, **kwargs):
-        if assets_url in url:
-            asset = json.loads(kwargs['body'])
-            return self.set_asset(asset)
-        elif connections_url in url:
-            connection = json.loads(kwargs['body'])
-            return self.set_connection(connection)
-        return MockResponse('Page not found', 404, 'NOT FOUND')
+        return self._route('PUT', url, **kwargs)
+
+    def post_endpoints(self, url, **kwargs):
+        return self._route('POST', url, **kwargs)
+
+    def delete_endpoints(self, url, **kwargs):
+        return self._route('DELETE', url, **kwargs)
+
+    def _crypto_route(self, match, **kwargs):
+        return self.get_current_crypto
+
+    def _asset_route(self, match, **kwargs):
+        return self.get_asset(match['asset_id'])
+
+    def _connection_route(self, match, fields=None, **kwargs):
+        asset_id = (fields or {}).get('asset_id', match['asset_id'])
+        if not asset_id:
+            return MockResponse(json.dumps('Bad Request'), 400, 'BAD REQUEST')
+        return self.get_connection(asset_id)
+
+    def _assets_route(self, match, fields=None, **kwargs):
+        ''' the assets of fields['asset_ids'], or a page of every asset after fields['cursor'] '''
+        fields = fields or {}
+        if 'asset_ids' in fields:
+            return self.get_assets(_id_list(fields['asset_ids']))
+        try:
+            limit = int(fields.get('limit', PAGE_SIZE))
+        except ValueError:
+            limit = 0
+        if not 0 < limit <= MAX_PAGE_SIZE:
+            return MockResponse(json.dumps(f'limit must be between 1 and {MAX_PAGE_SIZE}'),
+                                400, 'BAD REQUEST')
+        return self.get_assets_page(fields.get('cursor'), limit)
+
+    def _put_asset_route(self, match, **kwargs):
+        return self.set_asset(json.loads(kwargs['body']))
+
+    def _put_connection_route(self, match, **kwargs):
+        return self.set_connection(json.loads(kwargs['body']))
+
+    def _post_assets_route(self, match, **kwargs):
+        ''' body: a list of assets, or {'assets': [...], 'upsert': true} to replace existing '''
+        body = json.loads(kwargs.get('body') or 'null')
+        upsert = False
+        if isinstance(body, dict):
+            body, upsert = body.get('assets'), bool(body.get('upsert'))
+        if not isinstance(body, list):
+            return MockResponse(json.dumps('Bad Request'), 400, 'BAD REQUEST')
+        return self.set_assets(body, upsert)
+
+    def _post_connections_route(self, match, **kwargs):
+        body = json.loads(kwargs.get('body') or 'null')
+        if not isinstance(body, list):
+            return MockResponse(json.dumps('Bad Request'), 400, 'BAD REQUEST')
+        return self.set_connections(body)
+
+    def _delete_assets_route(self, match, fields=None, **kwargs):
+        if not fields or 'asset_ids' not in fields:
+            return MockResponse(json.dumps('Bad Request'), 400, 'BAD REQUEST')
+        return self.delete_assets(_id_list(fields['asset_ids']))
+
+    def _delete_asset_route(self, match, **kwargs):
+        return self.delete_asset(match['asset_id'])
+
+    def _delete_connection_route(self, match, **kwargs):
+        return self.delete_connections(match['asset_id'])
+
+    def _refresh(self):
+        ''' forget every cached response when the db changed other than through this server '''
+        if self.db.reindex() != self._generation:
+            self._responses.clear()
+            self._generation = self.db.generation
+
+    def _cached(self, key, source, build):
+        ''' response of a read, serialized once until a write to the asset it is about, or until
+        source, what it was built from, no longer equals a copy taken then '''
+        self._refresh()
+        current = source()
+        cached = self._responses.get(key)
+        if cached is not None and cached[0] == current:
+            return cached[1]
+        response = build()
+        self._responses[key] = (copy.deepcopy(current), response)
+        return response
+
+    def _invalidate(self, asset_id):
+        ''' after a write of this server to the asset, which _refresh() preceded '''
+        self._responses.pop(('asset', asset_id), None)
+        self._responses.pop(('connection', asset_id), None)
+        self._generation = self.db.generation
 
     def get_asset(self, asset_id):
+        return self._cached(('asset', asset_id), lambda: self.db.get_asset(asset_id),
+                            lambda: self._get_asset(asset_id))
+
+    def _get_asset(self, asset_id):
         asset = self.db.get_asset(asset_id)
         if asset != 'NOT FOUND':
             return MockResponse(json.dumps(asset), 200, 'OK')
@@ -49,7 +178,32 @@ class MockAssetsServer:
         return MockResponse(f'Failed to get asset with asset_id: {asset_id} ',
                             404, 'NOT FOUND')
 
+    def get_assets(self, asset_ids):
+        ''' every asset of asset_ids in one response, and the ids of the ones that do not exist '''
+        found, missing = [], []
+        for asset_id in asset_ids:
+            asset = self.db.get_asset(asset_id)
+            if asset == 'NOT FOUND':
+                missing.append(asset_id)
+            else:
+                found.append(asset)
+        return MockResponse(json.dumps({'assets': found, 'missing': missing}), 200, 'OK')
+
+    def get_assets_page(self, cursor, limit):
+        ''' limit assets after the one cursor names, with the cursor of the next page or None '''
+        page = self.db.get_assets_page(cursor, limit)
+        if page is None:
+            return MockResponse(json.dumps(f'Unknown cursor: {cursor}'), 400, 'BAD REQUEST')
+        assets, cursor = page
+        return MockResponse(json.dumps({'assets': assets, 'next': cursor}), 200, 'OK')
+
     def get_connection(self, asset_id):
+        db = self.db
+        return self._cached(('connection', asset_id),
+                            lambda: (db.get_asset(asset_id), db.get_connections(asset_id)),
+                            lambda: self._get_connection(asset_id))
+
+    def _get_connection(self, asset_id):
         asset = self.get_asset(asset_id)
         if asset.reason == 'OK':
             connection = self.db.get_connection(asset_id)
@@ -61,8 +215,10 @@ class MockAssetsServer:
         return MockResponse(json.dumps('NOT FOUND'), 200, 'OK')
 
     def set_asset(self, asset):
+        self._refresh()
         if asset and asset['asset_id'] != 'missing_mandatory_fields':
             if self.db.set_asset(asset):
+                self._invalidate(asset['asset_id'])
                 return MockResponse(json.dumps({'url': f'{assets_url}/asset/{asset["asset_id"]}'}),
                                     201, 'CREATED')
             return MockResponse(json.dumps(f'An asset with id: {asset["asset_id"]} already exists'),
@@ -71,11 +227,59 @@ class MockAssetsServer:
             return MockResponse(json.dumps('Bad Request'), 400, 'BAD REQUEST')
 
     def set_connection(self, connection):
+        self._refresh()
         if self.db.set_connection(connection):
+            self._invalidate(connection['asset_id'])
             return MockResponse(json.dumps({'url': f'{connections_url}/{connection["asset_id"]}'}),
                                 201, 'CREATED')
         return MockResponse(json.dumps('Bad Request'), 400, 'BAD REQUEST')
 
+    def set_assets(self, assets, upsert=False):
+        ''' create (or with upsert, replace) many assets, with a status per asset in body order '''
+        self._refresh()
+        statuses = []
+        for asset in assets:
+            if not _has_asset_id(asset) or asset['asset_id'] == 'missing_mandatory_fields':
+                statuses.append(_status(asset, 400, 'BAD REQUEST'))
+                continue
+            created = self.db.upsert_asset(asset) if upsert else self.db.set_asset(asset)
+            if created is False:
+                statuses.append(_status(asset, 409, 'CONFLICT'))
+                continue
+            self._invalidate(asset['asset_id'])
+            statuses.append(_status(asset, *((201, 'CREATED') if created else (200, 'OK'))))
+        return MockResponse(json.dumps(statuses), 207, 'MULTI-STATUS')
+
+    def set_connections(self, connections):
+        self._refresh()
+        statuses = []
+        for connection in connections:
+            if _has_asset_id(connection) and self.db.set_connection(connection):
+                self._invalidate(connection['asset_id'])
+                statuses.append(_status(connection, 201, 'CREATED'))
+            else:
+                statuses.append(_status(connection, 400, 'BAD REQUEST'))
+        return MockResponse(json.dumps(statuses), 207, 'MULTI-STATUS')
+
+    def delete_asset(self, asset_id):
+        if self.db.delete_assets([asset_id]):
+            return MockResponse(json.dumps({'deleted': asset_id}), 200, 'OK')
+        return MockResponse(f'Failed to get asset with asset_id: {asset_id} ', 404, 'NOT FOUND')
+
+    def delete_assets(self, asset_ids):
+        ''' delete many assets at once, with a status per asset_id '''
+        deleted = set(self.db.delete_assets(asset_ids))
+        return MockResponse(json.dumps([
+            _status({'asset_id': asset_id}, 200, 'OK') if asset_id in deleted else
+            _status({'asset_id': asset_id}, 404, 'NOT FOUND') for asset_id in asset_ids]),
+            207, 'MULTI-STATUS')
+
+    def delete_connections(self, asset_id):
+        deleted = self.db.delete_connections(asset_id)
+        if deleted:
+            return MockResponse(json.dumps({'deleted': deleted}), 200, 'OK')
+        return MockResponse(json.dumps('NOT FOUND'), 404, 'NOT FOUND')
+
     @property
     def get_current_crypto(self):
         return MockResponse('THIS IS THE CRYPTO KEY', 200, 'OK')
@@ -88,30 +292,221 @@ class MockResponse:
         self.reason = reason
 
 
+class TrackedList(list):
+    ''' list counting the changes made to it in version, so MockedDB notices the ones made to
+    its data behind its back '''
+    __slots__ = ('version',)
+
+    def __init__(self, items=()):
+        super().__init__(items)
+        self.version = 0
+
+    def _changing(name):
+        method = getattr(list, name)
+
+        def change(self, *args, **kwargs):
+            self.version += 1
+            return method(self, *args, **kwargs)
+        change.__name__ = name
+        return change
+
+    __setitem__ = _changing('__setitem__')
+    __delitem__ = _changing('__delitem__')
+    __iadd__ = _changing('__iadd__')
+    __imul__ = _changing('__imul__')
+    append = _changing('append')
+    extend = _changing('extend')
+    insert = _changing('insert')
+    pop = _changing('pop')
+    remove = _changing('remove')
+    clear = _changing('clear')
+    sort = _changing('sort')
+    reverse = _changing('reverse')
+    del _changing
+
+
+def _tracked(data, key):
+    ''' data[key] as a TrackedList, put back in data so changes made through it are tracked '''
+    if not isinstance(data[key], TrackedList):
+        data[key] = TrackedList(data[key])
+    return data[key]
+
+
 class MockedDB:
     def __init__(self, data):
         self.name = 'lmrm__sonarg'
-        self.asset = data['assets']
-        self.connection = data['connections']
+        # the lists of data, tracked in place of the ones given so direct changes are noticed
+        self.asset = _tracked(data, 'assets')
+        self.connection = _tracked(data, 'connections')
+        # asset_id -> first asset, asset_id -> connections, in list order
+        self.assets_by_id = {}
+        self.connections_by_id = {}
+        # asset_id -> position of its first asset in self.asset, for pages and replacing; the
+        # positions from _positions_from on are stale after a delete, until _positions()
+        self.asset_positions = {}
+        self._positions_from = None
+        # asset_ids of more than one asset, only the first of which is indexed
+        self._duplicates = set()
+        self.generation = 0
+        self._indexed = None
+        self.reindex()
+
+    def reindex(self, force=False):
+        ''' rebuild the asset_id indexes when the lists changed behind our back, returns the
+        generation of the data, which every write bumps. An asset_id changed in place in an item
+        is noticed by the next lookup of the old one '''
+        if force or self._indexed != (self.asset.version, self.connection.version):
+            self.assets_by_id = {}
+            self.asset_positions = {}
+            self._positions_from = None
+            self._duplicates = set()
+            for i, asset in enumerate(self.asset):
+                if asset['asset_id'] not in self.assets_by_id:
+                    self.assets_by_id[asset['asset_id']] = asset
+                    self.asset_positions[asset['asset_id']] = i
+                else:
+                    self._duplicates.add(asset['asset_id'])
+            self.connections_by_id = {}
+            for connection in self.connection:
+                self.connections_by_id.setdefault(connection['asset_id'], []).append(connection)
+            self._indexed_now()
+        return self.generation
+
+    def _indexed_now(self):
+        ''' the indexes are up to date with the lists, after a rebuild or our own write '''
+        self._indexed = (self.asset.version, self.connection.version)
+        self.generation += 1
+
+    def _positions(self):
+        ''' asset_positions, recomputed past the first asset a delete moved '''
+        if self._positions_from is not None:
+            for i in range(self._positions_from, len(self.asset)):
+                asset = self.asset[i]
+                if self.assets_by_id.get(asset['asset_id']) is asset:
+                    self.asset_positions[asset['asset_id']] = i
+            self._positions_from = None
+        return self.asset_positions
 
     def set_asset(self, asset):
         success = False
         if asset and self.get_asset(asset['asset_id']) == 'NOT FOUND':
             self.asset.append(asset)
+            self.assets_by_id[asset['asset_id']] = asset
+            self.asset_positions[asset['asset_id']] = len(self.asset) - 1
+            self._indexed_now()
             success = True
         return success
 
+    def upsert_asset(self, asset):
+        ''' True when the asset was created, None when it replaced the asset with its asset_id '''
+        if self.set_asset(asset):
+            return True
+        self.asset[self._positions()[asset['asset_id']]] = asset
+        self.assets_by_id[asset['asset_id']] = asset
+        self._indexed_now()
+        return None
+
+    def delete_assets(self, asset_ids):
+        ''' remove the assets of asset_ids and their connections, returns the ids removed '''
+        self.reindex()
+        deleted = {asset_id for asset_id in asset_ids if asset_id in self.assets_by_id}
+        if deleted & self._duplicates:
+            # the later assets with these asset_ids are not indexed, so look for them
+            self.asset[:] = [a for a in self.asset if a['asset_id'] not in deleted]
+            self.connection[:] = [c for c in self.connection if c['asset_id'] not in deleted]
+            self.reindex(force=True)
+        elif deleted:
+            positions = self._positions()
+            moved = sorted((positions.pop(asset_id) for asset_id in deleted), reverse=True)
+            for position in moved:
+                del self.asset[position]
+            self._positions_from = moved[-1]
+            for asset_id in deleted:
+                del self.assets_by_id[asset_id]
+                self._remove_connections(asset_id)
+            self._indexed_now()
+        return [asset_id for asset_id in asset_ids if asset_id in deleted]
+
+    def delete_connections(self, asset_id):
+        ''' remove the connections of an asset, returns how many there were '''
+        deleted = len(self.get_connections(asset_id))
+        if deleted:
+            self._remove_connections(asset_id)
+            self._indexed_now()
+        return deleted
+
+    def _remove_connections(self, asset_id):
+        for connection in self.connections_by_id.pop(asset_id, ()):
+            # the first equal connection, which has this asset_id too
+            self.connection.remove(connection)
+
+    def get_assets_page(self, cursor, limit):
+        ''' (up to limit assets after the asset_id cursor, cursor of the next page or None), None
+        when the cursor names no asset '''
+        self.reindex()
+        positions = self._positions()
+        if cursor is None:
+            start = 0
+        elif cursor in positions:
+            start = positions[cursor] + 1
+        else:
+            return None
+        page = []
+        for i in range(start, len(self.asset)):
+            asset = self.asset[i]
+            if positions[asset['asset_id']] != i:
+                continue
+            if len(page) == limit:
+                return page, page[-1]['asset_id']
+            page.append(asset)
+        return page, None
+
     def set_connection(self, connection):
         if connection and connection['asset_id'] != 'missing_mandatory_fields':
+            self.reindex()
             self.connection.append(connection)
+            self.connections_by_id.setdefault(connection['asset_id'], []).append(connection)
+            self._indexed_now()
             return True
         return False
 
     def get_asset(self, asset_id):
-        return item_by_asset_id(self.asset, asset_id)
+        self.reindex()
+        asset = self.assets_by_id.get(asset_id, 'NOT FOUND')
+        if asset != 'NOT FOUND' and asset['asset_id'] != asset_id:
+            # its asset_id was changed in place
+            self.reindex(force=True)
+            return self.assets_by_id.get(asset_id, 'NOT FOUND')
+        return asset
 
     def get_connection(self, asset_id):
-        return item_by_asset_id(self.connection, asset_id)
+        connections = self.get_connections(asset_id)
+        return connections[0] if connections else 'NOT FOUND'
+
+    def get_connections(self, asset_id):
+        self.reindex()
+        connections = self.connections_by_id.get(asset_id, [])
+        if any(connection['asset_id'] != asset_id for connection in connections):
+            self.reindex(force=True)
+            connections = self.connections_by_id.get(asset_id, [])
+        return connections
+
+
+def _has_asset_id(item):
+    return isinstance(item, dict) and 'asset_id' in item
+
+
+def _status(item, status, reason):
+    ''' entry of a batch response about one item of the batch '''
+    return {'asset_id': item['asset_id'] if _has_asset_id(item) else None,
+            'status': status, 'reason': reason}
+
+
+def _id_list(asset_ids):
+    ''' asset_ids of a list, or of a comma separated string as a query string carries them '''
+    if isinstance(asset_ids, str):
+        return [asset_id for asset_id in asset_ids.split(',') if asset_id]
+    return list(asset_ids)
 
 
 def item_by_asset_id(items, asset_id):
@@ -0,0 +1,156 @@
+import asyncio
+import json
+from collections import Counter
+from urllib.parse import parse_qsl, urlsplit
+
+from test.mock.connections import MockAssetsServer, connection_url, crypto_url, route
+from test.mock.loopback import LoopbackServer
+
+# the services the routes live on, by the path prefix their urls start with
+_ORIGINS = [(urlsplit(u).path, f'{urlsplit(u).scheme}://{urlsplit(u).netloc}')
+            for u in (crypto_url, connection_url)]
+
+
+def route_name(method, url):
+    ''' name a request is counted and delayed under, like 'GET asset' or 'PUT connection' '''
+    handler, _ = route(method, url)
+    if handler is None:
+        return f'{method} unknown'
+    name = handler[1:-len('_route')]
+    return f'{method} {name.removeprefix(method.lower() + "_")}'
+
+
+def _canonical(target):
+    ''' (url the in-process routes expect, query fields) of a request target '''
+    parts = urlsplit(target)
+    url = parts.path
+    for prefix, origin in _ORIGINS:
+        if parts.path.startswith(prefix):
+            url = origin + parts.path
+            break
+    return url, dict(parse_qsl(parts.query))
+
+
+async def _read_body(reader, headers):
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            if size == 0:
+                while (await reader.readline()).strip():
+                    pass
+                return b''.join(chunks)
+            chunks.append(await reader.readexactly(size))
+            await reader.readline()
+    length = int(headers.get('content-length', 0))
+    return await reader.readexactly(length) if length else b''
+
+
+class MockConnectionsServer(LoopbackServer):
+    ''' the crypto, assets and connections routes of MockAssetsServer served over HTTP/1.1 on the
+    loopback, with persistent connections, request counters and optional injected latency '''
+    thread_name = 'mock-connections-server'
+
+    def __init__(self, assets=None, data=None, host='127.0.0.1', port=0, latency=0,
+                 ssl_context=None):
+        super().__init__(host, port)
+        if assets is None:
+            assets = MockAssetsServer(data if data is not None else
+                                      {'assets': [], 'connections': []})
+        self.assets = assets
+        # seconds added to every response, or {route name: seconds}
+        self.latency = latency
+        self.ssl_context = ssl_context
+        self.connections_opened = 0
+        self.requests_per_connection = Counter()
+        self.routes = Counter()
+
+    @property
+    def scheme(self):
+        return 'https' if self.ssl_context is not None else 'http'
+
+    @property
+    def base_url(self):
+        return f'{self.scheme}://{self.host}:{self.port}'
+
+    address = base_url
+
+    def url(self, original):
+        ''' address of one of the connections module urls on this server '''
+        parts = urlsplit(original)
+        return self.base_url + parts.path + (f'?{parts.query}' if parts.query else '')
+
+    def _delay(self, name):
+        if isinstance(self.latency, dict):
+            return self.latency.get(name, 0)
+        return self.latency
+
+    async def _handle(self, reader, writer):
+        connection_id = next(self._connection_ids)
+        self.connections += 1
+        self.connections_opened += 1
+        self._writers.add(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line.strip():
+                    break
+                method, target, version = line.decode('latin-1').split()
+                headers = {}
+                while True:
+                    header = await reader.readline()
+                    if not header.strip():
+                        break
+                    name, _, value = header.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await _read_body(reader, headers)
+                self.requests_per_connection[connection_id] += 1
+
+                keep_alive = headers.get('connection', '').lower() != 'close' and \
+                    (version != 'HTTP/1.0' or headers.get('connection', '').lower() == 'keep-alive')
+                status, reason, data = await self.respond(method, target, body)
+                writer.write(b''.join([
+                    f'HTTP/1.1 {status} {reason}\r\n'.encode('latin-1'),
+                    b'Content-Type: application/json\r\n',
+                    f'Content-Length: {len(data)}\r\n'.encode('latin-1'),
+                    f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n'.encode(),
+                    data,
+                ]))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ValueError, ConnectionError):
+            pass
+        finally:
+            self.connections -= 1
+            self._writers.discard(writer)
+            writer.close()
+
+    async def respond(self, method, target, body=b''):
+        ''' (status, reason, body) of a request to target, a path with an optional query '''
+        url, fields = _canonical(target)
+        name = route_name(method, url)
+        self.routes[name] += 1
+        delay = self._delay(name)
+        if delay:
+            await asyncio.sleep(delay)
+        kwargs = {}
+        if fields:
+            kwargs['fields'] = fields
+        if body:
+            kwargs['body'] = body.decode('utf-8')
+        try:
+            response = self.assets.requests(method, url, **kwargs)
+        except (KeyError, TypeError, ValueError) as e:
+            # a body or query without the fields the route needs, or a body that is not JSON
+            return 400, 'BAD REQUEST', json.dumps(f'Bad request: {e!r}').encode()
+        except Exception as e:
+            return 500, 'INTERNAL SERVER ERROR', json.dumps(f'Server error: {e!r}').encode()
+        if response is None:
+            return 405, 'METHOD NOT ALLOWED', b'"Method not allowed"'
+        return response.status, response.reason, response.data
+
+
+if __name__ == '__main__':
+    # python -m test.mock.connections_server [port], an empty assets service for manual testing
+    MockConnectionsServer.main()
@@ -1,4 +1,5 @@
 from collections import namedtuple
+from os import PathLike
 from subprocess import CalledProcessError
 
 from test.mock.subprocess import validate_run_args
@@ -7,39 +8,112 @@ struct_group = namedtuple('struct_group',
                           ['gr_name', 'gr_passwd', 'gr_gid', 'gr_mem'])
 
 
+def read_group(source):
+    ''' entries of an /etc/group format file, from a path or an open file, one line at a time '''
+    if isinstance(source, (str, PathLike)):
+        with open(source) as f:
+            yield from read_group(f)
+        return
+    for line in source:
+        line = line.rstrip('\n')
+        if not line.strip() or line.startswith('#'):
+            continue
+        name, passwd, gid, members = line.split(':', 3)
+        yield struct_group(name, passwd, int(gid), [m for m in members.split(',') if m])
+
+
 class MockGrp:
     def __init__(self, entries=None):
         if entries is None:
             entries = [
                 ('sonar', 'x', 981, [])
             ]
-        self.db = [struct_group(*entry) for entry in entries]
+        self.db = []
+        # gid -> first entry, name -> first entry, user -> the groups listing them as a member
+        self._by_gid = {}
+        self._by_name = {}
+        self._by_member = {}
+        self._next_gid = 0
+        self._indexed = 0
+        self.load(entries)
+
+    @classmethod
+    def from_file(cls, source):
+        ''' MockGrp of the entries of an /etc/group format file '''
+        return cls(read_group(source))
+
+    def load(self, entries):
+        ''' add entries (tuples or struct_group, from an iterator too) one at a time '''
+        self._reindex()
+        for entry in entries:
+            self._add(struct_group(*entry))
+        return self
+
+    def _add(self, group):
+        self.db.append(group)
+        self._by_gid.setdefault(group.gr_gid, group)
+        self._by_name.setdefault(group.gr_name, group)
+        for user in group.gr_mem:
+            self._by_member.setdefault(user, []).append(group)
+        self._next_gid = max(self._next_gid, group.gr_gid + 1)
+        self._indexed = len(self.db)
+
+    def _reindex(self):
+        ''' rebuild the indexes when entries were added to db behind our back '''
+        if self._indexed != len(self.db):
+            groups, self.db = self.db, []
+            self._by_gid, self._by_name, self._by_member, self._next_gid = {}, {}, {}, 0
+            for group in groups:
+                self._add(group)
 
     def getgrgid(self, gid):
-        for item in self.db:
-            if item.gr_gid == gid:
-                return item
-        raise KeyError(f'getgrgid(): gid not found: {gid}')
+        self._reindex()
+        try:
+            return self._by_gid[gid]
+        except KeyError:
+            raise KeyError(f'getgrgid(): gid not found: {gid}') from None
 
     def getgrnam(self, name):
-        for item in self.db:
-            if item.gr_name == name:
-                return item
-        raise KeyError(f'getgrnam(): name not found: {name}')
+        self._reindex()
+        try:
+            return self._by_name[name]
+        except KeyError:
+            raise KeyError(f'getgrnam(): name not found: {name}') from None
 
     def getgrall(self):
         return self.db
 
+    def getgrouplist(self, user, group):
+        ''' gids of the groups of user, group (its primary gid) first, like os.getgrouplist '''
+        self._reindex()
+        gids = [group]
+        for member_of in self._by_member.get(user, ()):
+            if member_of.gr_gid not in gids:
+                gids.append(member_of.gr_gid)
+        return gids
+
+    def groups_of(self, user):
+        ''' the groups listing user as a member '''
+        self._reindex()
+        return list(self._by_member.get(user, ()))
+
+    def add_member(self, name, user):
+        ''' gpasswd -a: add user to the members of group name '''
+        group = self.getgrnam(name)
+        if user not in group.gr_mem:
+            group.gr_mem.append(user)
+            self._by_member.setdefault(user, []).append(group)
+
     def groupadd(self, name, gid):
         validate_run_args(name, gid)
-        for group in self.db:
-            if gid is not None and int(gid) == group.gr_gid:
-                raise CalledProcessError(f"groupadd: GID '{gid}' already exists")
-
-            if name == group.gr_name:
-                raise CalledProcessError(f"groupadd: group '{name}' already exists")
+        self._reindex()
+        if gid is not None and int(gid) in self._by_gid:
+            raise CalledProcessError(4, 'groupadd', stderr=f"groupadd: GID '{gid}' already exists")
+        if name in self._by_name:
+            raise CalledProcessError(9, 'groupadd',
+                                     stderr=f"groupadd: group '{name}' already exists")
 
         if gid is None:
-            gid = max([group.gr_gid for group in self.db]) + 1
+            gid = self._next_gid
 
-        self.db.append(struct_group(name, 'x', int(gid), []))
+        self._add(struct_group(name, 'x', int(gid), []))
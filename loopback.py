@@ -0,0 +1,97 @@
+import asyncio
+import sys
+import threading
+from itertools import count
+
+
+class LoopbackServer:
+    ''' asyncio server of the mock servers: serve() on the running loop, or start() a background
+    thread serving until stop(), also as a context manager. Subclasses handle the connections in
+    _handle(reader, writer) and name the address clients connect to '''
+    thread_name = 'mock-server'
+    ssl_context = None
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.host = host
+        self.port = port
+        self.connections = 0
+        self._connection_ids = count(1)
+        self._writers = set()
+        self._server = None
+        self._loop = None
+        self._thread = None
+
+    @property
+    def address(self):
+        raise NotImplementedError
+
+    async def _handle(self, reader, writer):
+        raise NotImplementedError
+
+    async def serve(self):
+        ''' start listening on the running loop, port 0 picks a free port '''
+        self._server = await asyncio.start_server(self._handle, self.host, self.port,
+                                                  ssl=self.ssl_context)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self._server
+
+    def start(self):
+        ''' serve from a background thread until stop() '''
+        ready = threading.Event()
+        failure = []
+
+        def run():
+            loop = self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            try:
+                loop.run_until_complete(self.serve())
+            except OSError as e:
+                failure.append(e)
+                ready.set()
+                loop.close()
+                return
+            ready.set()
+            loop.run_forever()
+            loop.run_until_complete(self._shutdown())
+            loop.close()
+
+        self._thread = threading.Thread(target=run, name=self.thread_name, daemon=True)
+        self._thread.start()
+        ready.wait()
+        if failure:
+            raise failure[0]
+        return self
+
+    async def _shutdown(self):
+        ''' close the listener and every connection, letting their handlers finish '''
+        self._server.close()
+        for writer in list(self._writers):
+            writer.close()
+        tasks = asyncio.all_tasks() - {asyncio.current_task()}
+        if tasks:
+            await asyncio.wait(tasks, timeout=1)
+
+    def stop(self):
+        if self._thread is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    @classmethod
+    def main(cls, argv=None):
+        ''' python -m test.mock.<module> [port]: serve until interrupted, printing the address '''
+        argv = sys.argv if argv is None else argv
+
+        async def run():
+            server = cls(port=int(argv[1]) if len(argv) > 1 else 0)
+            await server.serve()
+            print(server.address, flush=True)
+            await server._server.serve_forever()
+
+        asyncio.run(run())
@@ -1,47 +1,142 @@
+import heapq
 import os.path
-from datetime import datetime, timezone
+import re
+import threading
+from collections import deque
+from collections.abc import Sequence
+from copy import copy, deepcopy
+from functools import wraps
+from itertools import islice, product
+from time import perf_counter
+import bson
 from bson import ObjectId
-from pymongo.errors import DuplicateKeyError, InvalidOperation, BulkWriteError
+from bson.errors import InvalidDocument
+from bson.regex import Regex
+from bson.son import SON
+from pymongo import DeleteMany, DeleteOne, InsertOne, ReplaceOne, ReturnDocument, UpdateMany
+from pymongo.errors import DuplicateKeyError, InvalidOperation, BulkWriteError, \
+    OperationFailure, WriteError
+
+from test.mock.mongo_aggregate import run_pipeline
+from test.mock.mongo_index import SortedIndex, distinct_values, index_keys, index_name, plan
+from test.mock.mongo_lock import RWLock, locked
+from test.mock.mongo_oplog import OPLOG_SIZE, MockChangeStream, Oplog, update_description
+from test.mock.mongo_profile import MockProfiler, OpStats
+from test.mock.mongo_query import MISSING, compile_filter, equalities, hashable, is_operator, \
+    ranges, sort_key, sort_spec, sort_key_function
+from test.mock.mongo_read import READ_MODES, REFERENCE, reader
+from test.mock.mongo_replay import MockRecorder, result_size
+from test.mock.mongo_update import compile_update, fix_date, upsert_document
 
 
 def match(doc, _filter):
-    if _filter:
-        return all([_match(doc, k, v) for k, v in _filter.items()])
-    return True
-
-
-def _match(doc, k, v):
-    if (isinstance(v, dict)):
-        for inner_k, inner_v in v.items():
-            if (inner_k == "$exists"):
-                return (k in doc) == inner_v
-    return doc.get(k) == v
+    return compile_filter(_filter)(doc)
 
 
 def update(doc, update):
-    modified = 0
     if doc:
-        for k, v in update.items():
-            if k == '$set':
-                doc.update(fix_date(v))
-                modified = 1
-            else:
-                raise InvalidOperation
-    return modified
+        return int(compile_update(update)(doc))
+    return 0
+
+
+_raise_lock = threading.Lock()
+
+# marker a paced cursor returns instead of a document every so many candidates examined, so an
+# async caller can yield to its event loop in the middle of a selective scan
+PAUSE = object()
+
+
+def _paced(candidates, every):
+    for i, doc in enumerate(candidates, 1):
+        yield doc
+        if i % every == 0:
+            yield PAUSE
 
 
 def maybe_raise(func):
+    @wraps(func)
     def wrapper(self, *args, **kwargs):
         if self.raise_on_next_command is not None:
-            e, self.raise_on_next_command = self.raise_on_next_command, None
-            raise e
+            # only one of several racing threads gets the exception
+            with _raise_lock:
+                e, self.raise_on_next_command = self.raise_on_next_command, None
+            if e is not None:
+                raise e
         return func(self, *args, **kwargs)
     return wrapper
 
 
+def profiled(op):
+    ''' record a collection method with the active profiler and recorder, nested calls count
+    towards the outer one '''
+    def decorator(func):
+        @wraps(func)
+        def wrapper(self, *args, **kwargs):
+            profiler, recorder = self._profiler(), self._recorder()
+            if (profiler is None and recorder is None) or self._op is not None:
+                return func(self, *args, **kwargs)
+            if recorder is not None:
+                args, kwargs, journaled = recorder.bind(func, args, kwargs)
+            self._op = stats = OpStats(op)
+            start = perf_counter()
+            ret = error = None
+            try:
+                ret = func(self, *args, **kwargs)
+                return ret
+            except Exception as e:
+                error = e
+                raise
+            finally:
+                self._op = None
+                stats.micros = (perf_counter() - start) * 1e6
+                if profiler is not None:
+                    profiler.record(self.full_name, stats)
+                if recorder is not None:
+                    recorder.record(self, func.__name__, journaled, result_size(ret), stats.micros,
+                                    start, error)
+        return wrapper
+    return decorator
+
+
 class MockBase:
     def __init__(self):
         self.raise_on_next_command = None
+        self.profiler = None
+        self.recorder = None
+        self.oplog = None
+
+    def _top(self):
+        ''' object holding the oplog this one records into '''
+        return self
+
+    def enable_oplog(self, capacity=OPLOG_SIZE):
+        ''' record changes into a ring buffer of capacity events, watch() starts a default one '''
+        top = self._top()
+        top.oplog = Oplog(capacity)
+        return top.oplog
+
+    def _changes(self):
+        top = self._top()
+        if top.oplog is None:
+            top.oplog = Oplog()
+        return top.oplog
+
+    def enable_profiling(self, capacity=1000):
+        self.profiler = MockProfiler(capacity)
+        return self.profiler
+
+    def disable_profiling(self):
+        self.profiler = None
+
+    def enable_recording(self, out):
+        ''' journal operations as JSON lines into out, a path or a writable text file '''
+        self.recorder = MockRecorder(out)
+        return self.recorder
+
+    def disable_recording(self):
+        if self.recorder is not None:
+            self.recorder.close()
+        self.recorder = None
 
 
 class UpdateResult:
@@ -61,6 +156,35 @@ class UpdateResult:
             }
 
 
+class BulkWriteResult:
+    def __init__(self, results):
+        self.bulk_api_result = results
+        self.acknowledged = True
+        self.inserted_count = results['nInserted']
+        self.matched_count = results['nMatched']
+        self.modified_count = results['nModified']
+        self.deleted_count = results['nRemoved']
+        self.upserted_count = results['nUpserted']
+        self.upserted_ids = {u['index']: u['_id'] for u in results['upserted']}
+
+
+def bulk_results():
+    return {
+        'nInserted': 0,
+        'nMatched': 0,
+        'nModified': 0,
+        'nRemoved': 0,
+        'nUpserted': 0,
+        'upserted': [],
+        'writeConcernErrors': [],
+        'writeErrors': []
+    }
+
+
+def write_error(index, e, op):
+    return {'index': index, 'code': getattr(e, 'code', None) or 11000, 'errmsg': str(e), 'op': op}
+
+
 class DeleteResult:
     def __init__(self, count):
         self.deleted_count = count
@@ -76,23 +200,322 @@ class InsertOneResult:
         self.inserted_id = inserted_id
 
 
+class MockCursor:
+    ''' lazy result of MockCollection.find, following pymongo's Cursor '''
+    def __init__(self, collection, _filter=None, projection=None, skip=0, limit=0, sort=None,
+                 batch_size=0):
+        self.collection = collection
+        self._filter = _filter
+        self._projection = projection
+        self._skip = skip
+        self._limit = limit
+        self._sort = sort_spec(sort) if sort else None
+        self._batch_size = batch_size
+        self._it = None
+        self._buffer = deque()
+        self._retrieved = 0
+        self._killed = False
+        # candidates examined between two PAUSE markers, 0 for none
+        self._pace = 0
+
+    def _start(self):
+        collection = self.collection
+        profiler, recorder = collection._profiler(), collection._recorder()
+        if (profiler is None and recorder is None) or collection._op is not None:
+            docs = collection._read(self._execute)
+        else:
+            stats = OpStats('query', self._filter)
+            start = perf_counter()
+            call = None
+            if recorder is not None:
+                call = (recorder, 'find', recorder.bind(MockCollection.find, (), {
+                    '_filter': self._filter, 'projection': self._projection, 'skip': self._skip,
+                    'limit': self._limit, 'sort': self._sort, 'batch_size': self._batch_size})[2])
+            docs = collection._read(self._execute, stats)
+            stats.micros = (perf_counter() - start) * 1e6
+            docs = collection._recorded(docs, stats, profiler, start, call)
+        output = collection._reader(self._projection)
+        if output is None:
+            return docs
+        if self._pace:
+            return (d if d is PAUSE else output(d) for d in docs)
+        return map(output, docs)
+
+    def _check_okay_to_chain(self):
+        if self._it is not None:
+            raise InvalidOperation('cannot set options after executing query')
+
+    def sort(self, key_or_list, direction=None):
+        self._check_okay_to_chain()
+        self._sort = sort_spec(key_or_list, direction)
+        return self
+
+    def skip(self, skip):
+        if not isinstance(skip, int):
+            raise TypeError('skip must be an integer')
+        if skip < 0:
+            raise ValueError('skip must be >= 0')
+        self._check_okay_to_chain()
+        self._skip = skip
+        return self
+
+    def limit(self, limit):
+        if not isinstance(limit, int):
+            raise TypeError('limit must be an integer')
+        self._check_okay_to_chain()
+        self._limit = limit
+        return self
+
+    def batch_size(self, batch_size):
+        if not isinstance(batch_size, int):
+            raise TypeError('batch_size must be an integer')
+        if batch_size < 0:
+            raise ValueError('batch_size must be >= 0')
+        self._check_okay_to_chain()
+        self._batch_size = batch_size
+        return self
+
+    def _execute(self, stats=None):
+        docs, ordered = self.collection._select_ordered(self._filter, self._sort, stats,
+                                                        self._pace)
+        if self._pace:
+            return self._paced_window(docs, ordered)
+        if self._sort and not ordered:
+            return self._sorted(docs)
+        limit = abs(self._limit)
+        return islice(docs, self._skip, self._skip + limit if limit else None)
+
+    def _sorted(self, docs):
+        ''' the skip and limit window of docs in sort order '''
+        limit = abs(self._limit)
+        key, reverse = sort_key_function(self._sort)
+        if limit:
+            top = heapq.nlargest if reverse else heapq.nsmallest
+            return iter(top(self._skip + limit, docs, key=key)[self._skip:])
+        return iter(sorted(docs, key=key, reverse=reverse)[self._skip:])
+
+    def _paced_window(self, docs, ordered):
+        ''' _execute for a paced cursor, the PAUSE markers pass through sort, skip and limit '''
+        if self._sort and not ordered:
+            found = []
+            for doc in docs:
+                if doc is PAUSE:
+                    yield doc
+                else:
+                    found.append(doc)
+            yield from self._sorted(found)
+            return
+        skip, limit, n = self._skip, abs(self._limit), 0
+        for doc in docs:
+            if doc is PAUSE:
+                yield doc
+            elif skip:
+                skip -= 1
+            else:
+                yield doc
+                n += 1
+                if n == limit:
+                    return
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._killed:
+            raise StopIteration
+        if self._it is None:
+            self._it = self._start()
+        if not self._buffer:
+            self._buffer.extend(islice(self._it, self._batch_size or 1))
+            if not self._buffer:
+                self._killed = True
+                raise StopIteration
+        doc = self._buffer.popleft()
+        if doc is not PAUSE:
+            self._retrieved += 1
+        return doc
+
+    next = __next__
+
+    def __getitem__(self, index):
+        self._check_okay_to_chain()
+        if isinstance(index, slice):
+            if index.step is not None:
+                raise IndexError('Cursor instances do not support slice steps')
+            start = index.start or 0
+            self._skip += start
+            if index.stop is not None:
+                if index.stop < start:
+                    raise IndexError('stop index must be greater than start index for slice')
+                self._limit = index.stop - start
+            return self
+        if index < 0:
+            raise IndexError('Cursor instances do not support negative indices')
+        clone = self.clone()
+        clone._skip += index
+        clone._limit = -1
+        for doc in clone:
+            return doc
+        raise IndexError('no such item for Cursor instance')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def alive(self):
+        return not self._killed
+
+    @property
+    def retrieved(self):
+        return self._retrieved
+
+    def clone(self):
+        return MockCursor(self.collection, self._filter, self._projection, skip=self._skip,
+                          limit=self._limit, sort=self._sort, batch_size=self._batch_size)
+
+    def rewind(self):
+        self._it = None
+        self._buffer.clear()
+        self._retrieved = 0
+        self._killed = False
+        return self
+
+    def close(self):
+        self._killed = True
+        if hasattr(self._it, 'close'):
+            self._it.close()
+        self._it = None
+        self._buffer.clear()
+
+    def explain(self):
+        stats = OpStats('query', self._filter)
+        start = perf_counter()
+        returned = sum(1 for _ in self.clone()._execute(stats))
+        millis = int((perf_counter() - start) * 1000)
+        plan = stats.winning_plan()
+        if self._sort and not stats.ordered:
+            plan = {'stage': 'SORT', 'sortPattern': dict(self._sort), 'inputStage': plan}
+            if self._limit:
+                plan['limitAmount'] = abs(self._limit)
+        elif self._limit:
+            plan = {'stage': 'LIMIT', 'limitAmount': abs(self._limit), 'inputStage': plan}
+        if self._skip:
+            plan = {'stage': 'SKIP', 'skipAmount': self._skip, 'inputStage': plan}
+        return {
+            'queryPlanner': {
+                'namespace': self.collection.full_name,
+                'parsedQuery': self._filter or {},
+                'winningPlan': plan,
+                'rejectedPlans': [],
+            },
+            'executionStats': {
+                'executionSuccess': True,
+                'nReturned': returned,
+                'executionTimeMillis': millis,
+                'totalKeysExamined': stats.keys_examined,
+                'totalDocsExamined': stats.docs_examined,
+            },
+            'ok': 1.0,
+        }
+
+    def count(self, with_limit_and_skip=False):
+        if not with_limit_and_skip:
+            return self.collection.count_documents(self._filter)
+        return sum(1 for _ in self.clone()._execute())
+
+    def to_list(self, length=None):
+        return list(islice(self, length))
+
+
 class MockMongoClient:
-    def __init__(self, uri, directConnection=False):
-        self.db = MockDatabase()
+    def __init__(self, uri, directConnection=False, thread_safe=False, read_mode=REFERENCE):
+        self.db = MockDatabase(thread_safe=thread_safe, read_mode=read_mode)
+        self.db.client = self
+        self.thread_safe = thread_safe
+        self.read_mode = read_mode
         self.uri = uri
         self.is_primary = True
         self.databases = {}
         self.directConnection = directConnection
+        self.profiler = None
+        self.recorder = None
+        self.oplog = None
+
+    def enable_profiling(self, capacity=1000):
+        ''' profile every database of this client into one shared MockProfiler '''
+        self.profiler = MockProfiler(capacity)
+        for db in [self.db, *self.databases.values()]:
+            db.profiler = self.profiler
+        return self.profiler
+
+    def disable_profiling(self):
+        self.profiler = None
+        for db in [self.db, *self.databases.values()]:
+            db.profiler = None
+
+    def enable_recording(self, out):
+        ''' journal the operations on every database of this client into one MockRecorder '''
+        self.recorder = MockRecorder(out)
+        for db in [self.db, *self.databases.values()]:
+            db.recorder = self.recorder
+        return self.recorder
+
+    def disable_recording(self):
+        if self.recorder is not None:
+            self.recorder.close()
+        self.recorder = None
+        for db in [self.db, *self.databases.values()]:
+            db.recorder = None
 
     def get_default_database(self):
         return self.db
 
+    _top = MockBase._top
+    enable_oplog = MockBase.enable_oplog
+    _changes = MockBase._changes
+
+    def watch(self, pipeline=None, full_document=None, resume_after=None, max_await_time_ms=None,
+              start_at_operation_time=None, start_after=None, **kwargs):
+        ''' changes to every database of this client '''
+        return MockChangeStream(self._changes(), None, None, pipeline, full_document,
+                                resume_after=resume_after, start_after=start_after,
+                                start_at_operation_time=start_at_operation_time,
+                                max_await_time_ms=max_await_time_ms)
+
+    def snapshot(self):
+        return ClientSnapshot(self.db.snapshot(),
+                              {name: (db, db.snapshot()) for name, db in self.databases.items()})
+
+    def restore(self, snapshot):
+        self.db.restore(snapshot.db)
+        self.databases = {}
+        for name, (db, db_snapshot) in snapshot.databases.items():
+            db.restore(db_snapshot)
+            self.databases[name] = db
+
+    def fork(self):
+        ''' client with its own databases, sharing unchanged documents with this one '''
+        ret = copy(self)
+        ret.oplog = None
+        ret.db = self.db.fork()
+        ret.databases = {name: db.fork() for name, db in self.databases.items()}
+        for db in [ret.db, *ret.databases.values()]:
+            db.client = ret
+        return ret
+
     def get_database(self):
         return self.db
 
     def __getitem__(self, key):
         if key not in self.databases:
-            db = MockDatabase()
+            db = MockDatabase(thread_safe=self.thread_safe, read_mode=self.read_mode)
+            db.client = self
+            db.name = key
+            db.profiler = self.profiler
+            db.recorder = self.recorder
             self.databases[key] = db
         return self.databases[key]
 
@@ -108,149 +531,1005 @@ def equals(x, y):
         and all([y[k] == x.get(k) for k in y.keys() if k != '_id'])
 
 
-def fix_date(doc):
-    if isinstance(doc, dict):
-        ret = dict()
-        for k, v in doc.items():
-            ret[k] = fix_date(v)
+def bson_size(doc):
+    ''' encoded size of doc, its repr length for what bson cannot encode '''
+    try:
+        return len(bson.encode(doc))
+    except InvalidDocument:
+        return len(repr(doc))
+
+
+class Cap:
+    ''' limits of a capped collection, or the buffer_size of an ingest one, and the size of its
+    documents, oldest first. A capped collection measures every document as it changes. A buffer
+    measures them once the ones not measured yet, at the average size of the others, may not fit;
+    until then a changed document counts at its old size '''
+    def __init__(self, size=None, max=None, capped=True):
+        self.size = size
+        self.max = max
+        self.capped = capped
+        self._total = 0
+        self._measured = 0
+        # id_key -> (size or None before the first measure, insertion number)
+        self.sizes = {}
+        # id_key -> document of a buffer changed since it was last measured
+        self.pending = {}
+        self.order = deque()
+        self._inserted = 0
+
+    def clone(self):
+        ret = copy(self)
+        ret.sizes = dict(self.sizes)
+        ret.pending = dict(self.pending)
+        ret.order = deque(self.order)
         return ret
-    if isinstance(doc, datetime) and doc.tzinfo is not None:
-        return doc.astimezone(tz=timezone.utc).replace(tzinfo=None)
 
-    return doc
+    @property
+    def total(self):
+        while self.pending:
+            self._measure(*self.pending.popitem())
+        return self._total
+
+    def _measure(self, id_key, doc):
+        old, inserted = self.sizes[id_key]
+        size = bson_size(doc)
+        self.sizes[id_key] = (size, inserted)
+        self._total += size - (old or 0)
+        self._measured += old is None
+
+    def add(self, id_key, doc):
+        self._inserted += 1
+        self.sizes[id_key] = (None, self._inserted)
+        self.order.append((self._inserted, id_key))
+        if self.capped or not self._measured:
+            self._measure(id_key, doc)
+        else:
+            self.pending[id_key] = doc
+
+    def resize(self, id_key, doc):
+        ''' doc changed, keeping its place in insertion order '''
+        if self.capped:
+            self._measure(id_key, doc)
+        else:
+            self.pending[id_key] = doc
+
+    def remove(self, id_key):
+        size, _ = self.sizes.pop(id_key)
+        self.pending.pop(id_key, None)
+        if size is not None:
+            self._total -= size
+            self._measured -= 1
+        if len(self.order) > 2 * len(self.sizes) + 64:
+            # drop the entries of documents deleted out of order
+            self.order = deque(sorted((n, k) for k, (_, n) in self.sizes.items()))
+
+    def full(self, count):
+        if self.max is not None and count > self.max:
+            return True
+        if self.size is None:
+            return False
+        if self.pending:
+            unmeasured = len(self.sizes) - self._measured
+            if not self._measured or self._total * (1 + unmeasured / self._measured) > self.size:
+                return self.total > self.size
+        return self._total > self.size
+
+    def oldest(self):
+        while True:
+            inserted, id_key = self.order[0]
+            entry = self.sizes.get(id_key)
+            if entry is not None and entry[1] == inserted:
+                return id_key
+            self.order.popleft()
+
+
+class DocumentsView(Sequence):
+    ''' read only, insertion ordered view of the documents of a collection '''
+    def __init__(self, docs):
+        self._docs = docs
+
+    def __len__(self):
+        return len(self._docs)
+
+    def __iter__(self):
+        return iter(self._docs.values())
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self._docs.values())[index]
+        if index < 0:
+            index += len(self._docs)
+        if not 0 <= index < len(self._docs):
+            raise IndexError('document index out of range')
+        return next(islice(self._docs.values(), index, None))
+
+    def __eq__(self, other):
+        if isinstance(other, (list, tuple, DocumentsView)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+class CollectionSnapshot:
+    def __init__(self, docs, indexes, children, cap=None):
+        self.docs = docs
+        self.indexes = indexes
+        self.children = children
+        self.cap = cap
+
+
+class DatabaseSnapshot:
+    def __init__(self, collections, gid, system):
+        self.collections = collections
+        self.gid = gid
+        self.system = system
+
+
+class ClientSnapshot:
+    def __init__(self, db, databases):
+        self.db = db
+        self.databases = databases
 
 
 class MockCollection(MockBase):
-    def __init__(self, data=None):
+    def __init__(self, data=None, thread_safe=False, read_mode=REFERENCE):
         self.db = None
-        self.data = [add_id(d) for d in data or []]
+        self.name = None
+        self._docs = {}
+        self._indexes = {}
+        self._shared = False
+        self._cow = None
+        self._cap = None
+        self._local = threading.local()
+        self._lock = None
+        self.data = data
+        self.thread_safe = thread_safe
+        self.read_mode = read_mode
         super().__init__()
 
+    @property
+    def read_mode(self):
+        return self._read_mode
+
+    @read_mode.setter
+    def read_mode(self, value):
+        ''' reads return the stored documents (reference), deep copies of them (copy) or read only
+        views of them (readonly) '''
+        if value not in READ_MODES:
+            raise ValueError(f'read_mode must be one of {", ".join(READ_MODES)}')
+        self._read_mode = value
+
+    def _reader(self, projection=None):
+        return reader(self._read_mode, projection)
+
+    @property
+    def thread_safe(self):
+        return self._lock is not None
+
+    @thread_safe.setter
+    def thread_safe(self, value):
+        ''' in thread safe mode readers share a lock, writers hold it alone and never change
+        a document a reader may be looking at: updates swap in an updated copy '''
+        self._lock = RWLock() if value else None
+
+    def _top(self):
+        return self.db._top() if self.db is not None else self
+
+    def watch(self, pipeline=None, full_document=None, resume_after=None, max_await_time_ms=None,
+              start_at_operation_time=None, start_after=None, **kwargs):
+        ''' changes to this collection, recorded from the first watch() or enable_oplog() on '''
+        return MockChangeStream(self._changes(), self.db.name if self.db is not None else None,
+                                self.name, pipeline, full_document,
+                                resume_after=resume_after, start_after=start_after,
+                                start_at_operation_time=start_at_operation_time,
+                                max_await_time_ms=max_await_time_ms)
+
+    def contention(self):
+        ''' lock acquisitions and how many of them had to wait, empty unless thread safe '''
+        return dict(self._lock.stats) if self._lock is not None else {}
+
+    @property
+    def _op(self):
+        ''' stats of the profiled operation running in this thread '''
+        return getattr(self._local, 'op', None)
+
+    @_op.setter
+    def _op(self, stats):
+        self._local.op = stats
+
+    def _read(self, func, *args):
+        ''' func run under the read lock, enough to pick the candidates of a lazy read '''
+        if self._lock is None:
+            return func(*args)
+        with self._lock.reading():
+            return func(*args)
+
+    @property
+    def data(self):
+        return DocumentsView(self._docs)
+
+    @data.setter
+    def data(self, docs):
+        self._docs = {}
+        self._indexes = {name: index.clone(empty=True) for name, index in self._indexes.items()}
+        self._shared = False
+        self._cow = None
+        if self._cap is not None:
+            self._cap = Cap(self._cap.size, self._cap.max, self._cap.capped)
+        for d in docs or []:
+            self._append(add_id(d))
+
+    def _children(self):
+        ''' collections snapshotted and forked along with this one '''
+        return {}
+
+    @locked(write=True)
+    def snapshot(self):
+        ''' O(1) snapshot, documents are copied lazily by whichever side writes first '''
+        self._shared = True
+        self._cow = set()
+        return CollectionSnapshot(self._docs, dict(self._indexes),
+                                  {name: c.snapshot() for name, c in self._children().items()},
+                                  self._cap)
+
+    @locked(write=True)
+    def restore(self, snapshot):
+        self._docs = snapshot.docs
+        self._indexes = dict(snapshot.indexes)
+        self._cap = snapshot.cap
+        self._shared = True
+        self._cow = set()
+        for name, child in self._children().items():
+            child.restore(snapshot.children[name])
+
+    def fork(self):
+        ''' independent copy sharing unchanged documents with this collection '''
+        snapshot = self.snapshot()
+        ret = copy(self)
+        for name, child in self._children().items():
+            setattr(ret, name, copy(child))
+        for c in [ret, *ret._children().values()]:
+            c._local = threading.local()
+            c.thread_safe = c.thread_safe
+        ret.restore(snapshot)
+        return ret
+
+    def _unshare(self):
+        if self._shared:
+            self._docs = dict(self._docs)
+            self._indexes = {name: index.clone() for name, index in self._indexes.items()}
+            if self._cap is not None:
+                self._cap = self._cap.clone()
+            self._shared = False
+
+    def _own(self, doc):
+        ''' doc, copied first if it is still shared with a snapshot '''
+        if self._cow is None:
+            return doc
+        id_key = hashable(doc['_id'])
+        if id_key not in self._cow:
+            self._unshare()
+            doc = self._docs[id_key] = deepcopy(doc)
+            self._cow.add(id_key)
+        return doc
+
+    def _append(self, doc):
+        self._unshare()
+        id_key = hashable(doc['_id'])
+        if self._docs.setdefault(id_key, doc) is not doc:
+            return
+        if self._cow is not None:
+            self._cow.add(id_key)
+        for index in self._indexes.values():
+            index.add(doc, id_key)
+        if self._cap is not None:
+            self._cap.add(id_key, doc)
+            self._evict()
+
+    def _evict(self):
+        ''' drop the oldest documents until a capped collection fits its limits again '''
+        cap = self._cap
+        while len(self._docs) > 1 and cap.full(len(self._docs)):
+            id_key = cap.oldest()
+            doc = self._docs.pop(id_key)
+            for index in self._indexes.values():
+                index.remove(doc, id_key)
+            cap.remove(id_key)
+
+    def _remove(self, doc):
+        self._unshare()
+        id_key = hashable(doc['_id'])
+        del self._docs[id_key]
+        for index in self._indexes.values():
+            index.remove(doc, id_key)
+        if self._cap is not None:
+            self._cap.remove(id_key)
+        oplog = self._top().oplog
+        if oplog is not None:
+            oplog.append(self, 'delete', doc['_id'])
+
+    def _replace(self, doc, new):
+        ''' swap doc for new in place, keeping its _id and position '''
+        if '_id' in new and new['_id'] != doc['_id']:
+            raise WriteError('After applying the update, the (immutable) field \'_id\' '
+                             'was found to have been altered', 66)
+        new = {'_id': doc['_id'], **fix_date(new)}
+        id_key = hashable(doc['_id'])
+        self._unshare()
+        for index in self._indexes.values():
+            index.remove(doc, id_key)
+        try:
+            for index in self._indexes.values():
+                index.check(new, id_key)
+        except DuplicateKeyError:
+            for index in self._indexes.values():
+                index.add(doc, id_key)
+            raise
+        for index in self._indexes.values():
+            index.add(new, id_key)
+        self._docs[id_key] = new
+        if self._cow is not None:
+            self._cow.add(id_key)
+        if self._cap is not None:
+            self._cap.resize(id_key, new)
+            self._evict()
+        oplog = self._top().oplog
+        if oplog is not None:
+            oplog.append(self, 'replace', new['_id'], fullDocument=deepcopy(new))
+        return new
+
+    def _scan(self):
+        ''' all documents, tolerating writes while the scan is suspended '''
+        for id_key in list(self._docs):
+            doc = self._docs.get(id_key)
+            if doc is not None:
+                yield doc
+
+    def _candidates(self, _filter, stats=None):
+        ''' documents that may match _filter, narrowed by an index when possible '''
+        return self._ordered_candidates(_filter, None, stats)[0]
+
+    def _ordered_candidates(self, _filter, sort, stats=None):
+        ''' (documents that may match _filter, whether they already come in sort order) '''
+        eq = equalities(_filter)
+        if '_id' in eq:
+            docs = (self._docs.get(hashable(v)) for v in eq['_id'])
+            if stats is not None:
+                stats.plan('IDHACK', keys=len(eq['_id']))
+            return list({id(d): d for d in docs if d is not None}.values()), False
+        choice = plan(self._indexes.values(), eq, ranges(_filter), sort)
+        if choice is None:
+            if stats is not None:
+                stats.plan('COLLSCAN')
+            return self._scan(), False
+        index, p, bounds, reverse = choice
+        prefixes = product(*[eq[f] for f in index.fields[:p]])
+        if reverse is not None:
+            if stats is not None:
+                stats.plan('IXSCAN', index)
+                stats.ordered = True
+            return self._index_order(index, next(prefixes), bounds, reverse, stats), True
+        id_keys = {}
+        for prefix in prefixes:
+            if p == len(index.fields):
+                id_keys.update(index.lookup(prefix))
+            else:
+                for bucket in index.scan(prefix, bounds):
+                    id_keys.update(dict.fromkeys(bucket))
+        if stats is not None:
+            stats.plan('IXSCAN', index, keys=len(id_keys))
+        docs = (self._docs.get(k) for k in id_keys)
+        return [d for d in docs if d is not None], False
+
+    def _index_order(self, index, prefix, bounds, reverse, stats):
+        ''' documents in the order of an index scan, read as the consumer asks for them '''
+        for bucket in index.scan(prefix, bounds, reverse):
+            if stats is not None:
+                stats.keys_examined += len(bucket)
+            for id_key in bucket:
+                doc = self._docs.get(id_key)
+                if doc is not None:
+                    yield doc
+
+    def _select(self, _filter, stats=None):
+        return self._select_ordered(_filter, None, stats)[0]
+
+    def _select_ordered(self, _filter, sort, stats=None, pace=0):
+        ''' (documents matching _filter, whether they already come in sort order), with a PAUSE
+        after every pace candidates examined when pace is set '''
+        stats = stats or self._op
+        predicate = compile_filter(_filter)
+        candidates, ordered = self._ordered_candidates(_filter, sort, stats)
+        if pace:
+            candidates, match = _paced(candidates, pace), predicate
+
+            def predicate(doc):
+                return doc is PAUSE or match(doc)
+        if stats is None:
+            return (e for e in candidates if predicate(e)), ordered
+        if stats.filter is None:
+            stats.filter = _filter
+        return self._counted(candidates, predicate, stats), ordered
+
+    @staticmethod
+    def _counted(candidates, predicate, stats):
+        for doc in candidates:
+            if doc is PAUSE:
+                yield doc
+                continue
+            stats.docs_examined += 1
+            if predicate(doc):
+                stats.returned += 1
+                yield doc
+
+    def _profiler(self):
+        if self.profiler is not None:
+            return self.profiler
+        return self.db.profiler if self.db is not None else None
+
+    def _recorder(self):
+        if self.recorder is not None:
+            return self.recorder
+        return self.db.recorder if self.db is not None else None
+
+    def _recorded(self, it, stats, profiler, start, call=None):
+        ''' iterate it, timing the work done for each document and recording stats when done,
+        call is the (recorder, method, arguments) to journal it as, started at start '''
+        n = 0
+        try:
+            while True:
+                start = perf_counter()
+                try:
+                    doc = next(it)
+                except StopIteration:
+                    return
+                finally:
+                    stats.micros += (perf_counter() - start) * 1e6
+                n += doc is not PAUSE
+                yield doc
+        finally:
+            stats.returned = n
+            if profiler is not None:
+                profiler.record(self.full_name, stats)
+            if call is not None:
+                recorder, op, arguments = call
+                recorder.record(self, op, arguments, n, stats.micros, start)
+
+    @property
+    def full_name(self):
+        db_name = self.db.name if self.db is not None else None
+        return f'{db_name}.{self.name}'
+
+    def _update_doc(self, doc, updater):
+        if self._lock is not None or self._top().oplog is not None:
+            return self._swap_update(doc, updater)
+        doc = self._own(doc)
+        self._unshare()
+        indexes = [index for index in self._indexes.values() if updater.touches(index.fields)]
+        if not indexes:
+            return self._resized(doc, updater(doc))
+        id_key = hashable(doc['_id'])
+        before = deepcopy(doc) if any(index.unique for index in indexes) else None
+        for index in indexes:
+            index.remove(doc, id_key)
+        try:
+            modified = updater(doc)
+            for index in indexes:
+                index.check(doc, id_key)
+        except Exception:
+            if before is not None:
+                doc.clear()
+                doc.update(before)
+            raise
+        finally:
+            for index in indexes:
+                index.add(doc, id_key)
+        return self._resized(doc, modified)
+
+    def _resized(self, doc, modified):
+        ''' int(modified), after accounting for the new size of doc updated in place '''
+        if modified and self._cap is not None:
+            self._cap.resize(hashable(doc['_id']), doc)
+            self._evict()
+        return int(modified)
+
+    def _swap_update(self, doc, updater):
+        ''' update a copy of doc and swap it in, concurrent readers see either version whole '''
+        new = deepcopy(doc)
+        if not updater(new):
+            return 0
+        id_key = hashable(doc['_id'])
+        self._unshare()
+        indexes = [index for index in self._indexes.values() if updater.touches(index.fields)]
+        for index in indexes:
+            index.remove(doc, id_key)
+        try:
+            for index in indexes:
+                index.check(new, id_key)
+        except DuplicateKeyError:
+            for index in indexes:
+                index.add(doc, id_key)
+            raise
+        for index in indexes:
+            index.add(new, id_key)
+        self._docs[id_key] = new
+        if self._cow is not None:
+            self._cow.add(id_key)
+        if self._cap is not None:
+            self._cap.resize(id_key, new)
+            self._evict()
+        oplog = self._top().oplog
+        if oplog is not None:
+            oplog.append(self, 'update', new['_id'], updateDescription=update_description(doc, new))
+        return 1
+
     @maybe_raise
-    def find_one(self, _filter=None):
-        return next((e for e in self.data if match(e, _filter)), None)
+    @profiled('query')
+    @locked(write=False)
+    def find_one(self, _filter=None, projection=None, **kwargs):
+        if kwargs:
+            return next(self.find(_filter, projection, limit=-1, **kwargs), None)
+        return self._returned(next(self._select(_filter), None), projection)
 
     @maybe_raise
-    def find(self, _filter=None):
-        return [e for e in self.data if match(e, _filter)]
+    def find(self, _filter=None, projection=None, *, skip=0, limit=0, sort=None, batch_size=0):
+        return MockCursor(self, _filter, projection, skip=skip, limit=limit, sort=sort,
+                          batch_size=batch_size)
 
+    @profiled('insert')
+    @locked(write=True)
     def insert_one(self, doc):
         doc = add_id(fix_date(doc))
         self._check_duplicate(doc)
-        self.data.append(doc)
+        self._append(doc)
+        oplog = self._top().oplog
+        if oplog is not None:
+            oplog.append(self, 'insert', doc['_id'], fullDocument=deepcopy(doc))
         return InsertOneResult(doc['_id'])
 
-    def update_one(self, _filter, update_doc):
-        doc = self.find_one(_filter)
+    @profiled('update')
+    @locked(write=True)
+    def update_one(self, _filter, update_doc, upsert=False):
+        updater = compile_update(update_doc)
+        doc = self._find_one_for_write(_filter)
         matched = 0 if doc is None else 1
         modified = 0
         if doc:
-            modified += update(doc, update_doc)
-        else:
-            modified = 0
+            modified += self._update_doc(doc, updater)
+        elif upsert:
+            return self._upsert(_filter, updater)
         return UpdateResult(matched=matched, modified=modified)
 
+    @profiled('update')
+    @locked(write=True)
     def update_many(self, _filter, update_doc, upsert=False):
+        updater = compile_update(update_doc)
         modified = 0
         matched = 0
-        upserted = 0
-
-        to_update = self.find(_filter)
-        if to_update:
-            for doc in to_update:
-                if doc:
-                    matched += 1
-                    modified += update(doc, update_doc)
-                else:
-                    modified = 0
+
+        to_update = list(self._select(_filter))
+        for doc in to_update:
+            matched += 1
+            modified += self._update_doc(doc, updater)
 
         if not to_update and upsert:
-            set_doc = update_doc.get('$set', None)
-            update_doc = set_doc if set_doc else update_doc
-            upserted = 1
-            self.insert_one({**update_doc, **_filter})
+            return self._upsert(_filter, updater)
+        return UpdateResult(matched=matched, modified=modified)
 
-        return UpdateResult(matched=matched, modified=modified, upserted=upserted)
+    def _upsert(self, _filter, updater):
+        result = UpdateResult(upserted=1)
+        result.upserted_id = self.insert_one(upsert_document(_filter, updater)).inserted_id
+        return result
 
-    @maybe_raise
-    def insert_many(self, docs, **kwargs):
-        docs_with_id = [add_id(fix_date(d)) for d in docs or []]
-        ordered = kwargs['ordered'] if 'ordered' in kwargs else True
-        success = True
-        results = {
-            'nInserted': 0,
-            'nMatched': 0,
-            'nModified': 0,
-            'nRemoved': 0,
-            'nUpserted': 0,
-            'writeConcernErrors': [],
-            'writeErrors': []
-        }
-        for doc in docs_with_id:
+    def _insert_batch(self, docs, results, ordered, first=0):
+        ''' insert docs in one pass, recording duplicates as bulk write errors '''
+        oplog = self._top().oplog
+        for i, doc in enumerate(docs, first):
             try:
                 self._check_duplicate(doc)
-                self.data.append(doc)
-                results['nInserted'] += 1
-            except DuplicateKeyError:
-                success = False
+            except DuplicateKeyError as e:
+                results['writeErrors'].append(write_error(i, e, doc))
                 if ordered:
-                    raise BulkWriteError(results)
-                else:
-                    continue
-        if success:
-            return InsertManyResult([d['_id'] for d in docs_with_id])
-        else:
+                    return False
+                continue
+            self._append(doc)
+            results['nInserted'] += 1
+            if oplog is not None:
+                oplog.append(self, 'insert', doc['_id'], fullDocument=deepcopy(doc))
+        return True
+
+    @maybe_raise
+    @profiled('insert')
+    @locked(write=True)
+    def insert_many(self, docs, ordered=True, **kwargs):
+        docs_with_id = [add_id(fix_date(d)) for d in docs or []]
+        results = bulk_results()
+        self._insert_batch(docs_with_id, results, ordered)
+        if results['writeErrors']:
             raise BulkWriteError(results)
+        return InsertManyResult([d['_id'] for d in docs_with_id])
+
+    def _write_op(self, op, i, results):
+        if isinstance(op, (DeleteOne, DeleteMany)):
+            delete = self.delete_one if isinstance(op, DeleteOne) else self.delete_many
+            results['nRemoved'] += delete(op._filter).deleted_count
+            return
+        upsert = getattr(op, '_upsert', False)
+        if isinstance(op, ReplaceOne):
+            result = self.replace_one(op._filter, op._doc, upsert=upsert)
+        elif isinstance(op, UpdateMany):
+            result = self.update_many(op._filter, op._doc, upsert=upsert)
+        else:
+            result = self.update_one(op._filter, op._doc, upsert=upsert)
+        results['nMatched'] += result.matched_count
+        results['nModified'] += result.modified_count
+        if result.upsert_count:
+            results['nUpserted'] += 1
+            results['upserted'].append({'index': i, '_id': result.upserted_id})
 
-    def bulk_write(self, cmds, ordered=False):
-        for cmd in cmds:
-            out = self.update_one(cmd._filter, cmd._doc)
-            if not out.modified_count:
-                self.insert_one(cmd._doc['$set'])
+    @maybe_raise
+    @profiled('bulk')
+    @locked(write=True)
+    def bulk_write(self, requests, ordered=True, **kwargs):
+        results = bulk_results()
+        requests = list(requests)
+        i = 0
+        while i < len(requests):
+            if isinstance(requests[i], InsertOne):
+                # consecutive inserts go through one batched pass
+                end = i
+                while end < len(requests) and isinstance(requests[end], InsertOne):
+                    end += 1
+                docs = [add_id(fix_date(op._doc)) for op in requests[i:end]]
+                if not self._insert_batch(docs, results, ordered, first=i):
+                    break
+                i = end
+                continue
+            try:
+                self._write_op(requests[i], i, results)
+            except (DuplicateKeyError, WriteError, InvalidOperation, OperationFailure) as e:
+                results['writeErrors'].append(write_error(i, e, requests[i]._doc
+                                                          if hasattr(requests[i], '_doc')
+                                                          else requests[i]._filter))
+                if ordered:
+                    break
+            i += 1
+        if results['writeErrors']:
+            raise BulkWriteError(results)
+        return BulkWriteResult(results)
 
+    @profiled('remove')
+    @locked(write=True)
     def delete_one(self, _filter):
-        e = self.find_one(_filter)
+        e = self._find_one_for_write(_filter)
         if e:
-            self.data.remove(e)
+            self._remove(e)
         return DeleteResult(1 if e else 0)
 
+    @profiled('remove')
+    @locked(write=True)
+    def delete_many(self, _filter):
+        docs = list(self._select(_filter))
+        for doc in docs:
+            self._remove(doc)
+        return DeleteResult(len(docs))
+
+    @profiled('update')
+    @locked(write=True)
     def replace_one(self, old, new, upsert=False):
         ret = UpdateResult()
-        o = self.find_one(old)
+        o = self._find_one_for_write(old)
         ret.matched_count = 0 if o is None else 1
         if not equals(o, new):
-            d = self.delete_one(old)
-            ret.modified_count = d.deleted_count
-            if d.deleted_count == 1 or upsert:
-                doc = add_id(fix_date(new))
-                self.insert_one(doc)
-                ret.upserted_id = doc['_id']
+            if o is not None:
+                ret.upserted_id = self._replace(o, new)['_id']
+                ret.modified_count = 1
+            elif upsert:
+                ret.upserted_id = self.insert_one(self._upsert_doc(old, new)).inserted_id
+                ret.upsert_count = 1
         return ret
 
+    @staticmethod
+    def _upsert_doc(_filter, doc):
+        ''' an upserted replacement takes its _id from an equality in the filter '''
+        ids = equalities(_filter).get('_id')
+        if '_id' not in doc and ids and len(ids) == 1:
+            return {'_id': ids[0], **doc}
+        return doc
+
+    def _find_one_for_write(self, _filter, sort=None):
+        ''' the stored document a write applies to, whatever the read mode '''
+        if sort:
+            return next(self.find(_filter, sort=sort, limit=-1)._execute(), None)
+        return next(self._select(_filter), None)
+
+    def _returned(self, doc, projection=None):
+        ''' doc as a read returns it '''
+        output = self._reader(projection)
+        return doc if doc is None or output is None else output(doc)
+
+    @maybe_raise
+    @profiled('findAndModify')
+    @locked(write=True)
+    def find_one_and_delete(self, _filter, projection=None, sort=None, **kwargs):
+        doc = self._find_one_for_write(_filter, sort)
+        if doc is not None:
+            self._remove(doc)
+        return self._returned(doc, projection)
+
+    @maybe_raise
+    @profiled('findAndModify')
+    @locked(write=True)
+    def find_one_and_replace(self, _filter, replacement, projection=None, sort=None,
+                             upsert=False, return_document=ReturnDocument.BEFORE, **kwargs):
+        doc = self._find_one_for_write(_filter, sort)
+        if doc is None:
+            if not upsert:
+                return None
+            new = self.insert_one(self._upsert_doc(_filter, replacement)).inserted_id
+            new = self._find_one_for_write({'_id': new})
+            return self._returned(new, projection) if return_document else None
+        new = self._replace(doc, replacement)
+        return self._returned(new if return_document else doc, projection)
+
+    @maybe_raise
+    @profiled('findAndModify')
+    @locked(write=True)
+    def find_one_and_update(self, _filter, update_doc, projection=None, sort=None,
+                            upsert=False, return_document=ReturnDocument.BEFORE, **kwargs):
+        doc = self._find_one_for_write(_filter, sort)
+        if doc is None:
+            if not upsert:
+                return None
+            result = self.update_many(_filter, update_doc, upsert=True)
+            upserted = result.upserted_id
+            new = self._find_one_for_write({'_id': upserted}) if upserted is not None else None
+            return self._returned(new, projection) if return_document else None
+        doc = self._own(doc)
+        before = None if return_document else deepcopy(doc)
+        self._update_doc(doc, compile_update(update_doc))
+        if return_document:
+            doc = self._docs[hashable(doc['_id'])]
+        return self._returned(doc if return_document else before, projection)
+
+    @profiled('count')
+    @locked(write=False)
     def count(self, _filter=None):
-        return len(self.find(_filter))
+        n = self._fast_count(_filter)
+        if n is not None:
+            return n
+        return sum(1 for _ in self._select(_filter))
+
+    def _fast_count(self, _filter):
+        ''' count of an empty or single equality filter answered from metadata, None otherwise '''
+        stats = self._op
+        if stats is not None and stats.filter is None:
+            stats.filter = _filter
+        if not _filter:
+            if stats is not None:
+                stats.plan('RECORD_STORE_FAST_COUNT')
+            return len(self._docs)
+        if len(_filter) != 1:
+            return None
+        (field, value), = _filter.items()
+        if field.startswith('$'):
+            return None
+        if is_operator(value):
+            if list(value) != ['$eq']:
+                return None
+            value = value['$eq']
+        # these match more than the documents indexed under them
+        if value is None or isinstance(value, (dict, list, tuple, re.Pattern, Regex)):
+            return None
+        if field == '_id':
+            if stats is not None:
+                stats.plan('IDHACK', keys=1)
+            return int(hashable(value) in self._docs)
+        for index in self._indexes.values():
+            if index.fields == [field] and not index.sparse:
+                if stats is not None:
+                    stats.plan('COUNT_SCAN', index, keys=1)
+                return len(index.lookup([value]))
+        return None
+
+    @profiled('count')
+    @locked(write=False)
+    def estimated_document_count(self, **kwargs):
+        return self._fast_count(None)
 
-    def count_documents(self, _filter=None):
-        return self.count(_filter=_filter)
+    @maybe_raise
+    @profiled('command')
+    @locked(write=False)
+    def distinct(self, key, _filter=None, **kwargs):
+        ''' distinct values of key in the documents matching _filter, read from an index on key
+        when there is no filter and the index is not sparse, which would miss documents '''
+        index = None
+        if not _filter:
+            index = next((i for i in self._indexes.values()
+                          if i.fields[0] == key and not i.sparse), None)
+        if index is None:
+            values = {}
+            for doc in self._select(_filter):
+                for v in distinct_values(doc, key):
+                    values.setdefault(hashable(v), v)
+            values = values.values()
+        else:
+            values = self._distinct_from(index, key)
+        output = self._reader()
+        return list(values if output is None else map(output, values))
+
+    def _distinct_from(self, index, key):
+        ''' one value per distinct first key of index, found in a document under that key '''
+        stats = self._op
+        if stats is not None:
+            stats.plan('DISTINCT_SCAN', index)
+        values = []
+        for first, buckets in index.first_keys():
+            if stats is not None:
+                stats.keys_examined += 1
+            value = next((v for bucket in buckets for id_key in bucket
+                          for v in distinct_values(self._docs[id_key], key)
+                          if sort_key(v) == first), MISSING)
+            if value is not MISSING:
+                values.append(value)
+        return values
+
+    @locked(write=True)
+    def create_index(self, keys, unique=False, name=None, sparse=False, **kwargs):
+        keys = index_keys(keys)
+        name = name or index_name(keys)
+        if name == '_id_' or name in self._indexes:
+            return name
+        self._unshare()
+        index = SortedIndex(name, keys, unique=unique, sparse=sparse)
+        index.build(self._docs.items())
+        self._indexes[name] = index
+        return name
+
+    def create_indexes(self, indexes):
+        names = []
+        for model in indexes:
+            options = dict(model.document)
+            keys = list(options.pop('key').items())
+            names.append(self.create_index(keys, **options))
+        return names
+
+    @locked(write=True)
+    def drop_index(self, index_or_name):
+        name = index_or_name
+        if not isinstance(name, str):
+            name = index_name(index_keys(name))
+        if name == '_id_':
+            raise OperationFailure('cannot drop _id index')
+        if name not in self._indexes:
+            raise OperationFailure(f'index not found with name [{name}]')
+        self._unshare()
+        del self._indexes[name]
+
+    @locked(write=True)
+    def drop_indexes(self):
+        self._unshare()
+        self._indexes = {}
+
+    def index_information(self):
+        info = {'_id_': {'v': 2, 'key': [('_id', 1)]}}
+        for name, index in self._indexes.items():
+            info[name] = index.information()
+        return info
+
+    def list_indexes(self):
+        return iter([SON([('name', name), *info.items()])
+                     for name, info in self.index_information().items()])
+
+    @profiled('count')
+    @locked(write=False)
+    def count_documents(self, _filter=None, skip=0, limit=0, **kwargs):
+        n = max(0, self.count(_filter=_filter) - skip)
+        return min(n, abs(limit)) if limit else n
 
     def _check_duplicate(self, doc):
-        if self.find({'_id': doc['_id']}):
-            raise DuplicateKeyError('mock duplicate id: %s' % doc['_id'])
+        id_key = hashable(doc['_id'])
+        if id_key in self._docs:
+            raise DuplicateKeyError('mock duplicate id: %s' % doc['_id'], 11000)
+        for index in self._indexes.values():
+            index.check(doc, id_key)
 
     @maybe_raise
+    @locked(write=True)
     def clear(self):
         self.data = []
 
     @maybe_raise
-    def aggregate(self, pipeline):
-        # only support a single aggregate for now
-        assert pipeline == [{'$group': {
-            '_id': None,
-            'alldocs': {
-                '$push': '$$CURRENT'
-            }
-        }}]
-        return iter([{'_id': None, 'alldocs': self.find()}])
+    def aggregate(self, pipeline, explain=False, **kwargs):
+        if explain:
+            return self._explain_pipeline(pipeline)
+        profiler, recorder = self._profiler(), self._recorder()
+        # stages may pass stored documents through, so the output is read like a find's
+        output = self._reader()
+        if (profiler is None and recorder is None) or self._op is not None:
+            docs = self._read(run_pipeline, self, pipeline)
+            return docs if output is None else map(output, docs)
+        stats = OpStats('aggregate')
+        start = perf_counter()
+        call = None
+        if recorder is not None:
+            arguments = recorder.bind(MockCollection.aggregate, (pipeline,), kwargs)[2]
+            call = (recorder, 'aggregate', arguments)
+        docs = self._read(run_pipeline, self, pipeline, stats)
+        if output is not None:
+            docs = map(output, docs)
+        stats.micros = (perf_counter() - start) * 1e6
+        return self._recorded(docs, stats, profiler, start, call)
+
+    def _explain_pipeline(self, pipeline):
+        stats = OpStats('aggregate')
+        start = perf_counter()
+        returned = sum(1 for _ in run_pipeline(self, pipeline, stats))
+        leading_match = bool(pipeline) and '$match' in pipeline[0]
+        return {
+            'stages': [
+                {'$cursor': {
+                    'queryPlanner': {
+                        'namespace': self.full_name,
+                        'parsedQuery': pipeline[0]['$match'] if leading_match else {},
+                        'winningPlan': stats.winning_plan(),
+                        'rejectedPlans': [],
+                    },
+                    'executionStats': {
+                        'executionSuccess': True,
+                        'nReturned': returned,
+                        'executionTimeMillis': int((perf_counter() - start) * 1000),
+                        'totalKeysExamined': stats.keys_examined,
+                        'totalDocsExamined': stats.docs_examined,
+                    },
+                }},
+                *pipeline[1 if leading_match else 0:],
+            ],
+            'ok': 1.0,
+        }
+
+    @locked(write=True)
+    def cap(self, size=None, max=None):
+        ''' limit the collection to size bytes of bson and max documents, evicting the oldest '''
+        self._limit(Cap(size, max))
+
+    def _limit(self, cap):
+        self._unshare()
+        self._cap = cap
+        for id_key, doc in self._docs.items():
+            self._cap.add(id_key, doc)
+        self._evict()
+
+    def options(self):
+        if self._cap is None or not self._cap.capped:
+            return {}
+        options = {'capped': True, 'size': self._cap.size, 'max': self._cap.max}
+        return {k: v for k, v in options.items() if v is not None}
+
+    def stats(self, scale=1):
+        ''' collStats, with sizes estimated from the bson encoding of the documents '''
+        count = len(self._docs)
+        if self._cap is not None:
+            size = self._cap.total
+        else:
+            size = sum(bson_size(doc) for doc in list(self._docs.values()))
+        ret = {
+            'ns': self.full_name,
+            'count': count,
+            'size': size // scale,
+            'avgObjSize': size // count if count else 0,
+            'storageSize': size // scale,
+            'nindexes': len(self._indexes) + 1,
+            'capped': self._cap is not None and self._cap.capped,
+            'scaleFactor': scale,
+        }
+        if ret['capped']:
+            ret['max'] = self._cap.max or 0
+            ret['maxSize'] = (self._cap.size or 0) // scale
+        ret['ok'] = 1.0
+        return ret
 
     @maybe_raise
     def drop(self):
@@ -261,8 +1540,10 @@ class MockSystemCollection(MockCollection):
     def __init__(self, db, data=None):
         super().__init__(data)
         self.db = db
+        self.name = 'system'
         self.views = MockCollection()
         self.views.db = db
+        self.views.name = 'system.views'
         self.ingest = MockCollection([
             {
                 '_id': 'instance',
@@ -281,53 +1562,137 @@ class MockSystemCollection(MockCollection):
             }
         ])
         self.ingest.db = db
+        self.ingest.name = 'system.ingest'
+
+    def _children(self):
+        return {'views': self.views, 'ingest': self.ingest}
 
 
 class MockDatabase(MockBase):
-    def __init__(self):
+    def __init__(self, thread_safe=False, read_mode=REFERENCE):
+        self.client = None
         self.gid = MockGidCollection(self)
         self.system = MockSystemCollection(self)
         self.collections = {}
         self.return_from_next_command = None
         self.name = 'mock_db'
+        self.thread_safe = thread_safe
+        self.read_mode = read_mode
+        for c in [self.gid, self.system, *self.system._children().values()]:
+            c.thread_safe = thread_safe
+            c.read_mode = read_mode
         super().__init__()
 
     def __getitem__(self, key):
         if key not in self.collections:
-            c = MockCollection()
-            c.db = self
-            self.collections[key] = c
+            self._new_collection(key)
         return self.collections[key]
 
+    def _new_collection(self, name, capped=False, size=None, max=None):
+        ''' collections with an ingest configuration keep to its buffer_size, uncapped '''
+        c = MockCollection(thread_safe=self.thread_safe, read_mode=self.read_mode)
+        c.db = self
+        c.name = name
+        if capped:
+            if size is None:
+                raise OperationFailure('the \'size\' field is required when \'capped\' is true', 72)
+            c.cap(size, max)
+        else:
+            ingest = next(self.system.ingest._select({'_id': name}), None)
+            if ingest is not None and ingest.get('buffer_size'):
+                c._limit(Cap(ingest['buffer_size'], capped=False))
+        self.collections[name] = c
+        return c
+
     def __setitem__(self, key, value):
         value.db = self
+        value.name = key
         self.collections[key] = value
 
     def __getattr__(self, name):
         ''' immitate pymongo magic for collection names as attribute '''
+        if name.startswith('_'):
+            raise AttributeError(f'MockDatabase has no attribute {name!r}. '
+                                 f'To access the {name} collection, use database[{name!r}].')
         return self.__getitem__(name)
 
+    def _top(self):
+        return self.client if self.client is not None else self
+
+    def watch(self, pipeline=None, full_document=None, resume_after=None, max_await_time_ms=None,
+              start_at_operation_time=None, start_after=None, **kwargs):
+        ''' changes to every collection of this database '''
+        return MockChangeStream(self._changes(), self.name, None, pipeline, full_document,
+                                resume_after=resume_after, start_after=start_after,
+                                start_at_operation_time=start_at_operation_time,
+                                max_await_time_ms=max_await_time_ms)
+
+    def get_collection(self, name):
+        ''' collection by name, including gid and the system collections '''
+        for c in [self.gid, self.system, *self.system._children().values()]:
+            if c.name == name:
+                return c
+        return self[name]
+
+    def stats(self, scale=1):
+        ''' dbStats, summed over the collStats of the collections '''
+        stats = [c.stats() for c in self.collections.values()]
+        size = sum(s['size'] for s in stats)
+        objects = sum(s['count'] for s in stats)
+        return {
+            'db': self.name,
+            'collections': len(stats),
+            'objects': objects,
+            'avgObjSize': size // objects if objects else 0,
+            'dataSize': size // scale,
+            'storageSize': size // scale,
+            'indexes': sum(s['nindexes'] for s in stats),
+            'scaleFactor': scale,
+            'ok': 1.0,
+        }
+
     def collection_names(self):
         return self.collections.keys()
 
+    def snapshot(self):
+        return DatabaseSnapshot({name: (c, c.snapshot()) for name, c in self.collections.items()},
+                                self.gid.snapshot(), self.system.snapshot())
+
+    def restore(self, snapshot):
+        self.gid.restore(snapshot.gid)
+        self.system.restore(snapshot.system)
+        self.collections = {}
+        for name, (c, c_snapshot) in snapshot.collections.items():
+            c.restore(c_snapshot)
+            self.collections[name] = c
+
+    def fork(self):
+        ret = copy(self)
+        ret.gid = self.gid.fork()
+        ret.system = self.system.fork()
+        ret.collections = {name: c.fork() for name, c in self.collections.items()}
+        for c in [ret.gid, ret.system, *ret.system._children().values(), *ret.collections.values()]:
+            c.db = ret
+        return ret
+
     def list_collection_names(self):
         return self.collection_names()
     
-    def create_collection(self, name): 
-        c = MockCollection()
-        c.db = self
-        self.collections[name] = c
+    def create_collection(self, name, capped=False, size=None, max=None, **kwargs):
+        return self._new_collection(name, capped=capped, size=size, max=max)
     
     def drop_collection(self, collection):
-        name = None
         for name, c in self.collections.items():
-            if collection is c:
+            if collection is c or collection == name:
+                del self.collections[name]
+                oplog = self._top().oplog
+                if oplog is not None:
+                    oplog.append(c, 'drop', None)
                 break
-        if name:
-            del self.collections[name]
 
     @maybe_raise
-    def command(self, cmd):
+    def command(self, command, value=1, **kwargs):
+        cmd = SON([(command, value)], **kwargs) if isinstance(command, str) else command
         ret = None
         it = iter(cmd)
         sonar_command = next(it)
@@ -350,6 +1715,10 @@ class MockDatabase(MockBase):
             param = next(it)
             assert cmd[param] == 1
             ret = {'ok': 1, param: 0}
+        elif sonar_command == 'collStats':
+            ret = self.get_collection(cmd[sonar_command]).stats(cmd.get('scale', 1))
+        elif sonar_command == 'dbStats':
+            ret = self.stats(cmd.get('scale', 1))
 
         if ret is None:
             ret = self.return_from_next_command
@@ -373,3 +1742,6 @@ class MockGidCollection(MockCollection):
              'version': 10, 'current': True}
         ])
         self.db = db
+        self.name = 'gid'
+        self.create_index('gmachine_id')
+        self.create_index('hostname')
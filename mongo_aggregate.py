@@ -0,0 +1,394 @@
+import heapq
+import operator
+from datetime import datetime, timedelta
+from itertools import islice
+
+from pymongo.errors import OperationFailure
+
+from test.mock.mongo_query import MISSING, compile_filter, compile_projection, hashable, \
+    sort_key, sort_key_function, sort_spec
+
+
+def _path_value(value, parts):
+    ''' aggregation field path value, arrays of documents yield arrays of values '''
+    for i, part in enumerate(parts):
+        if isinstance(value, dict):
+            value = value.get(part, MISSING)
+        elif isinstance(value, list):
+            values = (_path_value(e, parts[i:]) for e in value if isinstance(e, dict))
+            return [v for v in values if v is not MISSING]
+        else:
+            return MISSING
+        if value is MISSING:
+            return MISSING
+    return value
+
+
+def _null(value):
+    return value is None or value is MISSING
+
+
+def _arithmetic(fn):
+    def op(*args):
+        if any(_null(a) for a in args):
+            return None
+        return fn(*args)
+    return op
+
+
+def _add(*args):
+    dates = [a for a in args if isinstance(a, datetime)]
+    total = sum(a for a in args if not isinstance(a, datetime))
+    if dates:
+        return dates[0] + timedelta(milliseconds=total)
+    return total
+
+
+def _subtract(a, b):
+    if isinstance(a, datetime) and isinstance(b, datetime):
+        return int((a - b) / timedelta(milliseconds=1))
+    if isinstance(a, datetime):
+        return a - timedelta(milliseconds=b)
+    return a - b
+
+
+def _multiply(*args):
+    ret = 1
+    for a in args:
+        ret *= a
+    return ret
+
+
+def _comparison(fn):
+    return lambda a, b: fn(sort_key(None if a is MISSING else a),
+                           sort_key(None if b is MISSING else b))
+
+
+def _cmp(a, b):
+    a, b = sort_key(None if a is MISSING else a), sort_key(None if b is MISSING else b)
+    return (a > b) - (a < b)
+
+
+def _size(value):
+    if not isinstance(value, list):
+        raise OperationFailure('The argument to $size must be an array')
+    return len(value)
+
+
+def _array_elem_at(array, index):
+    if _null(array) or _null(index):
+        return None
+    return array[index] if -len(array) <= index < len(array) else MISSING
+
+
+def _string(fn):
+    return lambda value: '' if _null(value) else fn(str(value))
+
+
+_OPERATORS = {
+    '$add': _arithmetic(_add),
+    '$subtract': _arithmetic(_subtract),
+    '$multiply': _arithmetic(_multiply),
+    '$divide': _arithmetic(operator.truediv),
+    '$mod': _arithmetic(operator.mod),
+    '$concat': lambda *args: None if any(_null(a) for a in args) else ''.join(args),
+    '$toLower': _string(str.lower),
+    '$toUpper': _string(str.upper),
+    '$eq': _comparison(operator.eq),
+    '$ne': _comparison(operator.ne),
+    '$gt': _comparison(operator.gt),
+    '$gte': _comparison(operator.ge),
+    '$lt': _comparison(operator.lt),
+    '$lte': _comparison(operator.le),
+    '$cmp': _cmp,
+    '$and': lambda *args: all(not _null(a) and a is not False and a != 0 for a in args),
+    '$or': lambda *args: any(not _null(a) and a is not False and a != 0 for a in args),
+    '$not': lambda a: _null(a) or a is False or a == 0,
+    '$in': lambda value, array: value in array,
+    '$size': _size,
+    '$arrayElemAt': _array_elem_at,
+}
+
+
+def compile_expression(expr):
+    ''' function evaluating an aggregation expression against a document '''
+    if isinstance(expr, str) and expr.startswith('$$'):
+        name, _, path = expr[2:].partition('.')
+        if name not in ('ROOT', 'CURRENT'):
+            raise OperationFailure(f'Use of undefined variable: {name}')
+        if not path:
+            return lambda doc: doc
+        parts = path.split('.')
+        return lambda doc: _path_value(doc, parts)
+    if isinstance(expr, str) and expr.startswith('$'):
+        parts = expr[1:].split('.')
+        if len(parts) == 1:
+            field = parts[0]
+            return lambda doc: doc.get(field, MISSING)
+        return lambda doc: _path_value(doc, parts)
+    if isinstance(expr, list):
+        items = [compile_expression(e) for e in expr]
+        return lambda doc: [i(doc) for i in items]
+    if isinstance(expr, dict):
+        if len(expr) == 1 and next(iter(expr)).startswith('$'):
+            return _compile_operator(*next(iter(expr.items())))
+        fields = [(k, compile_expression(v)) for k, v in expr.items()]
+        return lambda doc: {k: v for k, v in ((k, f(doc)) for k, f in fields) if v is not MISSING}
+    return lambda doc: expr
+
+
+def _compile_operator(op, args):
+    if op == '$literal':
+        return lambda doc: args
+    if op == '$ifNull':
+        values = [compile_expression(a) for a in args]
+
+        def if_null(doc):
+            for v in values[:-1]:
+                value = v(doc)
+                if not _null(value):
+                    return value
+            return values[-1](doc)
+        return if_null
+    if op == '$cond':
+        if isinstance(args, dict):
+            args = [args['if'], args['then'], args['else']]
+        test, then, otherwise = (compile_expression(a) for a in args)
+        return lambda doc: then(doc) if _OPERATORS['$and'](test(doc)) else otherwise(doc)
+    fn = _OPERATORS.get(op)
+    if fn is None:
+        raise OperationFailure(f'Unrecognized expression \'{op}\'')
+    if not isinstance(args, list):
+        args = [args]
+    values = [compile_expression(a) for a in args]
+    return lambda doc: fn(*(v(doc) for v in values))
+
+
+def _number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _sum_step(total, value):
+    return total + value if _number(value) else total
+
+
+def _avg_step(state, value):
+    if _number(value):
+        state[0] += value
+        state[1] += 1
+    return state
+
+
+def _extreme(pick):
+    def step(state, value):
+        if _null(value):
+            return state
+        if state is MISSING or pick(sort_key(value), sort_key(state)):
+            return value
+        return state
+    return step
+
+
+def _push_step(values, value):
+    if value is not MISSING:
+        values.append(value)
+    return values
+
+
+def _add_to_set_step(values, value):
+    if value is not MISSING:
+        values.setdefault(hashable(value), value)
+    return values
+
+
+# accumulator: (initial state, step, final value)
+_ACCUMULATORS = {
+    '$sum': (lambda: 0, _sum_step, lambda total: total),
+    '$avg': (lambda: [0, 0], _avg_step, lambda state: state[0] / state[1] if state[1] else None),
+    '$min': (lambda: MISSING, _extreme(operator.lt), lambda v: None if v is MISSING else v),
+    '$max': (lambda: MISSING, _extreme(operator.gt), lambda v: None if v is MISSING else v),
+    '$first': (lambda: MISSING, lambda state, v: v if state is MISSING else state,
+               lambda v: None if v is MISSING else v),
+    '$last': (lambda: MISSING, lambda state, v: v, lambda v: None if v is MISSING else v),
+    '$push': (list, _push_step, lambda values: values),
+    '$addToSet': (dict, _add_to_set_step, lambda values: list(values.values())),
+}
+
+
+def _group(docs, spec):
+    if '_id' not in spec:
+        raise OperationFailure('a group specification must include an _id')
+    group_id = compile_expression(spec['_id'])
+    accumulators = []
+    for field, acc in spec.items():
+        if field == '_id':
+            continue
+        (op, arg), = acc.items()
+        if op == '$count':
+            op, arg = '$sum', 1
+        if op not in _ACCUMULATORS:
+            raise OperationFailure(f'unknown group operator \'{op}\'')
+        init, step, finish = _ACCUMULATORS[op]
+        accumulators.append((field, compile_expression(arg), init, step, finish))
+    return _grouped(docs, group_id, accumulators)
+
+
+def _grouped(docs, group_id, accumulators):
+    groups = {}
+    for doc in docs:
+        _id = group_id(doc)
+        _id = None if _id is MISSING else _id
+        key = hashable(_id)
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = [_id, [init() for _, _, init, _, _ in accumulators]]
+        states = group[1]
+        for i, (_, value, _, step, _) in enumerate(accumulators):
+            states[i] = step(states[i], value(doc))
+
+    for _id, states in groups.values():
+        ret = {'_id': _id}
+        for (field, _, _, _, finish), state in zip(accumulators, states):
+            ret[field] = finish(state)
+        yield ret
+
+
+def _project(docs, spec):
+    paths = {k: v for k, v in spec.items()
+             if isinstance(v, bool) or (isinstance(v, int) and v in (0, 1))}
+    computed = [(k, compile_expression(v)) for k, v in spec.items() if k not in paths]
+    if not computed:
+        project = compile_projection(paths)
+    else:
+        # computed fields switch the projection to inclusion
+        fields = {k: 1 for k, v in paths.items() if v and k != '_id'}
+        fields['_id'] = paths.get('_id', 1)
+        project = compile_projection(fields) if any(fields.values()) else (lambda doc: {})
+    return _projected(docs, project, computed)
+
+
+def _projected(docs, project, computed):
+    for doc in docs:
+        ret = project(doc)
+        for field, value in computed:
+            _set_path(ret, field, value(doc))
+        yield ret
+
+
+def _set_path(doc, path, value):
+    ''' set a dotted field on doc, copying nested documents instead of mutating them '''
+    if value is MISSING:
+        return
+    parts = path.split('.')
+    for part in parts[:-1]:
+        sub = doc.get(part)
+        sub = dict(sub) if isinstance(sub, dict) else {}
+        doc[part] = sub
+        doc = sub
+    doc[parts[-1]] = value
+
+
+def _add_fields(docs, spec):
+    computed = [(k, compile_expression(v)) for k, v in spec.items()]
+    for doc in docs:
+        ret = dict(doc)
+        for field, value in computed:
+            _set_path(ret, field, value(doc))
+        yield ret
+
+
+def _unset(docs, spec):
+    project = compile_projection({field: 0 for field in ([spec] if isinstance(spec, str) else spec)})
+    return (project(doc) for doc in docs)
+
+
+def _unwind(docs, spec):
+    if isinstance(spec, str):
+        spec = {'path': spec}
+    path = spec['path']
+    if not path.startswith('$'):
+        raise OperationFailure('path option to $unwind stage should be prefixed with a \'$\'')
+    return _unwound(docs, path[1:], spec.get('includeArrayIndex'),
+                    spec.get('preserveNullAndEmptyArrays', False))
+
+
+def _unwound(docs, path, index_field, preserve):
+    parts = path.split('.')
+    for doc in docs:
+        value = _path_value(doc, parts)
+        if isinstance(value, list) and value:
+            for i, element in enumerate(value):
+                ret = dict(doc)
+                _set_path(ret, path, element)
+                if index_field:
+                    ret[index_field] = i
+                yield ret
+        elif not preserve and (isinstance(value, list) or _null(value)):
+            continue
+        else:
+            # non array values unwind to themselves
+            ret = dict(doc)
+            if index_field:
+                ret[index_field] = None
+            yield ret
+
+
+def _sort(docs, spec, limit=0):
+    key, reverse = sort_key_function(sort_spec(spec))
+    if limit:
+        top = heapq.nlargest if reverse else heapq.nsmallest
+        return iter(top(limit, docs, key=key))
+    return iter(sorted(docs, key=key, reverse=reverse))
+
+
+def _count(docs, field):
+    n = sum(1 for _ in docs)
+    if n:
+        yield {field: n}
+
+
+def _match(docs, _filter):
+    return filter(compile_filter(_filter), docs)
+
+
+_STAGES = {
+    '$match': _match,
+    '$project': _project,
+    '$addFields': _add_fields,
+    '$set': _add_fields,
+    '$unset': _unset,
+    '$group': _group,
+    '$unwind': _unwind,
+    '$sort': _sort,
+    '$skip': lambda docs, n: islice(docs, n, None),
+    '$limit': lambda docs, n: islice(docs, n),
+    '$count': _count,
+}
+
+
+def _stage(stage):
+    if not isinstance(stage, dict) or len(stage) != 1:
+        raise OperationFailure('A pipeline stage specification object must contain exactly one field.')
+    name, spec = next(iter(stage.items()))
+    if name not in _STAGES:
+        raise OperationFailure(f'Unrecognized pipeline stage name: \'{name}\'')
+    return name, spec
+
+
+def run_pipeline(collection, pipeline, stats=None):
+    ''' run pipeline over collection as a chain of generators '''
+    stages = [_stage(stage) for stage in pipeline]
+    if stages and stages[0][0] == '$match':
+        docs = collection._select(stages.pop(0)[1], stats)
+    else:
+        docs = collection._select(None, stats)
+    i = 0
+    while i < len(stages):
+        name, spec = stages[i]
+        if name == '$sort' and i + 1 < len(stages) and stages[i + 1][0] == '$limit':
+            docs = _sort(docs, spec, limit=stages[i + 1][1])
+            i += 2
+            continue
+        docs = _STAGES[name](docs, spec)
+        i += 1
+    return docs
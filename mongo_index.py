@@ -0,0 +1,334 @@
+from bisect import bisect_left, bisect_right, insort
+from copy import copy
+from itertools import product
+
+from pymongo.errors import DuplicateKeyError
+
+from test.mock.mongo_query import MISSING, _Descending, intersect_bounds, sort_key
+
+_NULL = sort_key(None)
+_ARRAY = sort_key([])[0]
+
+
+def _path_values(doc, field, missing=None):
+    ''' values at a (possibly dotted) field, following arrays of documents '''
+    values = [doc]
+    for part in field.split('.'):
+        found = []
+        for v in values:
+            if isinstance(v, dict):
+                found.append(v.get(part, missing))
+            elif isinstance(v, list):
+                if part.isdigit():
+                    found.append(v[int(part)] if int(part) < len(v) else missing)
+                else:
+                    found.extend(e.get(part, missing) for e in v if isinstance(e, dict))
+            else:
+                found.append(missing)
+        values = found
+    return values
+
+
+def index_values(doc, field):
+    ''' sort keys a (possibly dotted) field indexes as, arrays expanded multikey style '''
+    keys = set()
+    for v in _path_values(doc, field):
+        if isinstance(v, list):
+            keys.update(sort_key(e) for e in v)
+        keys.add(sort_key(v))
+    return keys
+
+
+def distinct_values(doc, field):
+    ''' values distinct() finds at field of doc: arrays are unwound, missing fields skipped '''
+    for v in _path_values(doc, field, MISSING):
+        if isinstance(v, list):
+            yield from v
+        elif v is not MISSING:
+            yield v
+
+
+def index_name(keys):
+    return '_'.join(f'{field}_{direction}' for field, direction in keys)
+
+
+def index_keys(keys):
+    ''' normalize a pymongo index specification to [(field, direction)] '''
+    if isinstance(keys, str):
+        return [(keys, 1)]
+    if isinstance(keys, dict):
+        return list(keys.items())
+    return [(k, 1) if isinstance(k, str) else tuple(k) for k in keys]
+
+
+class _Max:
+    ''' above any key, closes a range over every key starting with a prefix '''
+    def __lt__(self, other):
+        return False
+
+    def __gt__(self, other):
+        return True
+
+
+MAX = _Max()
+
+
+class SortedKeys:
+    ''' sorted distinct keys in blocks of bounded length, O(log n) add, remove and seek '''
+    LOAD = 512
+
+    def __init__(self, keys=()):
+        ''' keys must already be sorted '''
+        keys = list(keys)
+        self.blocks = [keys[i:i + self.LOAD] for i in range(0, len(keys), self.LOAD)]
+        self.maxes = [block[-1] for block in self.blocks]
+
+    def clone(self):
+        ret = copy(self)
+        ret.blocks = [list(block) for block in self.blocks]
+        ret.maxes = list(self.maxes)
+        return ret
+
+    def add(self, key):
+        blocks, maxes = self.blocks, self.maxes
+        if not blocks:
+            blocks.append([key])
+            maxes.append(key)
+            return
+        i = bisect_left(maxes, key)
+        if i == len(maxes):
+            i -= 1
+            blocks[i].append(key)
+            maxes[i] = key
+        else:
+            insort(blocks[i], key)
+        block = blocks[i]
+        if len(block) > 2 * self.LOAD:
+            blocks[i:i + 1] = [block[:self.LOAD], block[self.LOAD:]]
+            maxes[i:i + 1] = [block[self.LOAD - 1], block[-1]]
+
+    def remove(self, key):
+        i = bisect_left(self.maxes, key)
+        block = self.blocks[i]
+        j = bisect_left(block, key)
+        del block[j]
+        if not block:
+            del self.blocks[i]
+            del self.maxes[i]
+        elif j == len(block):
+            self.maxes[i] = block[-1]
+
+    def irange(self, lo=None, hi=None, reverse=False):
+        ''' keys k with lo <= k < hi in order, each block is copied before it is yielded from
+        and the next one found again from the last key, so writes in between are tolerated '''
+        if reverse:
+            yield from self._irange_reverse(lo, hi)
+            return
+        key, inclusive = lo, True
+        while True:
+            if key is None:
+                i = j = 0
+                if not self.blocks:
+                    return
+            else:
+                i = (bisect_left if inclusive else bisect_right)(self.maxes, key)
+                if i == len(self.maxes):
+                    return
+                j = (bisect_left if inclusive else bisect_right)(self.blocks[i], key)
+            chunk = self.blocks[i][j:]
+            for k in chunk:
+                if hi is not None and not k < hi:
+                    return
+                yield k
+            key, inclusive = chunk[-1], False
+
+    def _irange_reverse(self, lo, hi):
+        key = hi
+        while True:
+            if key is None:
+                i = len(self.blocks) - 1
+                j = len(self.blocks[i]) if i >= 0 else 0
+            else:
+                i = bisect_left(self.maxes, key)
+                if i == len(self.maxes):
+                    i -= 1
+                j = bisect_left(self.blocks[i], key) if i >= 0 else 0
+                if j == 0:
+                    i -= 1
+                    j = len(self.blocks[i]) if i >= 0 else 0
+            if i < 0:
+                return
+            chunk = self.blocks[i][:j]
+            for k in reversed(chunk):
+                if lo is not None and k < lo:
+                    return
+                yield k
+            key = chunk[0]
+
+
+class SortedIndex:
+    ''' key tuple -> insertion ordered set of document id keys, with the key tuples kept in
+    index order for range scans and sorted reads '''
+    def __init__(self, name, keys, unique=False, sparse=False):
+        self.name = name
+        self.keys = keys
+        self.fields = [field for field, _ in keys]
+        self.descending = [direction == -1 for _, direction in keys]
+        self.unique = unique
+        self.sparse = sparse
+        self.multikey = False
+        self.entries = {}
+        self.sorted = SortedKeys()
+        self._owned = None
+
+    def clone(self, empty=False):
+        ''' copy sharing buckets with this index until either side writes to them '''
+        ret = copy(self)
+        ret.entries = {} if empty else dict(self.entries)
+        ret.sorted = SortedKeys() if empty else self.sorted.clone()
+        ret.multikey = False if empty else self.multikey
+        ret._owned = None if empty else set()
+        return ret
+
+    def _key(self, keys):
+        ''' index order key of the sort keys of each field '''
+        if not any(self.descending):
+            return tuple(keys)
+        return tuple(_Descending(k) if d else k for k, d in zip(keys, self.descending))
+
+    def _bucket(self, key):
+        bucket = self.entries.get(key)
+        if bucket is not None and self._owned is not None and key not in self._owned:
+            bucket = self.entries[key] = dict(bucket)
+            self._owned.add(key)
+        return bucket
+
+    def doc_keys(self, doc):
+        if self.sparse and all(v is MISSING for f in self.fields
+                               for v in _path_values(doc, f, MISSING)):
+            # a sparse index leaves out the documents without its fields, but not explicit nulls
+            return ()
+        per_field = [index_values(doc, f) for f in self.fields]
+        if not self.multikey:
+            self.multikey = any(len(v) > 1 or next(iter(v))[0] == _ARRAY for v in per_field)
+        if len(per_field) == 1 and not self.descending[0]:
+            return [(k,) for k in per_field[0]]
+        return [self._key(keys) for keys in product(*per_field)]
+
+    def check(self, doc, id_key):
+        if self.unique:
+            for key in self.doc_keys(doc):
+                bucket = self.entries.get(key)
+                if bucket and id_key not in bucket:
+                    raise DuplicateKeyError(
+                        f'mock duplicate key error index: {self.name} dup key: {key}', 11000)
+
+    def add(self, doc, id_key):
+        for key in self.doc_keys(doc):
+            bucket = self._bucket(key)
+            if bucket is None:
+                bucket = self.entries[key] = {}
+                self.sorted.add(key)
+                if self._owned is not None:
+                    self._owned.add(key)
+            bucket[id_key] = None
+
+    def remove(self, doc, id_key):
+        for key in self.doc_keys(doc):
+            bucket = self._bucket(key)
+            if bucket is not None:
+                bucket.pop(id_key, None)
+                if not bucket:
+                    del self.entries[key]
+                    self.sorted.remove(key)
+
+    def build(self, docs):
+        ''' index (id key, doc) pairs into an empty index, sorting the keys once '''
+        for id_key, doc in docs:
+            self.check(doc, id_key)
+            for key in self.doc_keys(doc):
+                self.entries.setdefault(key, {})[id_key] = None
+        self.sorted = SortedKeys(sorted(self.entries))
+
+    def lookup(self, values):
+        return self.entries.get(self._key([sort_key(v) for v in values]), {})
+
+    def scan(self, prefix, bounds=None, reverse=False):
+        ''' buckets of the keys starting with the values in prefix, the next field within
+        bounds (low, low inclusive, high, high inclusive), in index order '''
+        p = len(prefix)
+        start = tuple(_Descending(sort_key(v)) if d else sort_key(v)
+                      for v, d in zip(prefix, self.descending))
+        if bounds is None:
+            lo, hi = (start or None), (start + (MAX,) if start else None)
+        else:
+            low, low_inclusive, high, high_inclusive = bounds
+            if self.descending[p]:
+                low, low_inclusive, high, high_inclusive = \
+                    _Descending(high), high_inclusive, _Descending(low), low_inclusive
+            lo = start + ((low,) if low_inclusive else (low, MAX))
+            hi = start + ((high, MAX) if high_inclusive else (high,))
+        for key in self.sorted.irange(lo, hi, reverse):
+            bucket = self.entries.get(key)
+            if bucket:
+                yield list(bucket)
+
+    def first_keys(self):
+        ''' (sort key of the first field, buckets having it) in index order '''
+        last, buckets = MISSING, []
+        for key in self.sorted.irange():
+            first = key[0].key if self.descending[0] else key[0]
+            if first != last:
+                if buckets:
+                    yield last, buckets
+                last, buckets = first, []
+            buckets.append(self.entries[key])
+        if buckets:
+            yield last, buckets
+
+    def information(self):
+        info = {'v': 2, 'key': list(self.keys)}
+        if self.unique:
+            info['unique'] = True
+        if self.sparse:
+            info['sparse'] = True
+        return info
+
+
+def _sort_direction(index, p, sort):
+    ''' None, or whether a scan of index after p equality fields returns sort reversed '''
+    if not sort or index.multikey or index.sparse:
+        return None
+    keys = [(f, d) for f, d in index.keys[p:p + len(sort)]]
+    if keys == [(f, d) for f, d in sort]:
+        return False
+    if keys == [(f, -d) for f, d in sort]:
+        return True
+    return None
+
+
+def plan(indexes, eq, ranges, sort=None):
+    ''' (index, equality prefix length, bounds of the next field, scan direction when it returns
+    the sort order) of the index serving a query best, None when no index helps. A multikey index
+    scans with one bound only, an array may match each comparison through another element '''
+    best, best_score = None, (0, False)
+    for index in indexes:
+        p = 0
+        while p < len(index.fields) and index.fields[p] in eq:
+            p += 1
+        bounds = ranges.get(index.fields[p]) if p < len(index.fields) else None
+        if bounds is not None:
+            bounds = bounds[0] if index.multikey else intersect_bounds(bounds)
+        if index.sparse and bounds is not None and bounds[0][0] <= _NULL[0]:
+            bounds = None
+        if index.sparse and (p == 0 or any(v is None for f in index.fields[:p] for v in eq[f])):
+            if bounds is None:
+                continue
+        reverse = None
+        if all(len(eq[f]) == 1 for f in index.fields[:p]):
+            reverse = _sort_direction(index, p, sort)
+        score = (p + (bounds is not None), reverse is not None)
+        if score > best_score or (score == best_score and best is not None
+                                  and len(index.fields) > len(best[0].fields)):
+            best, best_score = (index, p, bounds, reverse), score
+    return best
@@ -0,0 +1,95 @@
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+from time import perf_counter
+
+
+class RWLock:
+    ''' reentrant readers/writer lock preferring writers, counting the acquisitions that waited '''
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = None
+        self._writer_depth = 0
+        self._waiting_writers = 0
+        self._local = threading.local()
+        self.stats = Counter()
+
+    @contextmanager
+    def reading(self):
+        me = threading.get_ident()
+        held = getattr(self._local, 'held', 0)
+        if self._writer == me or held:
+            # nested in an operation of this thread that already holds the lock
+            self._local.held = held + 1
+            try:
+                yield
+            finally:
+                self._local.held = held
+            return
+        with self._cond:
+            self.stats['reads'] += 1
+            if self._writer is not None or self._waiting_writers:
+                self._wait('read', lambda: self._writer is None and not self._waiting_writers)
+            self._readers += 1
+        self._local.held = 1
+        try:
+            yield
+        finally:
+            self._local.held = 0
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def writing(self):
+        me = threading.get_ident()
+        if self._writer == me:
+            self._writer_depth += 1
+            try:
+                yield
+            finally:
+                self._writer_depth -= 1
+            return
+        if getattr(self._local, 'held', 0):
+            raise RuntimeError('cannot write while holding the read lock')
+        with self._cond:
+            self.stats['writes'] += 1
+            if self._writer is not None or self._readers:
+                self._waiting_writers += 1
+                try:
+                    self._wait('write', lambda: self._writer is None and not self._readers)
+                finally:
+                    self._waiting_writers -= 1
+            self._writer = me
+            self._writer_depth = 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer_depth -= 1
+                if not self._writer_depth:
+                    self._writer = None
+                    self._cond.notify_all()
+
+    def _wait(self, kind, ready):
+        start = perf_counter()
+        self._cond.wait_for(ready)
+        self.stats[f'{kind}_waits'] += 1
+        self.stats['wait_micros'] += int((perf_counter() - start) * 1e6)
+
+
+def locked(write):
+    ''' run a collection method under its lock, when the collection is thread safe '''
+    def decorator(func):
+        @wraps(func)
+        def wrapper(self, *args, **kwargs):
+            lock = self._lock
+            if lock is None:
+                return func(self, *args, **kwargs)
+            with lock.writing() if write else lock.reading():
+                return func(self, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,184 @@
+import threading
+import time
+from collections import deque
+from copy import deepcopy
+from datetime import datetime, timezone
+from itertools import islice
+
+from bson.timestamp import Timestamp
+from pymongo.errors import OperationFailure
+
+from test.mock.mongo_aggregate import _STAGES, _stage
+
+OPLOG_SIZE = 10000
+
+# stages a change stream pipeline may use
+_CHANGE_STREAM_STAGES = ('$match', '$project', '$addFields', '$set', '$unset')
+
+
+def _token(seq):
+    return {'_data': f'{seq:016X}'}
+
+
+def _seq(token):
+    try:
+        return int(token['_data'], 16)
+    except (KeyError, TypeError, ValueError):
+        raise OperationFailure(f'invalid resume token: {token!r}', 260) from None
+
+
+def update_description(before, after):
+    ''' top level fields an update set or removed '''
+    updated = {k: v for k, v in after.items() if k not in before or before[k] != v}
+    return {'updatedFields': deepcopy(updated),
+            'removedFields': [k for k in before if k not in after],
+            'truncatedArrays': []}
+
+
+class Oplog:
+    ''' fixed size ring buffer of change events, the oldest are dropped first '''
+    def __init__(self, capacity=OPLOG_SIZE):
+        self.entries = deque(maxlen=capacity)
+        self.next_seq = 1
+        self._cond = threading.Condition()
+
+    @property
+    def first_seq(self):
+        return self.entries[0][0] if self.entries else self.next_seq
+
+    def append(self, collection, op, doc_id, **fields):
+        ''' record op on the document doc_id of collection '''
+        with self._cond:
+            seq = self.next_seq
+            self.next_seq += 1
+            event = {
+                '_id': _token(seq),
+                'operationType': op,
+                'clusterTime': Timestamp(int(time.time()), seq & 0xFFFFFFFF),
+                'wallTime': datetime.now(tz=timezone.utc).replace(tzinfo=None),
+                'ns': {'db': collection.db.name if collection.db is not None else None,
+                       'coll': collection.name},
+            }
+            if doc_id is not None:
+                event['documentKey'] = {'_id': doc_id}
+            event.update(fields)
+            self.entries.append((seq, collection, event))
+            self._cond.notify_all()
+
+    def read(self, seq, limit=None):
+        ''' up to limit entries from seq on, raises once they have been dropped from the buffer '''
+        with self._cond:
+            first = self.first_seq
+            if seq < first:
+                raise OperationFailure('Resume of change stream was not possible, as the resume '
+                                       'point may no longer be in the oplog.', 286)
+            start = seq - first
+            return list(islice(self.entries, start, None if limit is None else start + limit))
+
+    def wait(self, seq, timeout):
+        ''' wait up to timeout seconds for an entry at or after seq '''
+        with self._cond:
+            return self._cond.wait_for(lambda: self.next_seq > seq, timeout)
+
+
+class MockChangeStream:
+    ''' iterator over the changes of a client, database or collection, following pymongo's ChangeStream '''
+    def __init__(self, oplog, db=None, coll=None, pipeline=None, full_document=None,
+                 resume_after=None, start_after=None, start_at_operation_time=None,
+                 max_await_time_ms=None):
+        if full_document not in (None, 'default', 'updateLookup'):
+            raise OperationFailure(f'unsupported fullDocument option: {full_document}')
+        self._oplog = oplog
+        self._db = db
+        self._coll = coll
+        self._stages = []
+        for stage in pipeline or []:
+            name, spec = _stage(stage)
+            if name not in _CHANGE_STREAM_STAGES:
+                raise OperationFailure(f'{name} is not permitted in a $changeStream pipeline')
+            self._stages.append((name, spec))
+        self._full_document = full_document
+        self._max_await = (max_await_time_ms or 1000) / 1000
+        token = start_after or resume_after
+        if token is not None:
+            self._seq = _seq(token) + 1
+            oplog.read(self._seq)
+        elif start_at_operation_time is not None:
+            self._seq = next((seq for seq, _, event in oplog.read(oplog.first_seq)
+                              if event['clusterTime'] >= start_at_operation_time), oplog.next_seq)
+        else:
+            self._seq = oplog.next_seq
+        self._resume_token = token
+        self._alive = True
+
+    @property
+    def alive(self):
+        return self._alive
+
+    @property
+    def resume_token(self):
+        return self._resume_token
+
+    @property
+    def lag(self):
+        ''' changes recorded that this stream has not returned yet '''
+        return self._oplog.next_seq - self._seq
+
+    def _in_scope(self, event):
+        ns = event['ns']
+        if self._db is not None and ns['db'] != self._db:
+            return False
+        return self._coll is None or ns['coll'] == self._coll
+
+    def _output(self, collection, event):
+        event = deepcopy(event)
+        if self._full_document == 'updateLookup' and event['operationType'] == 'update':
+            doc = collection._find_one_for_write({'_id': event['documentKey']['_id']})
+            event['fullDocument'] = deepcopy(doc)
+        docs = iter([event])
+        for name, spec in self._stages:
+            docs = _STAGES[name](docs, spec)
+        return next(docs, None)
+
+    def try_next(self):
+        ''' next change, or None when there is none yet '''
+        while self._alive:
+            entries = self._oplog.read(self._seq, limit=100)
+            if not entries:
+                break
+            for seq, collection, event in entries:
+                self._seq = seq + 1
+                self._resume_token = event['_id']
+                if not self._in_scope(event):
+                    continue
+                if event['operationType'] == 'drop' and self._coll is not None:
+                    self._alive = False
+                    return {'_id': event['_id'], 'operationType': 'invalidate',
+                            'clusterTime': event['clusterTime']}
+                ret = self._output(collection, event)
+                if ret is not None:
+                    return ret
+        return None
+
+    def next(self):
+        ''' next change, waiting for one to be recorded '''
+        while self._alive:
+            change = self.try_next()
+            if change is not None:
+                return change
+            self._oplog.wait(self._seq, self._max_await)
+        raise StopIteration
+
+    __next__ = next
+
+    def __iter__(self):
+        return self
+
+    def close(self):
+        self._alive = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
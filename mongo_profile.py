@@ -0,0 +1,109 @@
+from collections import Counter, deque
+from datetime import datetime, timezone
+
+from test.mock.mongo_query import is_operator
+
+
+def filter_shape(_filter):
+    ''' _filter with every value replaced by '?', keeping fields and operators '''
+    if not _filter:
+        return {}
+    shape = {}
+    for k, v in _filter.items():
+        if k in ('$and', '$or', '$nor'):
+            shape[k] = [filter_shape(sub) for sub in v]
+        elif is_operator(v):
+            shape[k] = {op: filter_shape(arg) if op == '$not' else '?' for op, arg in v.items()}
+        else:
+            shape[k] = '?'
+    return shape
+
+
+class OpStats:
+    ''' work done by one operation against a collection '''
+    def __init__(self, op, _filter=None):
+        self.op = op
+        self.filter = _filter
+        self.stage = None
+        self.index = None
+        self.ordered = False
+        self.keys_examined = 0
+        self.docs_examined = 0
+        self.returned = 0
+        self.micros = 0
+
+    def plan(self, stage, index=None, keys=0):
+        if self.stage is None:
+            self.stage = stage
+            self.index = index
+        self.keys_examined += keys
+
+    def plan_summary(self):
+        if self.index is not None:
+            return f'{self.stage} {{ {", ".join(f"{k}: {d}" for k, d in self.index.keys)} }}'
+        return self.stage or 'NONE'
+
+    def winning_plan(self):
+        if self.index is not None:
+            scan = {'stage': self.stage, 'indexName': self.index.name,
+                    'keyPattern': dict(self.index.keys)}
+            parent = {'IXSCAN': 'FETCH', 'COUNT_SCAN': 'COUNT', 'DISTINCT_SCAN': 'PROJECTION_COVERED'}
+            return {'stage': parent[self.stage], 'inputStage': scan}
+        return {'stage': self.stage or 'EOF'}
+
+
+def _bucket(micros):
+    ''' latency histogram bucket: upper bound in microseconds, powers of two '''
+    return 1 << max(int(micros), 1).bit_length()
+
+
+class MockProfiler:
+    ''' bounded record of the operations run against the mock, with per collection totals '''
+    def __init__(self, capacity=1000):
+        self.entries = deque(maxlen=capacity)
+        self.totals = {}
+        self.histograms = {}
+
+    def record(self, ns, stats):
+        entry = {
+            'op': stats.op,
+            'ns': ns,
+            'filter': filter_shape(stats.filter),
+            'planSummary': stats.plan_summary(),
+            'index': stats.index.name if stats.index is not None else None,
+            'keysExamined': stats.keys_examined,
+            'docsExamined': stats.docs_examined,
+            'nreturned': stats.returned,
+            'micros': stats.micros,
+            'ts': datetime.now(tz=timezone.utc).replace(tzinfo=None),
+        }
+        self.entries.append(entry)
+
+        totals = self.totals.setdefault(ns, Counter())
+        totals['ops'] += 1
+        totals[stats.op] += 1
+        totals['keysExamined'] += stats.keys_examined
+        totals['docsExamined'] += stats.docs_examined
+        totals['nreturned'] += stats.returned
+        totals['micros'] += stats.micros
+        if stats.stage == 'COLLSCAN':
+            totals['collscans'] += 1
+
+        histogram = self.histograms.setdefault((ns, stats.op), Counter())
+        histogram[_bucket(stats.micros)] += 1
+        return entry
+
+    def histogram(self, ns, op):
+        ''' {upper bound in microseconds: operation count}, in increasing latency '''
+        return dict(sorted(self.histograms.get((ns, op), {}).items()))
+
+    def repeated_queries(self, min_count=10):
+        ''' query shapes run at least min_count times in the buffer, the usual N+1 symptom '''
+        counts = Counter((e['ns'], e['op'], repr(e['filter'])) for e in self.entries)
+        return [{'ns': ns, 'op': op, 'filter': shape, 'count': count}
+                for (ns, op, shape), count in counts.most_common() if count >= min_count]
+
+    def clear(self):
+        self.entries.clear()
+        self.totals = {}
+        self.histograms = {}
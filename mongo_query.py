@@ -0,0 +1,486 @@
+import operator
+import re
+from datetime import datetime, timezone
+from functools import lru_cache, reduce
+
+from bson import ObjectId
+from bson.int64 import Int64
+from bson.max_key import MaxKey
+from bson.min_key import MinKey
+from bson.regex import Regex
+from bson.timestamp import Timestamp
+from pymongo.errors import OperationFailure
+
+MISSING = object()
+
+_DICT = object()
+_LIST = object()
+_BOOL = object()
+
+
+def hashable(value):
+    ''' key usable in a dict for any bson value, including documents and arrays. Booleans get
+    keys of their own, the server never takes true for 1 '''
+    if value.__class__ is bool:
+        return (_BOOL, value)
+    if isinstance(value, dict):
+        return (_DICT, tuple((k, hashable(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return (_LIST, tuple(hashable(v) for v in value))
+    return value
+
+
+def is_operator(value):
+    return isinstance(value, dict) and any(k.startswith('$') for k in value)
+
+
+# bson comparison order, see https://www.mongodb.com/docs/manual/reference/bson-type-comparison-order/
+_RANKS = {
+    MinKey: 1,
+    type(None): 2,
+    int: 3, Int64: 3, float: 3,
+    str: 4,
+    dict: 5,
+    list: 6, tuple: 6,
+    bytes: 7,
+    ObjectId: 8,
+    bool: 9,
+    datetime: 10,
+    Timestamp: 11,
+    Regex: 12, re.Pattern: 12,
+    MaxKey: 13,
+}
+
+
+def type_rank(value):
+    rank = _RANKS.get(type(value))
+    if rank is None:
+        rank = next((r for t, r in _RANKS.items() if isinstance(value, t)), 14)
+        if isinstance(value, bool):
+            rank = 9
+    return rank
+
+
+def sort_key(value):
+    ''' key ordering any two bson values the way the server compares them '''
+    rank = type_rank(value)
+    if rank == 3 or rank == 4 or rank == 8 or rank == 9 or rank == 11:
+        return (rank, value)
+    if rank == 5:
+        return (rank, tuple((k, sort_key(v)) for k, v in value.items()))
+    if rank == 6:
+        return (rank, tuple(sort_key(v) for v in value))
+    if rank == 7:
+        return (rank, (len(value), value))
+    if rank == 10:
+        if value.tzinfo is not None:
+            value = value.astimezone(tz=timezone.utc).replace(tzinfo=None)
+        return (rank, value)
+    if rank == 12:
+        return (rank, (value.pattern, str(value.flags)))
+    if rank == 14:
+        return (rank, str(value))
+    return (rank, 0)
+
+
+def resolve(doc, parts):
+    ''' values found at a dotted path, traversing arrays of documents '''
+    values = [doc]
+    for part in parts:
+        found = []
+        for v in values:
+            if isinstance(v, dict):
+                if part in v:
+                    found.append(v[part])
+            elif isinstance(v, list):
+                if part.isdigit():
+                    if int(part) < len(v):
+                        found.append(v[int(part)])
+                else:
+                    found.extend(e[part] for e in v if isinstance(e, dict) and part in e)
+        values = found
+    return values
+
+
+def _getter(field):
+    if '.' not in field:
+        def get(doc):
+            v = doc.get(field, MISSING)
+            return () if v is MISSING else (v,)
+        return get
+    parts = field.split('.')
+    return lambda doc: resolve(doc, parts)
+
+
+def _equal(a, b):
+    ''' a == b the way the server compares: booleans are not numbers, in documents and arrays
+    too. Only values Python finds equal pay for the type checks '''
+    if a != b:
+        return False
+    if a.__class__ is bool or b.__class__ is bool:
+        return a.__class__ is b.__class__
+    if isinstance(a, (dict, list)):
+        return hashable(a) == hashable(b)
+    return True
+
+
+def _eq(values, target):
+    if not values:
+        return target is None
+    for v in values:
+        if _equal(v, target) or (isinstance(v, list) and any(_equal(e, target) for e in v)):
+            return True
+    return False
+
+
+def _in(values, targets):
+    if not values:
+        return None in targets
+    for v in values:
+        if isinstance(v, (dict, list)):
+            if hashable(v) in targets:
+                return True
+            if isinstance(v, list) and any(hashable(e) in targets for e in v):
+                return True
+        elif hashable(v) in targets:
+            return True
+    return False
+
+
+_SCALAR_RANKS = frozenset((3, 4, 8, 9, 11))
+
+
+def _comparison(compare, null_matches_missing):
+    def test(values, key):
+        if not values:
+            return null_matches_missing and key[0] == 2
+        rank, target = key
+        for v in values:
+            r = _RANKS.get(type(v)) or type_rank(v)
+            if r == rank and compare(v if r in _SCALAR_RANKS else sort_key(v)[1], target):
+                return True
+            if r == 6:
+                for e in v:
+                    r = _RANKS.get(type(e)) or type_rank(e)
+                    if r == rank and compare(e if r in _SCALAR_RANKS else sort_key(e)[1], target):
+                        return True
+        return False
+    return test
+
+
+_OPERATORS = {
+    '$eq': _eq,
+    '$ne': lambda values, target: not _eq(values, target),
+    '$in': _in,
+    '$nin': lambda values, targets: not _in(values, targets),
+    '$gt': _comparison(operator.gt, False),
+    '$gte': _comparison(operator.ge, True),
+    '$lt': _comparison(operator.lt, False),
+    '$lte': _comparison(operator.le, True),
+    '$exists': lambda values, flag: bool(values) == flag,
+}
+
+
+def _param(op, value):
+    ''' precompute the per query argument of an operator '''
+    if op in ('$in', '$nin'):
+        if not isinstance(value, (list, tuple)):
+            raise OperationFailure(f'{op} needs an array')
+        return frozenset(hashable(v) for v in value)
+    if op in ('$gt', '$gte', '$lt', '$lte'):
+        return sort_key(value)
+    if op == '$exists':
+        return bool(value)
+    return value
+
+
+def _ops_shape(ops, params):
+    shape = []
+    for op, value in ops.items():
+        if op == '$not':
+            if not isinstance(value, dict):
+                raise OperationFailure('$not needs a document')
+            shape.append((op, _ops_shape(value, params)))
+        elif op in _OPERATORS:
+            params.append(_param(op, value))
+            shape.append((op, None))
+        else:
+            raise OperationFailure(f'unknown operator: {op}')
+    return tuple(shape)
+
+
+def _shape(_filter, params):
+    ''' structure of _filter with its values moved to params, in traversal order '''
+    shape = []
+    for k, v in _filter.items():
+        if k in ('$and', '$or', '$nor'):
+            if not isinstance(v, (list, tuple)) or not v:
+                raise OperationFailure(f'{k} must be a nonempty array')
+            shape.append((k, tuple(_shape(sub, params) for sub in v)))
+        elif k.startswith('$'):
+            raise OperationFailure(f'unknown top level operator: {k}')
+        elif is_operator(v):
+            shape.append(('field', k, _ops_shape(v, params)))
+        else:
+            params.append(v)
+            shape.append(('eq', k))
+    return tuple(shape)
+
+
+def _build_ops(shape, counter):
+    tests = []
+    for op, sub in shape:
+        if op == '$not':
+            inner = _build_ops(sub, counter)
+            tests.append(lambda values, p, inner=inner: not inner(values, p))
+        else:
+            i = next(counter)
+            test = _OPERATORS[op]
+            tests.append(lambda values, p, test=test, i=i: test(values, p[i]))
+    if len(tests) == 1:
+        return tests[0]
+    if len(tests) == 2:
+        first, second = tests
+        return lambda values, p: first(values, p) and second(values, p)
+    return lambda values, p: all(t(values, p) for t in tests)
+
+
+def _build_clause(clause, counter):
+    kind = clause[0]
+    if kind == 'eq':
+        field, i = clause[1], next(counter)
+        if '.' not in field:
+            def eq(doc, p):
+                v = doc.get(field, MISSING)
+                target = p[i]
+                if v is MISSING:
+                    return target is None
+                if v == target and _equal(v, target):
+                    return True
+                return isinstance(v, list) and any(_equal(e, target) for e in v)
+            return eq
+        get = _getter(field)
+        return lambda doc, p: _eq(get(doc), p[i])
+    if kind == 'field':
+        get, test = _getter(clause[1]), _build_ops(clause[2], counter)
+        return lambda doc, p: test(get(doc), p)
+    subs = [_build_filter(sub, counter) for sub in clause[1]]
+    if kind == '$and':
+        return lambda doc, p: all(s(doc, p) for s in subs)
+    if kind == '$or':
+        return lambda doc, p: any(s(doc, p) for s in subs)
+    return lambda doc, p: not any(s(doc, p) for s in subs)
+
+
+def _build_filter(shape, counter):
+    clauses = [_build_clause(c, counter) for c in shape]
+    if len(clauses) == 1:
+        return clauses[0]
+    if len(clauses) == 2:
+        first, second = clauses
+        return lambda doc, p: first(doc, p) and second(doc, p)
+    return lambda doc, p: all(c(doc, p) for c in clauses)
+
+
+@lru_cache(maxsize=1024)
+def _compile_shape(shape):
+    counter = iter(range(1 << 30))
+    return _build_filter(shape, counter)
+
+
+def _match_all(doc):
+    return True
+
+
+def compile_filter(_filter):
+    ''' predicate for _filter, sharing compiled code between filters of the same shape '''
+    if not _filter:
+        return _match_all
+    params = []
+    fn = _compile_shape(_shape(_filter, params))
+    params = tuple(params)
+    return lambda doc: fn(doc, params)
+
+
+def equalities(_filter):
+    ''' field -> values the field must equal one of, for index selection '''
+    eq = {}
+    for k, v in (_filter or {}).items():
+        if k == '$and':
+            for sub in v:
+                for field, values in equalities(sub).items():
+                    eq.setdefault(field, values)
+        elif k.startswith('$'):
+            continue
+        elif not is_operator(v):
+            eq[k] = [v]
+        elif '$eq' in v:
+            eq[k] = [v['$eq']]
+        elif isinstance(v.get('$in'), (list, tuple)):
+            eq[k] = list(v['$in'])
+    return eq
+
+
+def _bounds(op, value):
+    ''' (low, low inclusive, high, high inclusive) sort keys a comparison matches, within the
+    type bracket of value '''
+    key = sort_key(value)
+    if op in ('$gt', '$gte'):
+        return key, op == '$gte', (key[0] + 1,), False
+    return (key[0],), True, key, op == '$lte'
+
+
+def _intersect(a, b):
+    (a_low, a_low_inc, a_high, a_high_inc), (b_low, b_low_inc, b_high, b_high_inc) = a, b
+    if a_low == b_low:
+        low = a_low, a_low_inc and b_low_inc
+    else:
+        low = max((a_low, a_low_inc), (b_low, b_low_inc), key=lambda bound: bound[0])
+    if a_high == b_high:
+        high = a_high, a_high_inc and b_high_inc
+    else:
+        high = min((a_high, a_high_inc), (b_high, b_high_inc), key=lambda bound: bound[0])
+    return low + high
+
+
+def ranges(_filter):
+    ''' field -> [sort key bounds of each of its $gt/$gte/$lt/$lte comparisons], for index range
+    scans. The bounds are kept apart: the elements of an array may each satisfy a different one '''
+    ret = {}
+    for k, v in (_filter or {}).items():
+        if k == '$and':
+            found = [ranges(sub) for sub in v]
+        elif k.startswith('$') or not is_operator(v):
+            continue
+        else:
+            found = [{k: [_bounds(op, arg)]} for op, arg in v.items()
+                     if op in ('$gt', '$gte', '$lt', '$lte')]
+        for bounds in found:
+            for field, b in bounds.items():
+                ret.setdefault(field, []).extend(b)
+    return ret
+
+
+def intersect_bounds(bounds):
+    ''' the one interval of sort keys within every bounds of a list '''
+    return reduce(_intersect, bounds)
+
+
+def sort_spec(key_or_list, direction=None):
+    ''' normalize pymongo sort arguments to [(field, direction)] '''
+    if isinstance(key_or_list, str):
+        spec = [(key_or_list, 1 if direction is None else direction)]
+    elif isinstance(key_or_list, dict):
+        spec = list(key_or_list.items())
+    else:
+        spec = [(k, 1) if isinstance(k, str) else tuple(k) for k in key_or_list]
+    for field, d in spec:
+        if d not in (1, -1):
+            raise ValueError(f'bad sort direction for {field}: {d}')
+    return spec
+
+
+class _Descending:
+    __slots__ = ('key',)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __lt__(self, other):
+        if not isinstance(other, _Descending):
+            return NotImplemented
+        return other.key < self.key
+
+    def __gt__(self, other):
+        if not isinstance(other, _Descending):
+            return NotImplemented
+        return self.key < other.key
+
+    def __eq__(self, other):
+        return isinstance(other, _Descending) and self.key == other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+
+def _field_sort_key(field, descending):
+    get = _getter(field)
+
+    def key(doc):
+        values = get(doc)
+        if len(values) == 1 and not isinstance(values[0], list):
+            return sort_key(values[0])
+        # arrays sort by their smallest element ascending, largest descending
+        keys = [sort_key(e) for v in values for e in (v if isinstance(v, list) else (v,))]
+        if not keys:
+            return (2, 0)
+        return max(keys) if descending else min(keys)
+    return key
+
+
+def sort_key_function(spec):
+    ''' (key, reverse) arguments for sorted()/heapq implementing a sort spec '''
+    directions = {d for _, d in spec}
+    if len(directions) == 1:
+        descending = -1 in directions
+        keys = [_field_sort_key(f, descending) for f, _ in spec]
+        if len(keys) == 1:
+            return keys[0], descending
+        return (lambda doc: tuple(k(doc) for k in keys)), descending
+    keys = [(_field_sort_key(f, d == -1), d == -1) for f, d in spec]
+    return (lambda doc: tuple(_Descending(k(doc)) if desc else k(doc) for k, desc in keys)), False
+
+
+def _projection_tree(paths):
+    tree = {}
+    for path in paths:
+        node = tree
+        parts = path.split('.')
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+            if node is True:
+                break
+        else:
+            node[parts[-1]] = True
+    return tree
+
+
+def _include(value, tree):
+    if isinstance(value, list):
+        return [_include(v, tree) for v in value if isinstance(v, (dict, list))]
+    ret = {}
+    for k, v in value.items():
+        sub = tree.get(k)
+        if sub is True:
+            ret[k] = v
+        elif sub is not None and isinstance(v, (dict, list)):
+            ret[k] = _include(v, sub)
+    return ret
+
+
+def _exclude(value, tree):
+    if isinstance(value, list):
+        return [_exclude(v, tree) if isinstance(v, (dict, list)) else v for v in value]
+    ret = {}
+    for k, v in value.items():
+        sub = tree.get(k)
+        if sub is None:
+            ret[k] = v
+        elif sub is not True:
+            ret[k] = _exclude(v, sub) if isinstance(v, (dict, list)) else v
+    return ret
+
+
+def compile_projection(spec):
+    ''' function building the projected copy of a document for an inclusion/exclusion spec '''
+    spec = dict(spec)
+    with_id = spec.pop('_id', None)
+    included = [k for k, v in spec.items() if v]
+    excluded = [k for k, v in spec.items() if not v]
+    if included and excluded:
+        raise OperationFailure('cannot mix inclusion and exclusion in a projection')
+    if included or (with_id and not excluded):
+        tree = _projection_tree(included + ([] if with_id is not None and not with_id else ['_id']))
+        return lambda doc: _include(doc, tree)
+    tree = _projection_tree(excluded + ([] if with_id is None or with_id else ['_id']))
+    return lambda doc: _exclude(doc, tree)
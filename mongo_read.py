@@ -0,0 +1,115 @@
+from collections.abc import Mapping
+from copy import deepcopy
+
+from test.mock.mongo_query import compile_projection
+
+# what find() and friends return: the stored documents themselves, private copies, or read only
+# views of the stored documents
+REFERENCE = 'reference'
+COPY = 'copy'
+READ_ONLY = 'readonly'
+READ_MODES = (REFERENCE, COPY, READ_ONLY)
+
+
+def copy_document(value):
+    ''' deep copy of the dicts and lists of a document, sharing the (immutable) values in them '''
+    if type(value) is dict:
+        return {k: copy_document(v) for k, v in value.items()}
+    if type(value) is list:
+        return [copy_document(v) for v in value]
+    if isinstance(value, (dict, list)):
+        return deepcopy(value)
+    return value
+
+
+def _read_only(value):
+    if isinstance(value, dict):
+        return ReadOnlyDocument(value)
+    if isinstance(value, list):
+        return ReadOnlyList(value)
+    return value
+
+
+def _unwrap(value):
+    return value._data if isinstance(value, ReadOnlyDocument) else value
+
+
+class ReadOnlyDocument(Mapping):
+    ''' read only view of a stored document, nested documents and arrays are wrapped on access '''
+    __slots__ = ('_data',)
+
+    def __init__(self, doc):
+        self._data = doc
+
+    def __getitem__(self, key):
+        return _read_only(self._data[key])
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __eq__(self, other):
+        if isinstance(other, Mapping):
+            return self._data == _unwrap(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(self._data)
+
+    def copy(self):
+        ''' private, writable copy of the document '''
+        return copy_document(self._data)
+
+
+class ReadOnlyList(tuple):
+    ''' read only copy of an array of a stored document, its documents are read only views '''
+    __slots__ = ()
+
+    def __new__(cls, values):
+        return super().__new__(cls, (_read_only(v) for v in values))
+
+    def __eq__(self, other):
+        if isinstance(other, list):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return super().__eq__(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def copy(self):
+        return [v.copy() if isinstance(v, (ReadOnlyDocument, ReadOnlyList)) else v for v in self]
+
+
+def projector(projection):
+    ''' None, or the function building the projected copy of a document for a pymongo
+    projection: a dict or a list of field names '''
+    if not projection:
+        return None
+    if not isinstance(projection, Mapping):
+        projection = {field: 1 for field in projection}
+    return compile_projection(projection)
+
+
+def reader(mode, projection=None):
+    ''' None, or the function turning a stored document into what a read returns '''
+    if mode not in READ_MODES:
+        raise ValueError(f'read_mode must be one of {", ".join(READ_MODES)}')
+    project = projector(projection)
+    view = {REFERENCE: None, COPY: copy_document, READ_ONLY: _read_only}[mode]
+    if project is None:
+        return view
+    if view is None:
+        return project
+    return lambda doc: view(project(doc))
@@ -0,0 +1,216 @@
+import inspect
+import math
+import threading
+import time
+from collections import defaultdict
+from collections.abc import Iterator
+from os import PathLike
+from time import perf_counter
+
+from bson import json_util
+from pymongo import DeleteMany, DeleteOne, InsertOne, ReplaceOne, UpdateMany, UpdateOne
+from pymongo.errors import PyMongoError
+
+from test.mock.mongo_read import copy_document
+
+# bulk_write requests by name, with the attributes their constructor takes in order
+_REQUESTS = {
+    'InsertOne': (InsertOne, ('_doc',)),
+    'DeleteOne': (DeleteOne, ('_filter',)),
+    'DeleteMany': (DeleteMany, ('_filter',)),
+    'ReplaceOne': (ReplaceOne, ('_filter', '_doc', '_upsert')),
+    'UpdateOne': (UpdateOne, ('_filter', '_doc', '_upsert')),
+    'UpdateMany': (UpdateMany, ('_filter', '_doc', '_upsert')),
+}
+
+
+def _encode(value):
+    ''' journal form of an argument: bulk_write requests become {name: [arguments]} '''
+    name = type(value).__name__
+    if name in _REQUESTS and isinstance(value, _REQUESTS[name][0]):
+        return {name: [copy_document(getattr(value, a)) for a in _REQUESTS[name][1]]}
+    if isinstance(value, list):
+        return [_encode(v) for v in value]
+    return copy_document(value)
+
+
+def _decode(value):
+    if isinstance(value, list):
+        return [_decode(v) for v in value]
+    if isinstance(value, dict) and len(value) == 1:
+        name, args = next(iter(value.items()))
+        if name in _REQUESTS and isinstance(args, list):
+            return _REQUESTS[name][0](*args)
+    return value
+
+
+def result_size(result):
+    ''' documents an operation returned or wrote '''
+    if result is None:
+        return 0
+    if isinstance(result, list):
+        return len(result)
+    if hasattr(result, 'inserted_ids'):
+        return len(result.inserted_ids)
+    if hasattr(result, 'bulk_api_result'):
+        return sum(result.bulk_api_result[k] for k in ('nInserted', 'nUpserted', 'nMatched', 'nRemoved'))
+    for attr in ('deleted_count', 'matched_count'):
+        if hasattr(result, attr):
+            return getattr(result, attr)
+    return 1
+
+
+class MockRecorder:
+    ''' journal of the collection operations run against the mock, one compact JSON line each:
+    offset in seconds, database, collection, method, arguments, result size and latency '''
+    def __init__(self, out):
+        if isinstance(out, (str, PathLike)):
+            self._file = open(out, 'w')
+            self._owned = True
+        else:
+            self._file = out
+            self._owned = False
+        self._lock = threading.Lock()
+        self._signatures = {}
+        self.started = perf_counter()
+        self.entries = 0
+
+    def bind(self, func, args, kwargs):
+        ''' (args, kwargs, journaled arguments) of a call, iterators are read into lists first so
+        both the call and the journal see their items '''
+        signature = self._signatures.get(func)
+        if signature is None:
+            signature = self._signatures[func] = inspect.signature(func)
+        bound = signature.bind(None, *args, **kwargs)
+        arguments = dict(list(bound.arguments.items())[1:])
+        for name, value in arguments.items():
+            if isinstance(value, Iterator):
+                arguments[name] = bound.arguments[name] = list(value)
+        extra = arguments.pop('kwargs', {})
+        journaled = {name: _encode(value) for name, value in {**arguments, **extra}.items()}
+        return bound.args[1:], bound.kwargs, journaled
+
+    def record(self, collection, op, arguments, n, micros, start, error=None):
+        entry = {
+            'ts': round(start - self.started, 6),
+            'db': collection.db.name if collection.db is not None else None,
+            'coll': collection.name,
+            'op': op,
+            'args': arguments,
+            'n': n,
+            'micros': round(micros, 1),
+        }
+        if error is not None:
+            entry['error'] = type(error).__name__
+        line = json_util.dumps(entry, separators=(',', ':'))
+        with self._lock:
+            self._file.write(line + '\n')
+            self.entries += 1
+
+    def flush(self):
+        with self._lock:
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._owned:
+                self._file.close()
+            else:
+                self._file.flush()
+
+
+def load_journal(source):
+    ''' entries of a journal written by MockRecorder, from a path or an open file '''
+    if isinstance(source, (str, PathLike)):
+        with open(source) as f:
+            yield from load_journal(f)
+        return
+    for line in source:
+        if line.strip():
+            yield json_util.loads(line)
+
+
+def percentile(values, p):
+    ''' nearest rank percentile of sorted values '''
+    if not values:
+        return 0
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def _latencies(values):
+    values = sorted(values)
+    return {'p50': percentile(values, 50), 'p90': percentile(values, 90),
+            'p99': percentile(values, 99), 'max': values[-1] if values else 0}
+
+
+def _database(client, name):
+    ''' database name of client, the default one for its name (mock_db) too, like
+    MockMongoServer.database '''
+    if name is None:
+        return client.get_database()
+    default = client.db
+    return default if name == default.name else client[name]
+
+
+def replay(journal, client=None, threads=1, rate=None, speed=None):
+    ''' run the operations of a journal against client (a fresh MockMongoClient by default) at
+    full speed, at rate operations per second, or following the recorded timing sped up by speed,
+    from threads threads, and report throughput and latency percentiles in microseconds '''
+    if rate is not None and speed is not None:
+        raise ValueError('pass either rate or speed')
+    if client is None:
+        from test.mock.mongo import MockMongoClient
+        client = MockMongoClient(None, thread_safe=threads > 1)
+    entries = enumerate(load_journal(journal))
+    lock = threading.Lock()
+    latencies = defaultdict(list)
+    errors = []
+    start = perf_counter()
+
+    def due(i, entry):
+        if rate is not None:
+            return start + i / rate
+        if speed is not None:
+            return start + entry['ts'] / speed
+        return None
+
+    def run():
+        while True:
+            with lock:
+                i, entry = next(entries, (None, None))
+            if entry is None:
+                return
+            when = due(i, entry)
+            if when is not None:
+                time.sleep(max(0, when - perf_counter()))
+            db = _database(client, entry['db'])
+            method = getattr(db.get_collection(entry['coll']), entry['op'])
+            args = {name: _decode(value) for name, value in entry['args'].items()}
+            began = perf_counter()
+            try:
+                result = method(**args)
+                if entry['op'] in ('find', 'aggregate'):
+                    for _ in result:
+                        pass
+            except PyMongoError as e:
+                errors.append(e)
+            micros = (perf_counter() - began) * 1e6
+            with lock:
+                latencies[entry['op']].append(micros)
+
+    workers = [threading.Thread(target=run, daemon=True) for _ in range(threads - 1)]
+    for w in workers:
+        w.start()
+    run()
+    for w in workers:
+        w.join()
+    seconds = perf_counter() - start
+    ops = sum(len(v) for v in latencies.values())
+    return {
+        'ops': ops,
+        'errors': len(errors),
+        'seconds': seconds,
+        'throughput': ops / seconds if seconds else 0,
+        'latency': _latencies([m for v in latencies.values() for m in v]),
+        'by_op': {op: {'count': len(v), **_latencies(v)} for op, v in sorted(latencies.items())},
+    }
@@ -0,0 +1,415 @@
+import asyncio
+import struct
+from collections import Counter, OrderedDict
+from contextlib import nullcontext
+from datetime import datetime, timezone
+from itertools import chain, count, islice
+from time import monotonic
+
+import bson
+from bson.int64 import Int64
+from pymongo.errors import BulkWriteError, OperationFailure, PyMongoError
+
+from test.mock.loopback import LoopbackServer
+from test.mock.mongo import MockMongoClient
+from test.mock.mongo_query import MISSING, compile_filter
+
+OP_REPLY = 1
+OP_QUERY = 2004
+OP_MSG = 2013
+
+_HEADER = struct.Struct('<iiii')
+_CHECKSUM_PRESENT = 1
+_MORE_TO_COME = 2
+
+MAX_WIRE_VERSION = 17
+DEFAULT_BATCH_SIZE = 101
+# seconds an idle cursor lives, like the server's cursorTimeoutMillis, and the most kept open
+CURSOR_TIMEOUT = 600
+MAX_CURSORS = 1000
+
+
+def parse_msg(data):
+    ''' (flags, command) of an OP_MSG body, document sequences merged into the command '''
+    flags, = struct.unpack_from('<I', data)
+    end = len(data) - (4 if flags & _CHECKSUM_PRESENT else 0)
+    pos = 4
+    body, sequences = None, {}
+    while pos < end:
+        kind = data[pos]
+        size, = struct.unpack_from('<i', data, pos + 1)
+        if kind == 0:
+            body = bson.decode(data[pos + 1:pos + 1 + size])
+        else:
+            nul = data.index(b'\0', pos + 5)
+            sequences[data[pos + 5:nul].decode()] = bson.decode_all(data[nul + 1:pos + 1 + size])
+        pos += 1 + size
+    body.update(sequences)
+    return flags, body
+
+
+def parse_query(data):
+    ''' (namespace, query) of an OP_QUERY body '''
+    nul = data.index(b'\0', 4)
+    ns = data[4:nul].decode()
+    size, = struct.unpack_from('<i', data, nul + 9)
+    return ns, bson.decode(data[nul + 9:nul + 9 + size])
+
+
+def error_reply(e, default_code=8):
+    return {'ok': 0.0, 'errmsg': str(e), 'code': getattr(e, 'code', None) or default_code}
+
+
+def _write_error(index, e):
+    return {'index': index, 'code': getattr(e, 'code', None) or 2, 'errmsg': str(e)}
+
+
+class MockMongoServer(LoopbackServer):
+    ''' MongoDB wire protocol (OP_MSG, and OP_QUERY for the handshake) served from a MockMongoClient,
+    so clients in other threads or processes share one dataset '''
+    thread_name = 'mock-mongo-server'
+
+    def __init__(self, client=None, host='127.0.0.1', port=0):
+        super().__init__(host, port)
+        self.client = client if client is not None else MockMongoClient(None, thread_safe=True)
+        # cursor id -> (ns, docs, last used), least recently used first
+        self.cursors = OrderedDict()
+        self.cursor_timeout = CURSOR_TIMEOUT
+        self.max_cursors = MAX_CURSORS
+        self.commands = Counter()
+        self._cursor_ids = count(1)
+        self._request_ids = count(1)
+        self._handlers = {
+            'ping': lambda db, cmd: {},
+            'buildInfo': self._build_info,
+            'buildinfo': self._build_info,
+            'endSessions': lambda db, cmd: {},
+            'find': self._find,
+            'getMore': self._get_more,
+            'killCursors': self._kill_cursors,
+            'insert': self._insert,
+            'update': self._update,
+            'delete': self._delete,
+            'aggregate': self._aggregate,
+            'count': self._count,
+            'distinct': self._distinct,
+            'findAndModify': self._find_and_modify,
+            'createIndexes': self._create_indexes,
+            'dropIndexes': self._drop_indexes,
+            'listIndexes': self._list_indexes,
+            'listCollections': self._list_collections,
+            'create': self._create,
+            'drop': self._drop,
+            'listDatabases': self._list_databases,
+            'dropDatabase': self._drop_database,
+        }
+
+    @property
+    def uri(self):
+        return f'mongodb://{self.host}:{self.port}/?directConnection=true'
+
+    address = uri
+
+    async def _handle(self, reader, writer):
+        connection_id = next(self._connection_ids)
+        self.connections += 1
+        self._writers.add(writer)
+        try:
+            while True:
+                length, request_id, _, op_code = _HEADER.unpack(await reader.readexactly(16))
+                reply = self._reply(op_code, request_id, await reader.readexactly(length - 16),
+                                    connection_id)
+                if reply is not None:
+                    writer.write(reply)
+                    await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.connections -= 1
+            self._writers.discard(writer)
+            writer.close()
+
+    def _reply(self, op_code, request_id, data, connection_id):
+        if op_code == OP_MSG:
+            flags, cmd = parse_msg(data)
+            ret = self.run_command(cmd, connection_id)
+            if flags & _MORE_TO_COME:
+                return None
+            payload = struct.pack('<IB', 0, 0) + bson.encode(ret)
+            return _HEADER.pack(16 + len(payload), next(self._request_ids), request_id,
+                                OP_MSG) + payload
+        if op_code == OP_QUERY:
+            ns, query = parse_query(data)
+            if ns.endswith('.$cmd'):
+                cmd = dict(query.get('$query', query))
+                cmd['$db'] = ns[:-len('.$cmd')]
+                ret = self.run_command(cmd, connection_id)
+            else:
+                ret = {'$err': 'only commands are supported over OP_QUERY', 'code': 2, 'ok': 0.0}
+            payload = struct.pack('<iqii', 0, 0, 0, 1) + bson.encode(ret)
+            return _HEADER.pack(16 + len(payload), next(self._request_ids), request_id,
+                                OP_REPLY) + payload
+        raise ConnectionError(f'unsupported opcode {op_code}')
+
+    def database(self, name):
+        if name == self.client.db.name:
+            return self.client.db
+        return self.client[name]
+
+    def run_command(self, cmd, connection_id=0):
+        ''' reply document for a command document '''
+        name = next(iter(cmd))
+        self.commands[name] += 1
+        if name in ('hello', 'isMaster', 'ismaster'):
+            return self._hello(connection_id)
+        db = self.database(cmd.get('$db', 'admin'))
+        handler = self._handlers.get(name, self._command)
+        try:
+            ret = handler(db, cmd)
+        except Exception as e:
+            return error_reply(e)
+        ret.setdefault('ok', 1.0)
+        return ret
+
+    @staticmethod
+    def _hello(connection_id):
+        return {
+            'helloOk': True,
+            'ismaster': True,
+            'isWritablePrimary': True,
+            'maxBsonObjectSize': 16 * 1024 * 1024,
+            'maxMessageSizeBytes': 48000000,
+            'maxWriteBatchSize': 100000,
+            'localTime': datetime.now(tz=timezone.utc).replace(tzinfo=None),
+            'logicalSessionTimeoutMinutes': 30,
+            'connectionId': connection_id,
+            'minWireVersion': 0,
+            'maxWireVersion': MAX_WIRE_VERSION,
+            'readOnly': False,
+            'ok': 1.0,
+        }
+
+    @staticmethod
+    def _build_info(db, cmd):
+        return {'version': '6.0.0', 'versionArray': [6, 0, 0, 0], 'maxBsonObjectSize': 16 * 1024 * 1024}
+
+    @staticmethod
+    def _command(db, cmd):
+        ''' anything else goes to MockDatabase.command, merge_part, getParameter and the like '''
+        ret = db.command({k: v for k, v in cmd.items() if not k.startswith('$') and k != 'lsid'})
+        return dict(ret) if ret is not None else {}
+
+    def _cursor(self, ns, docs, batch_size, single_batch=False, cursor_id=None):
+        ''' next batch of docs as a cursor reply, keeping the rest for getMore '''
+        first = cursor_id is None
+        batch = list(islice(docs, DEFAULT_BATCH_SIZE if batch_size is None else batch_size))
+        rest = next(docs, MISSING)
+        if rest is MISSING or single_batch:
+            self.cursors.pop(cursor_id, None)
+            cursor_id = 0
+        else:
+            cursor_id = cursor_id or next(self._cursor_ids)
+            self.cursors[cursor_id] = (ns, chain([rest], docs), monotonic())
+            self.cursors.move_to_end(cursor_id)
+            self._expire_cursors()
+        return {'cursor': {'firstBatch' if first else 'nextBatch': batch,
+                           'id': Int64(cursor_id), 'ns': ns}}
+
+    def _expire_cursors(self):
+        ''' drop the cursors left idle past cursor_timeout, and the least recently used beyond
+        max_cursors, so abandoned ones do not pin their results forever '''
+        now = monotonic()
+        while self.cursors:
+            cursor_id, (_, _, used) = next(iter(self.cursors.items()))
+            if len(self.cursors) <= self.max_cursors and now - used <= self.cursor_timeout:
+                break
+            del self.cursors[cursor_id]
+
+    def _find(self, db, cmd):
+        coll = db.get_collection(cmd['find'])
+        limit = cmd.get('limit', 0)
+        docs = iter(coll.find(cmd.get('filter'), cmd.get('projection'), skip=cmd.get('skip', 0),
+                              limit=abs(limit), sort=cmd.get('sort') or None))
+        return self._cursor(coll.full_name, docs, cmd.get('batchSize'),
+                            cmd.get('singleBatch', False) or limit < 0)
+
+    def _get_more(self, db, cmd):
+        cursor_id = cmd['getMore']
+        self._expire_cursors()
+        if cursor_id not in self.cursors:
+            raise OperationFailure(f'cursor id {cursor_id} not found', 43)
+        ns, docs, _ = self.cursors[cursor_id]
+        return self._cursor(ns, docs, cmd.get('batchSize') or None, cursor_id=cursor_id)
+
+    def _kill_cursors(self, db, cmd):
+        killed = [i for i in cmd.get('cursors', []) if self.cursors.pop(i, None) is not None]
+        return {'cursorsKilled': killed,
+                'cursorsNotFound': [i for i in cmd.get('cursors', []) if i not in killed],
+                'cursorsAlive': [], 'cursorsUnknown': []}
+
+    @staticmethod
+    def _insert(db, cmd):
+        docs = cmd.get('documents', [])
+        try:
+            db.get_collection(cmd['insert']).insert_many(docs, ordered=cmd.get('ordered', True))
+        except BulkWriteError as e:
+            return {'n': e.details['nInserted'],
+                    'writeErrors': [{k: error[k] for k in ('index', 'code', 'errmsg')}
+                                    for error in e.details['writeErrors']]}
+        return {'n': len(docs)}
+
+    @staticmethod
+    def _update(db, cmd):
+        coll = db.get_collection(cmd['update'])
+        ret = {'n': 0, 'nModified': 0}
+        upserted, errors = [], []
+        for i, spec in enumerate(cmd.get('updates', [])):
+            q, u, upsert = spec.get('q', {}), spec['u'], spec.get('upsert', False)
+            try:
+                if isinstance(u, list):
+                    raise OperationFailure('update pipelines are not supported by the mock', 2)
+                if u and not any(k.startswith('$') for k in u):
+                    result = coll.replace_one(q, u, upsert=upsert)
+                elif spec.get('multi'):
+                    result = coll.update_many(q, u, upsert=upsert)
+                else:
+                    result = coll.update_one(q, u, upsert=upsert)
+            except PyMongoError as e:
+                errors.append(_write_error(i, e))
+                if cmd.get('ordered', True):
+                    break
+                continue
+            ret['n'] += result.matched_count + result.upsert_count
+            ret['nModified'] += result.modified_count
+            if result.upsert_count:
+                upserted.append({'index': i, '_id': result.upserted_id})
+        if upserted:
+            ret['upserted'] = upserted
+        if errors:
+            ret['writeErrors'] = errors
+        return ret
+
+    @staticmethod
+    def _delete(db, cmd):
+        coll = db.get_collection(cmd['delete'])
+        ret = {'n': 0}
+        errors = []
+        for i, spec in enumerate(cmd.get('deletes', [])):
+            delete = coll.delete_one if spec.get('limit') else coll.delete_many
+            try:
+                ret['n'] += delete(spec.get('q', {})).deleted_count
+            except PyMongoError as e:
+                errors.append(_write_error(i, e))
+                if cmd.get('ordered', True):
+                    break
+        if errors:
+            ret['writeErrors'] = errors
+        return ret
+
+    def _aggregate(self, db, cmd):
+        coll = db.get_collection(cmd['aggregate'])
+        if cmd.get('explain'):
+            return coll.aggregate(cmd['pipeline'], explain=True)
+        docs = iter(coll.aggregate(cmd['pipeline']))
+        return self._cursor(coll.full_name, docs, cmd.get('cursor', {}).get('batchSize'))
+
+    @staticmethod
+    def _count(db, cmd):
+        coll = db.get_collection(cmd['count'])
+        return {'n': coll.count_documents(cmd.get('query'), skip=cmd.get('skip', 0),
+                                          limit=cmd.get('limit', 0))}
+
+    @staticmethod
+    def _distinct(db, cmd):
+        return {'values': db.get_collection(cmd['distinct']).distinct(cmd['key'], cmd.get('query'))}
+
+    @staticmethod
+    def _find_and_modify(db, cmd):
+        coll = db.get_collection(cmd['findAndModify'])
+        q, sort, fields = cmd.get('query') or {}, cmd.get('sort'), cmd.get('fields')
+        if cmd.get('remove'):
+            doc = coll.find_one_and_delete(q, projection=fields, sort=sort)
+            return {'lastErrorObject': {'n': int(doc is not None)}, 'value': doc}
+        u, upsert, new = cmd.get('update') or {}, cmd.get('upsert', False), cmd.get('new', False)
+        if isinstance(u, dict) and not any(k.startswith('$') for k in u):
+            modify = coll.find_one_and_replace
+        else:
+            modify = coll.find_one_and_update
+        if not (upsert and new):
+            # the pre-image is None exactly when nothing matched, upserted or not
+            doc = modify(q, u, projection=fields, sort=sort, upsert=upsert, return_document=new)
+            existed = doc is not None
+        else:
+            # the post-image is there either way, an upsert shows as one more document
+            with coll._lock.writing() if coll._lock is not None else nullcontext():
+                size = len(coll.data)
+                doc = modify(q, u, projection=fields, sort=sort, upsert=True, return_document=True)
+                existed = len(coll.data) == size
+        return {'lastErrorObject': {'n': int(existed or upsert), 'updatedExisting': existed},
+                'value': doc}
+
+    @staticmethod
+    def _create_indexes(db, cmd):
+        coll = db.get_collection(cmd['createIndexes'])
+        before = len(coll.index_information())
+        for spec in cmd.get('indexes', []):
+            options = {k: v for k, v in spec.items() if k not in ('key', 'v')}
+            coll.create_index(list(spec['key'].items()), **options)
+        return {'createdCollectionAutomatically': False, 'numIndexesBefore': before,
+                'numIndexesAfter': len(coll.index_information())}
+
+    @staticmethod
+    def _drop_indexes(db, cmd):
+        coll = db.get_collection(cmd['dropIndexes'])
+        before = len(coll.index_information())
+        if cmd['index'] == '*':
+            coll.drop_indexes()
+        else:
+            coll.drop_index(cmd['index'])
+        return {'nIndexesWas': before}
+
+    def _list_indexes(self, db, cmd):
+        coll = db.get_collection(cmd['listIndexes'])
+        docs = [{**info, 'key': dict(info['key']), 'name': name}
+                for name, info in coll.index_information().items()]
+        return self._cursor(coll.full_name, iter(docs), cmd.get('cursor', {}).get('batchSize'))
+
+    def _list_collections(self, db, cmd):
+        predicate = compile_filter(cmd.get('filter'))
+        docs = [{'name': name, 'type': 'collection', 'options': {}, 'info': {'readOnly': False}}
+                for name in db.list_collection_names()]
+        return self._cursor(f'{db.name}.$cmd.listCollections',
+                            (d for d in docs if predicate(d)),
+                            cmd.get('cursor', {}).get('batchSize'))
+
+    @staticmethod
+    def _create(db, cmd):
+        if cmd['create'] in db.collections:
+            raise OperationFailure(f'Collection {db.name}.{cmd["create"]} already exists.', 48)
+        db.create_collection(cmd['create'], capped=cmd.get('capped', False), size=cmd.get('size'),
+                             max=cmd.get('max'))
+        return {}
+
+    @staticmethod
+    def _drop(db, cmd):
+        if cmd['drop'] not in db.collections:
+            raise OperationFailure('ns not found', 26)
+        db.drop_collection(cmd['drop'])
+        return {'ns': f'{db.name}.{cmd["drop"]}'}
+
+    def _list_databases(self, db, cmd):
+        names = [self.client.db.name, *self.client.databases]
+        return {'databases': [{'name': name, 'sizeOnDisk': 0, 'empty': False} for name in names],
+                'totalSize': 0}
+
+    def _drop_database(self, db, cmd):
+        if db is self.client.db:
+            db.collections = {}
+        else:
+            self.client.databases.pop(db.name, None)
+        return {'dropped': db.name}
+
+
+if __name__ == '__main__':
+    # python -m test.mock.mongo_server [port], one dataset for every test process
+    MockMongoServer.main()
@@ -0,0 +1,333 @@
+from copy import deepcopy
+from datetime import datetime, timezone
+
+from bson.timestamp import Timestamp
+from pymongo.errors import InvalidOperation, WriteError
+
+from test.mock.mongo_query import MISSING, _equal, compile_filter, is_operator, sort_key, \
+    sort_key_function, sort_spec
+
+
+def fix_date(doc):
+    if isinstance(doc, dict):
+        ret = dict()
+        for k, v in doc.items():
+            ret[k] = fix_date(v)
+        return ret
+    if isinstance(doc, datetime) and doc.tzinfo is not None:
+        return doc.astimezone(tz=timezone.utc).replace(tzinfo=None)
+
+    return doc
+
+
+def _copy(value):
+    return deepcopy(value) if isinstance(value, (dict, list)) else value
+
+
+def _same(old, new):
+    return type(old) is type(new) and old == new
+
+
+def _rollback(undo):
+    ''' revert the changes logged in undo, latest first. An entry is (node, key, old value):
+    MISSING for a key that was added, and key None for the length of an array before it grew or
+    the key order of a document before one of its fields was removed '''
+    for node, key, old in reversed(undo):
+        if key is None:
+            if isinstance(node, list):
+                del node[old:]
+            else:
+                ordered = {k: node[k] for k in old}
+                node.clear()
+                node.update(ordered)
+        elif old is MISSING:
+            del node[key]
+        else:
+            node[key] = old
+
+
+def _extend(node, i, undo):
+    if undo is not None:
+        undo.append((node, None, len(node)))
+    node.extend([None] * (i - len(node) + 1))
+
+
+def _container(doc, parts, create, undo=None):
+    ''' document or array holding the last part of a path, None if there is none. What create
+    adds is logged in undo '''
+    node = doc
+    for part in parts[:-1]:
+        if isinstance(node, dict):
+            if part not in node:
+                if not create:
+                    return None
+                if undo is not None:
+                    undo.append((node, part, MISSING))
+                node[part] = {}
+            nxt = node[part]
+        elif isinstance(node, list) and part.isdigit():
+            i = int(part)
+            if i >= len(node):
+                if not create:
+                    return None
+                _extend(node, i, undo)
+            if node[i] is None and create:
+                if undo is not None:
+                    undo.append((node, i, None))
+                node[i] = {}
+            nxt = node[i]
+        else:
+            nxt = None
+        if not isinstance(nxt, (dict, list)):
+            if create:
+                raise WriteError(f'Cannot create field \'{parts[-1]}\' in element '
+                                 f'{{{part}: {nxt!r}}}', 28)
+            return None
+        node = nxt
+    return node
+
+
+def _get(node, key):
+    if isinstance(node, dict):
+        return node.get(key, MISSING)
+    if isinstance(node, list) and key.isdigit() and int(key) < len(node):
+        return node[int(key)]
+    return MISSING
+
+
+def _put(node, key, value, undo=None):
+    if isinstance(node, dict):
+        if undo is not None:
+            undo.append((node, key, node.get(key, MISSING)))
+        node[key] = value
+    elif key.isdigit():
+        i = int(key)
+        if i >= len(node):
+            _extend(node, i, undo)
+        if undo is not None:
+            undo.append((node, i, node[i]))
+        node[i] = value
+    else:
+        raise WriteError(f'Cannot create field \'{key}\' in an array', 28)
+
+
+def _number(value, op):
+    if not isinstance(value, (int, float)) or isinstance(value, bool):
+        raise WriteError(f'Cannot apply {op} to a value of non-numeric type', 14)
+    return value
+
+
+def _array(value, op):
+    if not isinstance(value, list):
+        raise WriteError(f'The field is not an array, cannot apply {op}', 2)
+    return value
+
+
+# operators: (node, key, old value, argument) -> new value, or MISSING for no change
+
+def _set(node, key, old, value):
+    if old is not MISSING and _same(old, value):
+        return MISSING
+    return _copy(value)
+
+
+def _inc(node, key, old, value):
+    if old is MISSING:
+        return _number(value, '$inc')
+    new = _number(old, '$inc') + _number(value, '$inc')
+    return MISSING if _same(old, new) else new
+
+
+def _mul(node, key, old, value):
+    if old is MISSING:
+        return type(_number(value, '$mul'))(0)
+    new = _number(old, '$mul') * _number(value, '$mul')
+    return MISSING if _same(old, new) else new
+
+
+def _extreme(replace):
+    def op(node, key, old, value):
+        if old is MISSING or replace(sort_key(value), sort_key(old)):
+            return _copy(value)
+        return MISSING
+    return op
+
+
+def _each(value):
+    if isinstance(value, dict) and '$each' in value:
+        return value['$each'], value
+    return [value], {}
+
+
+def _push(node, key, old, value):
+    values, modifiers = _each(value)
+    array = [] if old is MISSING else list(_array(old, '$push'))
+    position = modifiers.get('$position')
+    values = [_copy(v) for v in values]
+    if position is None:
+        array.extend(values)
+    else:
+        array[position:position] = values
+    if '$sort' in modifiers:
+        spec = modifiers['$sort']
+        if isinstance(spec, dict):
+            key_fn, reverse = sort_key_function(sort_spec(spec))
+        else:
+            key_fn, reverse = sort_key, spec == -1
+        array.sort(key=key_fn, reverse=reverse)
+    if '$slice' in modifiers:
+        n = modifiers['$slice']
+        array = array[:n] if n >= 0 else array[n:]
+    return MISSING if old is not MISSING and _equal(old, array) else array
+
+
+def _add_to_set(node, key, old, value):
+    values, _ = _each(value)
+    array = [] if old is MISSING else _array(old, '$addToSet')
+    added = [_copy(v) for v in values if not any(_equal(v, e) for e in array)]
+    added = [v for i, v in enumerate(added) if not any(_equal(v, e) for e in added[:i])]
+    if old is not MISSING and not added:
+        return MISSING
+    return array + added
+
+
+def _pull(node, key, old, value):
+    if old is MISSING:
+        return MISSING
+    if isinstance(value, dict) and is_operator(value):
+        test = compile_filter({'v': value})
+        matches = lambda e: test({'v': e})
+    elif isinstance(value, dict):
+        test = compile_filter(value)
+        matches = lambda e: isinstance(e, dict) and test(e)
+    else:
+        matches = lambda e: _equal(e, value)
+    array = [e for e in _array(old, '$pull') if not matches(e)]
+    return MISSING if len(array) == len(old) else array
+
+
+def _pop(node, key, old, value):
+    if old is MISSING or not _array(old, '$pop'):
+        return MISSING
+    return old[1:] if value == -1 else old[:-1]
+
+
+def _current_date(node, key, old, value):
+    now = datetime.now(tz=timezone.utc).replace(tzinfo=None)
+    if isinstance(value, dict) and value.get('$type') == 'timestamp':
+        return Timestamp(now, 0)
+    return now
+
+
+_OPERATORS = {
+    '$set': _set,
+    '$setOnInsert': _set,
+    '$inc': _inc,
+    '$mul': _mul,
+    '$min': _extreme(lambda new, old: new < old),
+    '$max': _extreme(lambda new, old: new > old),
+    '$push': _push,
+    '$addToSet': _add_to_set,
+    '$pull': _pull,
+    '$pop': _pop,
+    '$currentDate': _current_date,
+}
+
+
+def _conflicts(a, b):
+    return a == b or a.startswith(b + '.') or b.startswith(a + '.')
+
+
+class Updater:
+    ''' an update document compiled once and applied in place to any number of documents '''
+    def __init__(self, spec):
+        self.steps = []
+        self.paths = []
+        for op, fields in (spec or {}).items():
+            if not op.startswith('$') or (op not in _OPERATORS and op not in ('$unset', '$rename')):
+                raise InvalidOperation(f'unsupported update operator: {op}')
+            for path, value in fields.items():
+                targets = [path, value] if op == '$rename' else [path]
+                for target in targets:
+                    conflict = next((p for p in self.paths if _conflicts(p, target)), None)
+                    if conflict is not None:
+                        raise WriteError(f'Updating the path \'{target}\' would create a '
+                                         f'conflict at \'{conflict}\'', 40)
+                    self.paths.append(target)
+                self.steps.append((op, path, path.split('.'), fix_date(value)))
+
+    def touches(self, fields):
+        return any(_conflicts(p, f) for p in self.paths for f in fields)
+
+    def __call__(self, doc, insert=False):
+        ''' apply to doc, returns whether doc changed. Either every step applies or, when one
+        fails, the changes of the others are rolled back. The operators build new values rather
+        than change the old ones, so the undo log only keeps references to them '''
+        undo = []
+        try:
+            return self._apply(doc, insert, undo)
+        except Exception:
+            _rollback(undo)
+            raise
+
+    def _apply(self, doc, insert, undo):
+        modified = False
+        for op, path, parts, value in self.steps:
+            if op == '$setOnInsert' and not insert:
+                continue
+            if parts[0] == '_id':
+                self._check_id(doc, op, path, parts, value)
+            if op == '$unset':
+                modified |= self._unset(doc, parts, undo) is not MISSING
+            elif op == '$rename':
+                moved = self._unset(doc, parts, undo)
+                if moved is not MISSING:
+                    new_parts = value.split('.')
+                    _put(_container(doc, new_parts, True, undo), new_parts[-1], moved, undo)
+                    modified = True
+            else:
+                node = _container(doc, parts, True, undo)
+                new = _OPERATORS[op](node, parts[-1], _get(node, parts[-1]), value)
+                if new is not MISSING:
+                    _put(node, parts[-1], new, undo)
+                    modified = True
+        return modified
+
+    @staticmethod
+    def _unset(doc, parts, undo):
+        node = _container(doc, parts, False)
+        old = MISSING if node is None else _get(node, parts[-1])
+        if old is not MISSING:
+            if isinstance(node, dict):
+                undo.append((node, None, list(node)))
+                undo.append((node, parts[-1], old))
+                del node[parts[-1]]
+            else:
+                undo.append((node, int(parts[-1]), old))
+                node[int(parts[-1])] = None
+        return old
+
+    @staticmethod
+    def _check_id(doc, op, path, parts, value):
+        if op in ('$set', '$setOnInsert') and len(parts) == 1 and \
+                ('_id' not in doc or _same(doc['_id'], value)):
+            return
+        raise WriteError('Performing an update on the path \'_id\' would modify '
+                         'the immutable field \'_id\'', 66)
+
+
+def compile_update(spec):
+    return Updater(spec)
+
+
+def upsert_document(_filter, updater):
+    ''' document inserted by an upsert: equality fields of the filter with the update applied '''
+    doc = {}
+    for k, v in (_filter or {}).items():
+        if k.startswith('$') or is_operator(v) and '$eq' not in v:
+            continue
+        v = v['$eq'] if is_operator(v) else v
+        parts = k.split('.')
+        _put(_container(doc, parts, True), parts[-1], _copy(fix_date(v)))
+    updater(doc, insert=True)
+    return doc
@@ -0,0 +1,186 @@
+import asyncio
+
+from test.mock.mongo import PAUSE, MockCursor, MockMongoClient
+
+# documents examined (or, for aggregations, served) between two yields to the event loop
+YIELD_EVERY = 100
+
+
+class MockMotorCursor:
+    ''' async iteration over a MockCursor or an aggregation, following motor's cursors '''
+    def __init__(self, cursor, yield_every=YIELD_EVERY):
+        self.delegate = cursor
+        self.yield_every = yield_every
+        self._served = 0
+        if isinstance(cursor, MockCursor):
+            cursor._pace = yield_every
+
+    def _chain(name):
+        def method(self, *args, **kwargs):
+            getattr(self.delegate, name)(*args, **kwargs)
+            return self
+        method.__name__ = name
+        return method
+
+    sort = _chain('sort')
+    skip = _chain('skip')
+    limit = _chain('limit')
+    batch_size = _chain('batch_size')
+    del _chain
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not isinstance(self.delegate, MockCursor):
+            self._served += 1
+            if self._served % self.yield_every == 0:
+                await asyncio.sleep(0)
+        while True:
+            try:
+                doc = next(self.delegate)
+            except StopIteration:
+                raise StopAsyncIteration from None
+            if doc is not PAUSE:
+                return doc
+            await asyncio.sleep(0)
+
+    async def next(self):
+        return await self.__anext__()
+
+    async def to_list(self, length=None):
+        ret = []
+        async for doc in self:
+            ret.append(doc)
+            if length is not None and len(ret) >= length:
+                break
+        return ret
+
+    @property
+    def alive(self):
+        return getattr(self.delegate, 'alive', True)
+
+    def clone(self):
+        return MockMotorCursor(self.delegate.clone(), self.yield_every)
+
+    async def close(self):
+        if hasattr(self.delegate, 'close'):
+            self.delegate.close()
+
+    async def explain(self):
+        return self.delegate.explain()
+
+
+def _async(name):
+    async def method(self, *args, **kwargs):
+        ret = getattr(self.delegate, name)(*args, **kwargs)
+        await asyncio.sleep(0)
+        return ret
+    method.__name__ = name
+    return method
+
+
+class MockMotorCollection:
+    ''' awaitable wrapper of a MockCollection '''
+    def __init__(self, collection, yield_every=YIELD_EVERY):
+        self.delegate = collection
+        self.yield_every = yield_every
+
+    @property
+    def name(self):
+        return self.delegate.name
+
+    @property
+    def full_name(self):
+        return self.delegate.full_name
+
+    def find(self, *args, **kwargs):
+        return MockMotorCursor(self.delegate.find(*args, **kwargs), self.yield_every)
+
+    def aggregate(self, pipeline, **kwargs):
+        return MockMotorCursor(self.delegate.aggregate(pipeline, **kwargs), self.yield_every)
+
+    find_one = _async('find_one')
+    insert_one = _async('insert_one')
+    insert_many = _async('insert_many')
+    update_one = _async('update_one')
+    update_many = _async('update_many')
+    replace_one = _async('replace_one')
+    delete_one = _async('delete_one')
+    delete_many = _async('delete_many')
+    bulk_write = _async('bulk_write')
+    find_one_and_delete = _async('find_one_and_delete')
+    find_one_and_replace = _async('find_one_and_replace')
+    find_one_and_update = _async('find_one_and_update')
+    count_documents = _async('count_documents')
+    estimated_document_count = _async('estimated_document_count')
+    distinct = _async('distinct')
+    create_index = _async('create_index')
+    create_indexes = _async('create_indexes')
+    drop_index = _async('drop_index')
+    drop_indexes = _async('drop_indexes')
+    index_information = _async('index_information')
+    drop = _async('drop')
+
+
+class MockMotorDatabase:
+    ''' awaitable wrapper of a MockDatabase '''
+    def __init__(self, db, yield_every=YIELD_EVERY):
+        self.delegate = db
+        self.yield_every = yield_every
+
+    @property
+    def name(self):
+        return self.delegate.name
+
+    def __getitem__(self, key):
+        return self.get_collection(key)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self.get_collection(name)
+
+    def get_collection(self, name):
+        ''' resolved by MockDatabase.get_collection, so gid and system are the seeded ones '''
+        return MockMotorCollection(self.delegate.get_collection(name), self.yield_every)
+
+    async def create_collection(self, name, **kwargs):
+        self.delegate.create_collection(name, **kwargs)
+        return self[name]
+
+    async def drop_collection(self, name_or_collection):
+        if isinstance(name_or_collection, MockMotorCollection):
+            name_or_collection = name_or_collection.delegate
+        elif isinstance(name_or_collection, str):
+            name_or_collection = self.delegate.collections.get(name_or_collection)
+        self.delegate.drop_collection(name_or_collection)
+
+    async def list_collection_names(self):
+        return list(self.delegate.list_collection_names())
+
+    command = _async('command')
+
+
+class MockMotorClient:
+    ''' motor AsyncIOMotorClient over a MockMongoClient '''
+    def __init__(self, uri=None, client=None, yield_every=YIELD_EVERY, **kwargs):
+        self.delegate = client if client is not None else MockMongoClient(uri, **kwargs)
+        self.yield_every = yield_every
+
+    def __getitem__(self, key):
+        return MockMotorDatabase(self.delegate[key], self.yield_every)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self[name]
+
+    def get_database(self, name=None):
+        return self[name] if name else self.get_default_database()
+
+    def get_default_database(self):
+        return MockMotorDatabase(self.delegate.get_default_database(), self.yield_every)
+
+    def close(self):
+        pass
@@ -1,7 +1,13 @@
-import os
-import shutil
+import posixpath
+import stat
 from paramiko.sftp_attr import SFTPAttributes
 
+from test.mock.paramiko_fs import LocalFS, Shaper
+
+# bytes per read or write of a transfer, the largest request paramiko sends
+CHUNK_SIZE = 32768
+
+
 class MockTransport:
     def __init__(self, *kargs):
         pass
@@ -26,15 +32,35 @@ class MockTransport:
 
 
 class MockSFTPClient:
+    ''' SFTP client over a filesystem backend: the real disk (LocalFS) unless filesystem, or the
+    class attribute of the same name, is another one like a MemoryFS. Each client has its own
+    working directory, and may add latency to every request and cap the transfer bandwidth '''
+    filesystem = None
+
+    def __init__(self, filesystem=None, bandwidth=None, latency=0):
+        if filesystem is None:
+            filesystem = self.filesystem if self.filesystem is not None else LocalFS()
+        self.fs = filesystem
+        self.cwd = filesystem.cwd
+        self.shaper = Shaper(bandwidth, latency)
+
     @classmethod
     def from_transport_(cls, t, **kargs):
         return cls()
 
+    def _path(self, path):
+        return posixpath.normpath(posixpath.join(self.cwd, path))
+
     def chdir(self, path):
-        os.chdir(path)
+        self.shaper.request()
+        path = self._path(path)
+        if not stat.S_ISDIR(self.fs.stat(path).st_mode):
+            raise NotADirectoryError(f'Not a directory: {path}')
+        self.cwd = path
 
-    def mkdir(self, path):
-        os.mkdir(path)
+    def mkdir(self, path, mode=0o777):
+        self.shaper.request()
+        self.fs.mkdir(self._path(path), mode)
 
     def close(self):
         pass
@@ -43,32 +69,89 @@ class MockSFTPClient:
         pass
 
     def stat(self, path):
-        return os.stat(path)
+        self.shaper.request()
+        return SFTPAttributes.from_stat(self.fs.stat(self._path(path)))
+
+    def lstat(self, path):
+        self.shaper.request()
+        return SFTPAttributes.from_stat(self.fs.lstat(self._path(path)))
+
+    def chmod(self, path, mode):
+        self.shaper.request()
+        self.fs.chmod(self._path(path), mode)
 
     def unlink(self, path):
-        os.unlink(path)
+        self.shaper.request()
+        self.fs.unlink(self._path(path))
 
-    def get(self, remote, local):
-        shutil.copy(remote, local)
+    remove = unlink
 
-    def listdir(self, path):
-        return os.listdir(path)
+    def open(self, filename, mode='r', bufsize=-1):
+        self.shaper.request()
+        return self.fs.open(self._path(filename), mode)
 
-    def posix_rename(self, src, dst):
-        return os.rename(src, dst)
+    file = open
 
-    def listdir_attr(self, path="."):
+    def getfo(self, remotepath, fl, callback=None):
+        ''' copy a remote file into the open file fl, returns the bytes copied '''
+        with self.open(remotepath, 'rb') as remote:
+            return self._copy(remote, fl, callback)
+
+    def get(self, remotepath, localpath, callback=None):
+        with open(localpath, 'wb') as local:
+            self.getfo(remotepath, local, callback)
+
+    def putfo(self, fl, remotepath, file_size=0, callback=None, confirm=True):
+        with self.open(remotepath, 'wb') as remote:
+            self._copy(fl, remote, callback)
+        return self.stat(remotepath) if confirm else SFTPAttributes()
+
+    def put(self, localpath, remotepath, callback=None, confirm=True):
+        with open(localpath, 'rb') as local:
+            return self.putfo(local, remotepath, callback=callback, confirm=confirm)
+
+    def _copy(self, src, dst, callback):
+        size = 0
+        for chunk in self.shaper.transfer(iter(lambda: src.read(CHUNK_SIZE), b'')):
+            dst.write(chunk)
+            size += len(chunk)
+            if callback is not None:
+                callback(size, 0)
+        return size
+
+    def listdir(self, path='.'):
+        self.shaper.request()
+        return self.fs.listdir(self._path(path))
+
+    def posix_rename(self, src, dst):
+        self.shaper.request()
+        return self.fs.rename(self._path(src), self._path(dst))
+
+    def rename(self, oldpath, newpath):
+        ''' SFTP rename, which unlike posix_rename will not replace newpath '''
+        self.shaper.request()
+        oldpath, newpath = self._path(oldpath), self._path(newpath)
+        try:
+            self.fs.lstat(newpath)
+        except FileNotFoundError:
+            return self.fs.rename(oldpath, newpath)
+        raise FileExistsError(f'File exists: {newpath}')
+
+    def listdir_attr(self, path='.'):
+        self.shaper.request()
+        path = self._path(path)
         ret = []
-        for filename in os.listdir(path):
-            child = os.lstat(filename)
+        for filename in self.fs.listdir(path):
+            child = self.fs.lstat(posixpath.join(path, filename))
             ret.append(SFTPAttributes.from_stat(child, filename))
         return ret
 
     def rmdir(self, path):
-        os.rmdir(path)
+        self.shaper.request()
+        self.fs.rmdir(self._path(path))
 
     def getcwd(self):
-        return os.getcwd()
+        return self.cwd
 
     def get_channel(self):
         return MockChannel()
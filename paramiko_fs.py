@@ -0,0 +1,280 @@
+import errno
+import io
+import os
+import posixpath
+import stat
+import threading
+import time
+from itertools import count
+
+
+def _error(code, path):
+    return OSError(code, os.strerror(code), path)
+
+
+class LocalFS:
+    ''' the real filesystem, what MockSFTPClient used directly before backends '''
+    def __init__(self, cwd=None):
+        self.cwd = cwd if cwd is not None else os.getcwd()
+
+    def stat(self, path):
+        return os.stat(path)
+
+    def lstat(self, path):
+        return os.lstat(path)
+
+    def listdir(self, path):
+        return os.listdir(path)
+
+    def mkdir(self, path, mode=0o777):
+        os.mkdir(path, mode)
+
+    def rmdir(self, path):
+        os.rmdir(path)
+
+    def unlink(self, path):
+        os.unlink(path)
+
+    def rename(self, src, dst):
+        os.rename(src, dst)
+
+    def chmod(self, path, mode):
+        os.chmod(path, mode)
+
+    def open(self, path, mode='r'):
+        return open(path, mode.replace('b', '') + 'b')
+
+
+class _Inode:
+    __slots__ = ('ino', 'mode', 'uid', 'gid', 'atime', 'mtime', 'children', 'data')
+
+    def __init__(self, ino, mode, uid, gid):
+        self.ino = ino
+        self.mode = mode
+        self.uid = uid
+        self.gid = gid
+        self.atime = self.mtime = time.time()
+        # name -> inode for directories, the contents for files
+        self.children = {} if stat.S_ISDIR(mode) else None
+        self.data = None if stat.S_ISDIR(mode) else bytearray()
+
+    def stat(self):
+        size = len(self.data) if self.data is not None else 4096
+        nlink = 2 if self.children is not None else 1
+        return os.stat_result((self.mode, self.ino, 0, nlink, self.uid, self.gid, size,
+                               int(self.atime), int(self.mtime), int(self.mtime)))
+
+
+class MemoryFS:
+    ''' in memory tree of inodes: directories map names to inodes, files hold a bytearray.
+    Share one between clients to give them the same remote host '''
+    def __init__(self, uid=None, gid=None):
+        self.uid = os.getuid() if uid is None else uid
+        self.gid = os.getgid() if gid is None else gid
+        self.cwd = '/'
+        self._inos = count(1)
+        self._lock = threading.RLock()
+        self.root = _Inode(next(self._inos), stat.S_IFDIR | 0o755, self.uid, self.gid)
+
+    def _lookup(self, path):
+        node = self.root
+        for name in posixpath.normpath(path).split('/'):
+            if not name or name == '.':
+                continue
+            if node.children is None:
+                raise _error(errno.ENOTDIR, path)
+            node = node.children.get(name)
+            if node is None:
+                raise _error(errno.ENOENT, path)
+        return node
+
+    def _parent(self, path):
+        ''' (directory inode, name) of the entry path names '''
+        head, name = posixpath.split(posixpath.normpath(path))
+        parent = self._lookup(head)
+        if parent.children is None:
+            raise _error(errno.ENOTDIR, path)
+        if not name or name in ('.', '..'):
+            raise _error(errno.EINVAL, path)
+        return parent, name
+
+    def _create(self, path, mode):
+        parent, name = self._parent(path)
+        if name in parent.children:
+            raise _error(errno.EEXIST, path)
+        node = parent.children[name] = _Inode(next(self._inos), mode, self.uid, self.gid)
+        parent.mtime = node.mtime
+        return node
+
+    def stat(self, path):
+        with self._lock:
+            return self._lookup(path).stat()
+
+    lstat = stat
+
+    def listdir(self, path):
+        with self._lock:
+            node = self._lookup(path)
+            if node.children is None:
+                raise _error(errno.ENOTDIR, path)
+            return list(node.children)
+
+    def mkdir(self, path, mode=0o777):
+        with self._lock:
+            self._create(path, stat.S_IFDIR | (mode & 0o7777))
+
+    def rmdir(self, path):
+        with self._lock:
+            parent, name = self._parent(path)
+            node = parent.children.get(name)
+            if node is None:
+                raise _error(errno.ENOENT, path)
+            if node.children is None:
+                raise _error(errno.ENOTDIR, path)
+            if node.children:
+                raise _error(errno.ENOTEMPTY, path)
+            del parent.children[name]
+
+    def unlink(self, path):
+        with self._lock:
+            parent, name = self._parent(path)
+            node = parent.children.get(name)
+            if node is None:
+                raise _error(errno.ENOENT, path)
+            if node.children is not None:
+                raise _error(errno.EISDIR, path)
+            del parent.children[name]
+
+    def rename(self, src, dst):
+        ''' posix rename: replaces a file, or an empty directory, at dst '''
+        with self._lock:
+            src_parent, src_name = self._parent(src)
+            node = src_parent.children.get(src_name)
+            if node is None:
+                raise _error(errno.ENOENT, src)
+            dst_parent, dst_name = self._parent(dst)
+            target = dst_parent.children.get(dst_name)
+            if target is node:
+                return
+            if target is not None:
+                if target.children is not None and node.children is None:
+                    raise _error(errno.EISDIR, dst)
+                if target.children is None and node.children is not None:
+                    raise _error(errno.ENOTDIR, dst)
+                if target.children:
+                    raise _error(errno.ENOTEMPTY, dst)
+            if node.children is not None and \
+                    posixpath.normpath(dst).startswith(posixpath.normpath(src) + '/'):
+                raise _error(errno.EINVAL, dst)
+            dst_parent.children[dst_name] = src_parent.children.pop(src_name)
+
+    def chmod(self, path, mode):
+        with self._lock:
+            node = self._lookup(path)
+            node.mode = stat.S_IFMT(node.mode) | (mode & 0o7777)
+
+    def open(self, path, mode='r'):
+        ''' binary file object over the contents of a file, paramiko modes: r w a x and + '''
+        mode = mode.replace('b', '')
+        with self._lock:
+            try:
+                node = self._lookup(path)
+            except FileNotFoundError:
+                if mode.startswith('r'):
+                    raise
+                node = self._create(path, stat.S_IFREG | 0o644)
+            else:
+                if mode.startswith('x'):
+                    raise _error(errno.EEXIST, path)
+                if node.children is not None:
+                    raise _error(errno.EISDIR, path)
+                if mode.startswith('w'):
+                    del node.data[:]
+                    node.mtime = time.time()
+        return MemoryFile(node, mode)
+
+
+class MemoryFile(io.RawIOBase):
+    ''' file of a MemoryFS, reads slice the contents and writes go straight into them '''
+    def __init__(self, node, mode):
+        super().__init__()
+        self._node = node
+        self._readable = mode.startswith('r') or '+' in mode
+        self._writable = not mode.startswith('r') or '+' in mode
+        self._append = mode.startswith('a')
+        self._pos = 0
+
+    def readable(self):
+        return self._readable
+
+    def writable(self):
+        return self._writable
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        if not self._readable:
+            raise io.UnsupportedOperation('not readable')
+        data = self._node.data
+        n = max(0, min(len(buffer), len(data) - self._pos))
+        buffer[:n] = data[self._pos:self._pos + n]
+        self._pos += n
+        self._node.atime = time.time()
+        return n
+
+    def write(self, b):
+        if not self._writable:
+            raise io.UnsupportedOperation('not writable')
+        data = self._node.data
+        if self._append:
+            self._pos = len(data)
+        if self._pos > len(data):
+            data.extend(bytes(self._pos - len(data)))
+        data[self._pos:self._pos + len(b)] = b
+        self._pos += len(b)
+        self._node.mtime = time.time()
+        return len(b)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._node.data)
+        if offset < 0:
+            raise ValueError(f'negative seek position {offset}')
+        self._pos = offset
+        return offset
+
+    def tell(self):
+        return self._pos
+
+    def truncate(self, size=None):
+        size = self._pos if size is None else size
+        del self._node.data[size:]
+        return size
+
+    def stat(self):
+        return self._node.stat()
+
+
+class Shaper:
+    ''' latency added to every request, and transfers held to bandwidth bytes per second '''
+    def __init__(self, bandwidth=None, latency=0):
+        self.bandwidth = bandwidth
+        self.latency = latency
+
+    def request(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def transfer(self, chunks):
+        ''' pass chunks through, sleeping whenever they run ahead of the bandwidth '''
+        start, sent = time.perf_counter(), 0
+        for chunk in chunks:
+            yield chunk
+            sent += len(chunk)
+            if self.bandwidth:
+                ahead = start + sent / self.bandwidth - time.perf_counter()
+                if ahead > 0:
+                    time.sleep(ahead)
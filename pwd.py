@@ -1,4 +1,5 @@
 from collections import namedtuple
+from os import PathLike
 from subprocess import CalledProcessError
 
 from test.mock.subprocess import validate_run_args
@@ -8,6 +9,20 @@ struct_passwd = namedtuple('struct_passwd',
                             'pw_gid', 'pw_gecos', 'pw_dir', 'pw_shell'])
 
 
+def read_passwd(source):
+    ''' entries of an /etc/passwd format file, from a path or an open file, one line at a time '''
+    if isinstance(source, (str, PathLike)):
+        with open(source) as f:
+            yield from read_passwd(f)
+        return
+    for line in source:
+        line = line.rstrip('\n')
+        if not line.strip() or line.startswith('#'):
+            continue
+        name, passwd, uid, gid, gecos, home, shell = line.split(':', 6)
+        yield struct_passwd(name, passwd, int(uid), int(gid), gecos, home, shell)
+
+
 class MockPwd:
     def __init__(self, entries=None):
         if entries is None:
@@ -17,32 +32,68 @@ class MockPwd:
                 ('sonargd', 'x', 980, 981, 'jSonar system user',
                  '/home/sonargd', '/bin/bash'),
             ]
-        self.db = [struct_passwd(*entry) for entry in entries]
+        self.db = []
+        # uid -> first entry, name -> first entry, like the scans of the real module
+        self._by_uid = {}
+        self._by_name = {}
+        self._next_uid = 0
+        self._indexed = 0
+        self.load(entries)
+
+    @classmethod
+    def from_file(cls, source):
+        ''' MockPwd of the entries of an /etc/passwd format file '''
+        return cls(read_passwd(source))
+
+    def load(self, entries):
+        ''' add entries (tuples or struct_passwd, from an iterator too) one at a time '''
+        self._reindex()
+        for entry in entries:
+            self._add(struct_passwd(*entry))
+        return self
+
+    def _add(self, user):
+        self.db.append(user)
+        self._by_uid.setdefault(user.pw_uid, user)
+        self._by_name.setdefault(user.pw_name, user)
+        self._next_uid = max(self._next_uid, user.pw_uid + 1)
+        self._indexed = len(self.db)
+
+    def _reindex(self):
+        ''' rebuild the indexes when entries were added to db behind our back '''
+        if self._indexed != len(self.db):
+            users, self.db = self.db, []
+            self._by_uid, self._by_name, self._next_uid = {}, {}, 0
+            for user in users:
+                self._add(user)
 
     def getpwuid(self, uid):
-        for item in self.db:
-            if item.pw_uid == uid:
-                return item
-        raise(KeyError(f'getpwuid(): uid not found {uid}'))
+        self._reindex()
+        try:
+            return self._by_uid[uid]
+        except KeyError:
+            raise KeyError(f'getpwuid(): uid not found {uid}') from None
 
     def getpwnam(self, name):
-        for item in self.db:
-            if item.pw_name == name:
-                return item
-        raise(KeyError(f'getpwnam(): name not found {name}'))
+        self._reindex()
+        try:
+            return self._by_name[name]
+        except KeyError:
+            raise KeyError(f'getpwnam(): name not found {name}') from None
 
     def get_pwall(self):
         return self.db
 
     def useradd(self, username, uid, groupname):
         validate_run_args(username, uid, groupname)
-        for user in self.db:
-            if uid is not None and int(uid) == user.pw_uid:
-                raise CalledProcessError(f"invalid user ID 'id'")
-            if username == user.pw_name:
-                raise CalledProcessError(f"useradd: user '{username}' already exists")
+        self._reindex()
+        if uid is not None and int(uid) in self._by_uid:
+            raise CalledProcessError(4, 'useradd', stderr=f"useradd: UID {uid} is not unique")
+        if username in self._by_name:
+            raise CalledProcessError(9, 'useradd',
+                                     stderr=f"useradd: user '{username}' already exists")
         if uid is None:
-            uid = max([user.pw_uid for user in self.db]) + 1
+            uid = self._next_uid
 
-        self.db.append(struct_passwd(username, 'x', int(uid), 981,
-                                     'jSonar system user', f'/home/{username}', '/bin/bash'))
+        self._add(struct_passwd(username, 'x', int(uid), 981,
+                                'jSonar system user', f'/home/{username}', '/bin/bash'))
@@ -0,0 +1,61 @@
+import pytest
+from pymongo.errors import OperationFailure
+
+from test.mock.mongo import MockCollection
+
+DOCS = [
+    {'_id': 1, 'host': 'a', 'bytes': 10, 'tags': ['x', 'y']},
+    {'_id': 2, 'host': 'b', 'bytes': 5, 'tags': []},
+    {'_id': 3, 'host': 'a', 'bytes': 7, 'tags': ['y']},
+    {'_id': 4, 'host': 'c'},
+]
+
+
+def test_group_current():
+    coll = MockCollection(DOCS)
+    pipeline = [{'$group': {'_id': None, 'alldocs': {'$push': '$$CURRENT'}}}]
+    assert list(coll.aggregate(pipeline)) == [{'_id': None, 'alldocs': DOCS}]
+
+
+def test_group_accumulators():
+    coll = MockCollection(DOCS)
+    result = list(coll.aggregate([
+        {'$group': {'_id': '$host', 'total': {'$sum': '$bytes'}, 'n': {'$sum': 1},
+                    'avg': {'$avg': '$bytes'}, 'min': {'$min': '$bytes'}, 'max': {'$max': '$bytes'},
+                    'first': {'$first': '$_id'}, 'ids': {'$push': '$_id'}}},
+        {'$sort': {'total': -1}},
+    ]))
+    assert result == [
+        {'_id': 'a', 'total': 17, 'n': 2, 'avg': 8.5, 'min': 7, 'max': 10, 'first': 1, 'ids': [1, 3]},
+        {'_id': 'b', 'total': 5, 'n': 1, 'avg': 5.0, 'min': 5, 'max': 5, 'first': 2, 'ids': [2]},
+        {'_id': 'c', 'total': 0, 'n': 1, 'avg': None, 'min': None, 'max': None, 'first': 4, 'ids': [4]},
+    ]
+
+
+def test_match_project_sort_limit():
+    coll = MockCollection(DOCS)
+    coll.create_index('host')
+    result = coll.aggregate([
+        {'$match': {'host': 'a'}},
+        {'$project': {'_id': 0, 'host': 1, 'kb': {'$divide': ['$bytes', 1000]}}},
+        {'$sort': {'kb': 1}},
+        {'$limit': 1},
+    ])
+    assert list(result) == [{'host': 'a', 'kb': 0.007}]
+
+
+def test_unwind_skip_count():
+    coll = MockCollection(DOCS)
+    assert [d['tags'] for d in coll.aggregate([{'$unwind': '$tags'}])] == ['x', 'y', 'y']
+    result = coll.aggregate([{'$unwind': {'path': '$tags', 'preserveNullAndEmptyArrays': True}},
+                             {'$skip': 1}, {'$count': 'n'}])
+    assert list(result) == [{'n': 4}]
+    assert list(coll.aggregate([{'$match': {'host': 'z'}}, {'$count': 'n'}])) == []
+
+
+def test_bad_pipeline():
+    coll = MockCollection(DOCS)
+    with pytest.raises(OperationFailure):
+        coll.aggregate([{'$bogus': {}}])
+    with pytest.raises(OperationFailure):
+        coll.aggregate([{'$group': {'total': {'$sum': 1}}}])
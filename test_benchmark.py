@@ -0,0 +1,252 @@
+import json
+import math
+import os
+import random
+from time import perf_counter
+
+import pytest
+
+from test.mock.connections import MockAssetsServer, assets_url
+from test.mock.grp import MockGrp
+from test.mock.mongo import MockCollection
+from test.mock.paramiko import MockSFTPClient
+from test.mock.paramiko_fs import MemoryFS
+from test.mock.pwd import MockPwd
+
+# MOCK_BENCHMARK=1 times the benchmarks and checks their costs, without it each one only runs
+# once at the smallest size. MOCK_BENCHMARK_SIZES=1000,100000,1000000 runs the large sizes,
+# MOCK_BENCHMARK_SAVE=1 stores the measured costs as the new baselines
+TIMED = bool(os.environ.get('MOCK_BENCHMARK') or os.environ.get('MOCK_BENCHMARK_SAVE'))
+SIZES = sorted(int(n) for n in os.environ.get('MOCK_BENCHMARK_SIZES', '1000,10000').split(','))
+BASELINES = os.environ.get('MOCK_BENCHMARK_BASELINES',
+                           os.path.join(os.path.dirname(__file__), 'benchmark_baselines.json'))
+# a cost may be this many times its baseline before it counts as a regression
+TOLERANCE = float(os.environ.get('MOCK_BENCHMARK_TOLERANCE', '3'))
+# cost per operation growing like size ** MAX_EXPONENT or faster is superlinear scaling
+MAX_EXPONENT = 0.5
+# point operations timed against a collection of each size
+POINT_OPS = 1000
+
+_results = {}
+
+
+def _calibration():
+    ''' microseconds per item of a plain dict workload, costs are stored relative to it so
+    baselines carry over between machines '''
+    best = math.inf
+    for _ in range(5):
+        start = perf_counter()
+        d = {}
+        for i in range(100000):
+            d[i] = {'_id': i, 'n': i}
+        best = min(best, perf_counter() - start)
+    return best * 1e6 / 100000
+
+
+def _docs(n):
+    return [{'_id': i, 'n': i, 'g': i % 100, 's': f'value {i}'} for i in range(1, n + 1)]
+
+
+def _collection(n):
+    coll = MockCollection()
+    coll.insert_many(_docs(n))
+    return coll
+
+
+def _sample(n):
+    return random.Random(n).sample(range(1, n + 1), min(n, POINT_OPS))
+
+
+# benchmark: size -> (state for one run, function running the timed work on it, units of work),
+# the state is built untimed before each run
+def insert_many(n):
+    docs = _docs(n)
+    return MockCollection, lambda c: c.insert_many(docs), n
+
+
+def insert_one(n):
+    docs = _docs(n + POINT_OPS)[n:]
+
+    def run(c):
+        for doc in docs:
+            c.insert_one(doc)
+    return lambda: _collection(n), run, len(docs)
+
+
+def find(n):
+    coll = _collection(n)
+    return None, lambda _: list(coll.find({'n': {'$gt': 0}})), n
+
+
+def update_many(n):
+    return lambda: _collection(n), lambda c: c.update_many({}, {'$inc': {'n': 1}}), n
+
+
+def delete_one(n):
+    ids = _sample(n)
+
+    def run(c):
+        for i in ids:
+            c.delete_one({'_id': i})
+    return lambda: _collection(n), run, len(ids)
+
+
+def replace_one(n):
+    ids = _sample(n)
+
+    def run(c):
+        for i in ids:
+            c.replace_one({'_id': i}, {'n': -i})
+    return lambda: _collection(n), run, len(ids)
+
+
+def aggregate(n):
+    coll = _collection(n)
+    pipeline = [{'$match': {'n': {'$gt': n // 2}}}, {'$group': {'_id': '$g', 'c': {'$sum': 1}}}]
+    return None, lambda _: list(coll.aggregate(pipeline)), n
+
+
+def _assets(n):
+    return {'assets': [{'asset_id': f'asset{i}', 'name': f'db{i}'} for i in range(n)],
+            'connections': [{'asset_id': f'asset{i}', 'port': i} for i in range(n)]}
+
+
+def assets_get(n):
+    server, ids = MockAssetsServer(_assets(n)), _sample(n)
+
+    def run(_):
+        for i in ids:
+            server.requests('GET', f'{assets_url}/asset{i - 1}')
+    return None, run, len(ids)
+
+
+def assets_get_batched(n):
+    server, ids = MockAssetsServer(_assets(n)), _sample(n)
+    batches = [','.join(f'asset{i - 1}' for i in ids[i:i + 100]) for i in range(0, len(ids), 100)]
+
+    def run(_):
+        for batch in batches:
+            server.requests('GET', assets_url, fields={'asset_ids': batch})
+    return None, run, len(ids)
+
+
+def assets_put(n):
+    data = _assets(n)
+    bodies = [json.dumps({'asset_id': f'new{i}'}) for i in range(POINT_OPS)]
+
+    def run(server):
+        for body in bodies:
+            server.requests('PUT', assets_url, body=body)
+    return lambda: MockAssetsServer({k: list(v) for k, v in data.items()}), run, len(bodies)
+
+
+def pwd_lookup(n):
+    pwd = MockPwd([(f'user{i}', 'x', 1000 + i, 1000, '', f'/home/user{i}', '/bin/sh')
+                   for i in range(n)])
+    ids = _sample(n)
+
+    def run(_):
+        for i in ids:
+            pwd.getpwnam(f'user{i - 1}')
+            pwd.getpwuid(999 + i)
+    return None, run, len(ids)
+
+
+def grp_lookup(n):
+    grp = MockGrp([(f'group{i}', 'x', 1000 + i, []) for i in range(n)])
+    ids = _sample(n)
+
+    def run(_):
+        for i in ids:
+            grp.getgrnam(f'group{i - 1}')
+            grp.getgrgid(999 + i)
+    return None, run, len(ids)
+
+
+def sftp_stat(n):
+    sftp = MockSFTPClient(MemoryFS())
+    sftp.mkdir('/dump')
+    for i in range(n):
+        sftp.open(f'/dump/coll{i}.bson', 'w').close()
+    sftp.chdir('/dump')
+    ids = _sample(n)
+
+    def run(_):
+        for i in ids:
+            sftp.stat(f'coll{i - 1}.bson')
+    return None, run, len(ids)
+
+
+BENCHMARKS = [
+    insert_many, insert_one, find, update_many, delete_one, replace_one, aggregate,
+    assets_get, assets_get_batched, assets_put, pwd_lookup, grp_lookup, sftp_stat,
+]
+
+
+def _measure(benchmark, n):
+    ''' best microseconds per unit of work over a few runs '''
+    prepare, run, units = benchmark(n)
+    best = math.inf
+    for _ in range(3 if n < 100000 else 1):
+        state = prepare() if prepare is not None else None
+        start = perf_counter()
+        run(state)
+        best = min(best, perf_counter() - start)
+    return best * 1e6 / units
+
+
+@pytest.fixture(scope='module')
+def calibration(request):
+    unit = _calibration()
+    yield unit
+    plugins = request.config.pluginmanager
+    reporter, capture = plugins.getplugin('terminalreporter'), plugins.getplugin('capturemanager')
+    if reporter is not None and capture is not None and _results:
+        with capture.global_and_fixture_disabled():
+            reporter.write_line('')
+            reporter.write_line(f'micros per operation ({unit:.3f} per dict item):')
+            for name, costs in _results.items():
+                curve = '  '.join(f'{n}: {c:.2f}' for n, c in costs.items())
+                reporter.write_line(f'  {name:<18} {curve}')
+    if os.environ.get('MOCK_BENCHMARK_SAVE'):
+        stored = _baselines()
+        stored.update({f'{name}@{n}': round(c / unit, 3)
+                       for name, costs in _results.items() for n, c in costs.items()})
+        with open(BASELINES, 'w') as f:
+            json.dump(dict(sorted(stored.items())), f, indent=2)
+            f.write('\n')
+
+
+def _baselines():
+    if not os.path.exists(BASELINES):
+        return {}
+    with open(BASELINES) as f:
+        return json.load(f)
+
+
+def _run_once(benchmark, n):
+    prepare, run, _ = benchmark(n)
+    run(prepare() if prepare is not None else None)
+
+
+@pytest.mark.parametrize('benchmark', BENCHMARKS)
+def test_scaling(benchmark, request):
+    if not TIMED:
+        _run_once(benchmark, SIZES[0])
+        return
+    calibration = request.getfixturevalue('calibration')
+    costs = _results[benchmark.__name__] = {n: _measure(benchmark, n) for n in SIZES}
+
+    baselines = _baselines()
+    for n, cost in costs.items():
+        baseline = baselines.get(f'{benchmark.__name__}@{n}')
+        if baseline is not None:
+            assert cost / calibration <= baseline * TOLERANCE, \
+                f'{benchmark.__name__} at {n}: {cost:.2f} micros per operation, ' \
+                f'baseline {baseline * calibration:.2f}'
+
+    if len(SIZES) > 1:
+        small, large = SIZES[0], SIZES[-1]
+        exponent = math.log(costs[large] / costs[small]) / math.log(large / small)
+        assert exponent < MAX_EXPONENT, \
+            f'{benchmark.__name__} cost per operation grows like size ** {exponent:.2f}: {costs}'
@@ -0,0 +1,44 @@
+import pytest
+from pymongo import DeleteMany, DeleteOne, InsertOne, ReplaceOne, UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from test.mock.mongo import MockCollection
+
+
+def test_bulk_write_result():
+    coll = MockCollection([{'_id': i, 'n': i % 2} for i in range(1, 7)])
+    result = coll.bulk_write([
+        InsertOne({'_id': 7, 'n': 1}),
+        InsertOne({'_id': 8, 'n': 0}),
+        UpdateOne({'_id': 1}, {'$set': {'x': 1}}),
+        UpdateMany({'n': 0}, {'$set': {'x': 0}}),
+        UpdateOne({'_id': 9}, {'$set': {'n': 9}}, upsert=True),
+        UpdateOne({'_id': 10}, {'$set': {'n': 10}}),
+        ReplaceOne({'_id': 3}, {'n': 3}),
+        DeleteOne({'_id': 5}),
+        DeleteMany({'n': 0}),
+    ])
+    assert (result.inserted_count, result.matched_count, result.modified_count,
+            result.deleted_count, result.upserted_count) == (2, 6, 6, 5, 1)
+    assert result.upserted_ids == {4: 9}
+    assert [d['_id'] for d in coll.data] == [1, 3, 7, 9]
+
+
+def test_bulk_write_ordered():
+    coll = MockCollection([{'_id': 1}])
+    with pytest.raises(BulkWriteError) as e:
+        coll.bulk_write([InsertOne({'_id': 2}), InsertOne({'_id': 1}), InsertOne({'_id': 3})])
+    details = e.value.details
+    assert details['nInserted'] == 1
+    assert [(err['index'], err['code']) for err in details['writeErrors']] == [(1, 11000)]
+    assert [d['_id'] for d in coll.data] == [1, 2]
+
+
+def test_bulk_write_unordered():
+    coll = MockCollection([{'_id': 1}])
+    with pytest.raises(BulkWriteError) as e:
+        coll.bulk_write([InsertOne({'_id': 1}), InsertOne({'_id': 2}), DeleteOne({'_id': 1})],
+                        ordered=False)
+    assert e.value.details['nInserted'] == 1
+    assert e.value.details['nRemoved'] == 1
+    assert [d['_id'] for d in coll.data] == [2]
@@ -0,0 +1,80 @@
+import bson
+import pytest
+from pymongo.errors import OperationFailure
+
+from test.mock import mongo
+from test.mock.mongo import MockCollection
+
+
+def test_capped_by_count():
+    db = mongo.MockDatabase()
+    coll = db.create_collection('log', capped=True, size=1 << 20, max=3)
+    coll.create_index('n')
+    coll.insert_many([{'_id': i, 'n': i} for i in range(1, 6)])
+    assert [d['_id'] for d in coll.find()] == [3, 4, 5]
+    assert coll.find_one({'n': 1}) is None
+    assert coll.options() == {'capped': True, 'size': 1 << 20, 'max': 3}
+    coll.delete_one({'_id': 4})
+    coll.insert_many([{'_id': 6}, {'_id': 7}])
+    assert [d['_id'] for d in coll.find()] == [5, 6, 7]
+
+
+def test_capped_by_size():
+    doc_size = len(bson.encode({'_id': 1, 's': 'x' * 100}))
+    coll = MockCollection()
+    coll.cap(size=doc_size * 10)
+    for i in range(1, 51):
+        coll.insert_one({'_id': i, 's': 'x' * 100})
+    assert coll.count_documents({}) == 10
+    stats = coll.stats()
+    assert stats['size'] == doc_size * 10
+    assert stats['capped'] and stats['maxSize'] == doc_size * 10
+    # growing a document evicts the oldest ones
+    coll.update_one({'_id': 50}, {'$set': {'s': 'x' * (doc_size * 2)}})
+    assert coll.count_documents({}) == 8
+    assert coll.stats()['size'] <= doc_size * 10
+    assert coll.find_one({'_id': 50}) is not None
+
+
+def test_ingest_buffer_size():
+    db = mongo.MockDatabase()
+    db.system.ingest.update_one({'_id': 'instance'}, {'$set': {'buffer_size': 1000}})
+    coll = db['instance']
+    coll.insert_many([{'_id': i, 'v': 'x' * 50} for i in range(1, 101)])
+    stats = db.command('collStats', 'instance')
+    assert stats['size'] <= 1000 and stats['count'] < 100
+    assert not db['other'].stats()['capped']
+
+
+def test_ingest_collections_are_not_capped():
+    db = mongo.MockDatabase()
+    coll = db['instance']
+    coll.insert_many([{'_id': i, 'n': i} for i in range(100)])
+    first = coll.data[0]
+    coll.update_many({}, {'$set': {'s': 'x' * 10}})
+    # updated in place rather than swapped for an updated copy
+    assert coll.data[0] is first and first['s'] == 'x' * 10
+    stats = coll.stats()
+    assert not stats['capped'] and 'maxSize' not in stats and coll.options() == {}
+    assert stats['size'] == sum(len(bson.encode(d)) for d in coll.find())
+    coll.delete_many({'n': {'$lt': 50}})
+    assert coll.stats()['size'] == sum(len(bson.encode(d)) for d in coll.find())
+
+
+def test_stats_and_snapshot():
+    db = mongo.MockDatabase()
+    coll = db.create_collection('log', capped=True, size=1 << 20, max=2)
+    coll.insert_many([{'_id': 1}, {'_id': 2}])
+    snapshot = coll.snapshot()
+    coll.insert_one({'_id': 3})
+    coll.restore(snapshot)
+    assert [d['_id'] for d in coll.find()] == [1, 2]
+    assert coll.stats()['size'] == 2 * len(bson.encode({'_id': 1}))
+    coll.insert_one({'_id': 4})
+    assert [d['_id'] for d in coll.find()] == [2, 4]
+
+    db['plain'].insert_one({'_id': 1, 'a': 'b'})
+    assert db.command({'collStats': 'plain'})['size'] == len(bson.encode({'_id': 1, 'a': 'b'}))
+    assert db.command('dbStats')['objects'] == 3
+    with pytest.raises(OperationFailure):
+        db.create_collection('bad', capped=True)
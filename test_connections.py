@@ -0,0 +1,148 @@
+import json
+
+from test.mock.connections import MockAssetsServer, assets_url, connections_url, crypto_url
+
+
+def _server():
+    return MockAssetsServer({
+        'assets': [{'asset_id': 'a1', 'name': 'one'}, {'asset_id': 'a2', 'name': 'two'}],
+        'connections': [{'asset_id': 'a1', 'port': 1}, {'asset_id': 'a1', 'port': 2},
+                        {'asset_id': 'a2', 'port': 3}],
+    })
+
+
+def _body(response):
+    return json.loads(response.data)
+
+
+def test_routes():
+    server = _server()
+    assert server.requests('GET', crypto_url).data == b'THIS IS THE CRYPTO KEY'
+    asset = server.requests('GET', f'{assets_url}/asset/a2')
+    assert _body(asset) == {'asset_id': 'a2', 'name': 'two'}
+    assert _body(server.requests('GET', f'{assets_url}/a1'))['name'] == 'one'
+    assert server.requests('GET', f'{assets_url}/asset/a3').status == 404
+    assert _body(server.requests('GET', connections_url, fields={'asset_id': 'a1'})) == [
+        {'asset_id': 'a1', 'port': 1}]
+    assert _body(server.requests('GET', f'{connections_url}/a2')) == [{'asset_id': 'a2', 'port': 3}]
+    assert _body(server.requests('GET', f'{connections_url}/a3')) == 'NOT FOUND'
+    assert server.requests('GET', 'https://localhost/elsewhere').status == 404
+    assert [c['port'] for c in server.db.get_connections('a1')] == [1, 2]
+
+
+def test_writes_invalidate_cached_responses():
+    server = _server()
+    missing = server.requests('GET', f'{assets_url}/asset/a3')
+    assert server.requests('GET', f'{assets_url}/asset/a3') is missing
+    assert server.requests('GET', connections_url, fields={'asset_id': 'a3'}).status == 200
+
+    response = server.requests('PUT', assets_url, body=json.dumps({'asset_id': 'a3'}))
+    assert response.status == 201
+    assert _body(server.requests('GET', _body(response)['url'])) == {'asset_id': 'a3'}
+    assert server.requests('PUT', assets_url, body=json.dumps({'asset_id': 'a3'})).status == 409
+    assert server.requests('GET', connections_url, fields={'asset_id': 'a3'}).status == 500
+
+    server.requests('PUT', connections_url, body=json.dumps({'asset_id': 'a3', 'port': 4}))
+    assert _body(server.requests('GET', f'{connections_url}/a3')) == [{'asset_id': 'a3', 'port': 4}]
+
+    server.db.asset.append({'asset_id': 'a4'})
+    assert server.requests('GET', f'{assets_url}/asset/a4').status == 200
+
+
+def test_direct_db_writes_invalidate_cached_responses():
+    server = _server()
+    assert server.requests('GET', f'{assets_url}/a3').status == 404
+    assert _body(server.requests('GET', f'{assets_url}/a1'))['name'] == 'one'
+    assert _body(server.requests('GET', f'{connections_url}/a2')) == [{'asset_id': 'a2', 'port': 3}]
+
+    server.db.set_asset({'asset_id': 'a3', 'name': 'three'})
+    assert _body(server.requests('GET', f'{assets_url}/a3'))['name'] == 'three'
+    server.db.upsert_asset({'asset_id': 'a1', 'name': 'uno'})
+    assert _body(server.requests('GET', f'{assets_url}/a1'))['name'] == 'uno'
+    server.db.delete_connections('a2')
+    server.db.set_connection({'asset_id': 'a2', 'port': 5})
+    assert _body(server.requests('GET', f'{connections_url}/a2')) == [{'asset_id': 'a2', 'port': 5}]
+
+    # a write through the server after a direct one still drops the stale responses
+    server.requests('GET', f'{assets_url}/a2')
+    server.db.upsert_asset({'asset_id': 'a2', 'name': 'dos'})
+    server.requests('PUT', assets_url, body=json.dumps({'asset_id': 'a4'}))
+    assert _body(server.requests('GET', f'{assets_url}/a2'))['name'] == 'dos'
+
+
+def test_changes_to_the_data_are_served():
+    data = {'assets': [{'asset_id': 'a1', 'name': 'old'}],
+            'connections': [{'asset_id': 'a1', 'port': 1}]}
+    server = MockAssetsServer(data)
+    assert _body(server.requests('GET', f'{assets_url}/a1'))['name'] == 'old'
+    assert _body(server.requests('GET', f'{connections_url}/a1')) == [{'asset_id': 'a1', 'port': 1}]
+
+    data['assets'][0]['name'] = 'new'
+    data['connections'][0]['port'] = 2
+    assert _body(server.requests('GET', f'{assets_url}/a1'))['name'] == 'new'
+    assert _body(server.requests('GET', f'{connections_url}/a1')) == [{'asset_id': 'a1', 'port': 2}]
+    data['assets'][0] = {'asset_id': 'a1', 'name': 'newer'}
+    assert _body(server.requests('GET', f'{assets_url}/a1'))['name'] == 'newer'
+    data['assets'][0] = {'asset_id': 'a2', 'name': 'two'}
+    assert server.requests('GET', f'{assets_url}/a1').status == 404
+    assert _body(server.requests('GET', f'{assets_url}/a2'))['name'] == 'two'
+
+    assert server.requests('GET', f'{connections_url}/a1', fields={'foo': '1'}).status == 200
+    assert server.requests('GET', connections_url, fields={'foo': '1'}).status == 400
+
+
+def test_batches():
+    server = _server()
+    response = server.requests('POST', assets_url, body=json.dumps(
+        [{'asset_id': 'a3'}, {'asset_id': 'a1'}, {'name': 'no id'}]))
+    assert response.status == 207
+    assert [(s['asset_id'], s['status']) for s in _body(response)] == [
+        ('a3', 201), ('a1', 409), (None, 400)]
+    response = server.requests('POST', assets_url, body=json.dumps(
+        {'assets': [{'asset_id': 'a1', 'name': 'uno'}, {'asset_id': 'a4'}], 'upsert': True}))
+    assert [s['status'] for s in _body(response)] == [200, 201]
+    assert _body(server.requests('GET', f'{assets_url}/a1'))['name'] == 'uno'
+    assert server.requests('POST', assets_url, body='{"asset_id": "a5"}').status == 400
+
+    response = server.requests('POST', connections_url, body=json.dumps(
+        [{'asset_id': 'a3', 'port': 4}, {'asset_id': 'missing_mandatory_fields'}]))
+    assert [s['status'] for s in _body(response)] == [201, 400]
+    assert _body(server.requests('GET', f'{connections_url}/a3')) == [{'asset_id': 'a3', 'port': 4}]
+
+    bulk = _body(server.requests('GET', assets_url, fields={'asset_ids': 'a2,a9,a4'}))
+    assert [a['asset_id'] for a in bulk['assets']] == ['a2', 'a4'] and bulk['missing'] == ['a9']
+    assert _body(server.requests('GET', assets_url, fields={'asset_ids': ['a1']}))['assets'] == [
+        {'asset_id': 'a1', 'name': 'uno'}]
+
+    server.db.asset.append({'asset_id': 'a2', 'name': 'duplicate'})
+    pages, cursor = [], None
+    while True:
+        fields = {'limit': '2'} if cursor is None else {'limit': '2', 'cursor': cursor}
+        page = _body(server.requests('GET', assets_url, fields=fields))
+        pages.append([a['asset_id'] for a in page['assets']])
+        cursor = page['next']
+        if cursor is None:
+            break
+    assert pages == [['a1', 'a2'], ['a3', 'a4']]
+    assert server.requests('GET', assets_url, fields={'cursor': 'a9'}).status == 400
+    assert server.requests('GET', assets_url, fields={'limit': '0'}).status == 400
+
+
+def test_delete():
+    server = _server()
+    assert _body(server.requests('GET', f'{connections_url}/a1')) == [{'asset_id': 'a1', 'port': 1}]
+    assert server.requests('DELETE', f'{connections_url}/a1').status == 200
+    assert server.requests('GET', connections_url, fields={'asset_id': 'a1'}).status == 500
+    assert server.requests('DELETE', f'{connections_url}/a1').status == 404
+
+    assert server.requests('DELETE', f'{assets_url}/asset/a2').status == 200
+    assert server.requests('GET', f'{assets_url}/asset/a2').status == 404
+    assert server.db.get_connections('a2') == []
+    assert server.requests('DELETE', f'{assets_url}/a2').status == 404
+
+    server.requests('POST', assets_url, body=json.dumps([{'asset_id': 'a3'}, {'asset_id': 'a4'}]))
+    response = server.requests('DELETE', assets_url, fields={'asset_ids': 'a3,a5,a1'})
+    assert [(s['asset_id'], s['status']) for s in _body(response)] == [
+        ('a3', 200), ('a5', 404), ('a1', 200)]
+    assert [a['asset_id'] for a in server.db.asset] == ['a4']
+    assert server.requests('DELETE', assets_url).status == 400
@@ -0,0 +1,89 @@
+import json
+import threading
+from http.client import HTTPConnection
+from time import perf_counter
+
+import pytest
+
+from test.mock.connections import assets_url, connections_url, crypto_url
+from test.mock.connections_server import MockConnectionsServer, route_name
+
+
+def _data():
+    return {'assets': [{'asset_id': f'a{i}', 'name': f'db{i}'} for i in range(20)],
+            'connections': [{'asset_id': f'a{i}', 'port': i} for i in range(20)]}
+
+
+@pytest.fixture
+def server():
+    with MockConnectionsServer(data=_data()) as server:
+        yield server
+
+
+def _get(connection, server, url):
+    connection.request('GET', server.url(url))
+    response = connection.getresponse()
+    return response.status, response.read()
+
+
+def test_keep_alive(server):
+    connection = HTTPConnection(server.host, server.port, timeout=5)
+    assert _get(connection, server, crypto_url) == (200, b'THIS IS THE CRYPTO KEY')
+    status, body = _get(connection, server, f'{assets_url}/asset/a3')
+    assert status == 200 and json.loads(body) == {'asset_id': 'a3', 'name': 'db3'}
+    status, body = _get(connection, server, f'{connections_url}?asset_id=a4')
+    assert json.loads(body) == [{'asset_id': 'a4', 'port': 4}]
+    assert _get(connection, server, f'{assets_url}/asset/missing')[0] == 404
+
+    connection.request('PUT', server.url(assets_url), body=json.dumps({'asset_id': 'new'}))
+    response = connection.getresponse()
+    assert response.status == 201 and json.loads(response.read())['url'].endswith('/new')
+    assert _get(connection, server, f'{assets_url}/new')[0] == 200
+    connection.request('PATCH', server.url(assets_url), body='{}')
+    assert connection.getresponse().status == 405
+    connection.close()
+
+    assert server.connections_opened == 1
+    assert list(server.requests_per_connection.values()) == [7]
+    assert server.routes == {'GET crypto': 1, 'GET asset': 3, 'GET connection': 1,
+                             'PUT asset': 1, 'PATCH unknown': 1}
+    assert route_name('GET', f'{connections_url}/a1') == 'GET connection'
+
+
+def test_bad_requests_get_a_response(server):
+    connection = HTTPConnection(server.host, server.port, timeout=5)
+    for method, url, body in [('PUT', assets_url, json.dumps({'name': 'no id'})),
+                              ('PUT', assets_url, '{not json'),
+                              ('GET', f'{connections_url}?foo=1', None)]:
+        connection.request(method, server.url(url), body=body)
+        response = connection.getresponse()
+        assert 400 <= response.status < 500 and json.loads(response.read())
+    assert _get(connection, server, f'{assets_url}/a1')[0] == 200
+    connection.close()
+    assert server.connections_opened == 1
+
+
+def test_concurrent_connections_with_latency(server):
+    server.latency = {'GET asset': 0.2}
+    results = []
+
+    def fetch(i):
+        connection = HTTPConnection(server.host, server.port, timeout=5)
+        results.append(_get(connection, server, f'{assets_url}/a{i}')[0])
+        results.append(_get(connection, server, crypto_url)[0])
+        connection.close()
+
+    threads = [threading.Thread(target=fetch, args=(i,)) for i in range(10)]
+    start = perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = perf_counter() - start
+
+    assert results == [200] * 20
+    # the delays overlap instead of queueing behind each other
+    assert 0.2 <= elapsed < 1.5
+    assert server.connections_opened == 10
+    assert sorted(server.requests_per_connection.values()) == [2] * 10
+    assert server.routes['GET asset'] == 10 and server.routes['GET crypto'] == 10
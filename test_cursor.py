@@ -0,0 +1,114 @@
+import bson
+import pytest
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import InvalidOperation
+
+from test.mock import mongo
+from test.mock.mongo import MockCollection
+
+DOCS = [{'_id': i, 'n': i % 4, 's': str(i)} for i in range(1, 11)]
+
+
+def _ids(cursor):
+    return [d['_id'] for d in cursor]
+
+
+def test_cursor_is_lazy():
+    coll = MockCollection(DOCS)
+    cursor = coll.find({'n': 1})
+    coll.insert_one({'_id': 11, 'n': 1})
+    assert _ids(cursor) == [1, 5, 9, 11]
+    assert not cursor.alive
+
+
+def test_sort_skip_limit():
+    coll = MockCollection(DOCS)
+    assert _ids(coll.find().sort('n', DESCENDING).limit(3)) == [3, 7, 2]
+    assert _ids(coll.find().sort([('n', ASCENDING), ('_id', DESCENDING)]).skip(1).limit(3)) == [4, 9, 5]
+    assert _ids(coll.find(sort=[('s', -1)], skip=8)) == [10, 1]
+    assert _ids(coll.find({'n': 2}).skip(1)) == [6, 10]
+    assert _ids(coll.find().sort('missing').limit(2)) == [1, 2]
+
+
+def test_sort_mixed_types():
+    coll = MockCollection([{'_id': 1, 'v': 'a'}, {'_id': 2, 'v': 3}, {'_id': 3}, {'_id': 4, 'v': [5, 0]}])
+    assert _ids(coll.find().sort('v')) == [3, 4, 2, 1]
+    assert _ids(coll.find().sort('v', -1)) == [1, 4, 2, 3]
+
+
+def test_cursor_api():
+    coll = MockCollection(DOCS)
+    cursor = coll.find({'n': {'$gt': 1}}).batch_size(2)
+    assert cursor.count() == 5
+    assert next(cursor)['_id'] == 2
+    assert cursor.retrieved == 1
+    with pytest.raises(InvalidOperation):
+        cursor.limit(1)
+    assert _ids(cursor.rewind().limit(2)) == [2, 3]
+    assert coll.find().sort('_id', -1)[1]['_id'] == 9
+    assert _ids(coll.find()[2:4]) == [3, 4]
+    assert coll.find().limit(2).count(with_limit_and_skip=True) == 2
+    with coll.find() as cursor:
+        next(cursor)
+    assert not cursor.alive
+    assert coll.find_one({'n': 0}, sort=[('_id', -1)]) == {'_id': 8, 'n': 0, 's': '8'}
+
+
+def test_projection():
+    coll = MockCollection([{'_id': i, 'name': f'n{i}', 'meta': {'a': i, 'b': [i]}} for i in range(1, 4)])
+
+    assert list(coll.find({'_id': 1}, {'name': 1})) == [{'_id': 1, 'name': 'n1'}]
+    assert coll.find_one({'_id': 2}, {'meta.a': 1, '_id': 0}) == {'meta': {'a': 2}}
+    assert coll.find_one({'_id': 2}, ['name']) == {'_id': 2, 'name': 'n2'}
+    assert coll.find_one({}, {'meta': 0}, sort=[('_id', -1)]) == {'_id': 3, 'name': 'n3'}
+    cursor = coll.find({}, projection={'name': 1}).sort('_id', -1).limit(2)
+    assert [d['name'] for d in cursor.clone()] == ['n3', 'n2']
+    assert coll.find_one_and_update({'_id': 1}, {'$inc': {'meta.a': 1}}, projection={'meta.a': 1},
+                                    return_document=True) == {'_id': 1, 'meta': {'a': 2}}
+
+
+def test_read_modes():
+    coll = MockCollection([{'_id': 1, 'tags': ['a'], 'meta': {'n': 1}}])
+    coll.find_one()['meta']['n'] = 2
+    assert coll.find_one({'_id': 1})['meta'] == {'n': 2}
+
+    coll.read_mode = 'copy'
+    doc = coll.find_one()
+    doc['meta']['n'] = 3
+    doc['tags'].append('b')
+    next(coll.find())['x'] = 1
+    assert coll.find_one() == {'_id': 1, 'tags': ['a'], 'meta': {'n': 2}}
+
+    coll.read_mode = 'readonly'
+    doc = coll.find_one()
+    assert doc == {'_id': 1, 'tags': ['a'], 'meta': {'n': 2}}
+    assert doc['tags'] == ['a'] and bson.decode(bson.encode(doc)) == doc
+    with pytest.raises(TypeError):
+        doc['meta']['n'] = 4
+    with pytest.raises(AttributeError):
+        doc['tags'].append('b')
+    copied = doc.copy()
+    copied['meta']['n'] = 4
+    assert coll.find_one({}, {'meta': 1}) == {'_id': 1, 'meta': {'n': 2}}
+
+    assert coll.update_one({'_id': 1}, {'$set': {'meta.n': 5}}).modified_count == 1
+    assert doc['meta']['n'] == 5
+    with pytest.raises(ValueError):
+        coll.read_mode = 'bogus'
+    client = mongo.MockMongoClient(None, read_mode='copy')
+    assert client['db']['coll'].read_mode == client.db.gid.read_mode == 'copy'
+
+
+@pytest.mark.parametrize('read_mode', ['copy', 'readonly'])
+def test_aggregate_read_modes(read_mode):
+    coll = MockCollection([{'_id': 1, 'n': 1, 'meta': {'a': 1}}], read_mode=read_mode)
+    matched = next(coll.aggregate([{'$match': {'n': 1}}]))
+    grouped = next(coll.aggregate([{'$group': {'_id': None, 'docs': {'$push': '$$CURRENT'}}}]))
+    for doc in (matched, grouped['docs'][0]):
+        if read_mode == 'readonly':
+            with pytest.raises(TypeError):
+                doc['meta']['a'] = 999
+        else:
+            doc['n'] = 999
+            doc['meta']['a'] = 999
+    assert coll.find_one({}, {'_id': 0}) == {'n': 1, 'meta': {'a': 1}}
@@ -0,0 +1,49 @@
+import pytest
+from pymongo import ReturnDocument
+from pymongo.errors import WriteError
+
+from test.mock.mongo import MockCollection
+
+
+def _docs():
+    return [{'_id': i, 'n': i % 3} for i in range(1, 10)]
+
+
+def test_delete_many():
+    coll = MockCollection(_docs())
+    assert coll.delete_many({'n': 0}).deleted_count == 3
+    assert [d['_id'] for d in coll.data] == [1, 2, 4, 5, 7, 8]
+    assert coll.delete_many({}).deleted_count == 6
+    assert len(coll.data) == 0
+
+
+def test_delete_while_iterating():
+    coll = MockCollection(_docs())
+    for doc in coll.find():
+        coll.delete_one({'_id': doc['_id'] + 1})
+    assert [d['_id'] for d in coll.data] == [1, 3, 5, 7, 9]
+
+
+def test_replace_in_place():
+    coll = MockCollection(_docs())
+    result = coll.replace_one({'_id': 2}, {'n': 'new'})
+    assert (result.matched_count, result.modified_count) == (1, 1)
+    assert coll.data[1] == {'_id': 2, 'n': 'new'}
+    with pytest.raises(WriteError):
+        coll.replace_one({'_id': 2}, {'_id': 3, 'n': 'newer'})
+    assert coll.replace_one({'_id': 20}, {'n': 1}, upsert=True).upserted_id == 20
+    assert coll.data[-1] == {'_id': 20, 'n': 1}
+
+
+def test_find_one_and_modify():
+    coll = MockCollection(_docs())
+    assert coll.find_one_and_delete({'n': 1}, sort=[('_id', -1)]) == {'_id': 7, 'n': 1}
+    assert coll.find_one({'_id': 7}) is None
+
+    assert coll.find_one_and_update({'_id': 1}, {'$set': {'n': 5}}) == {'_id': 1, 'n': 1}
+    assert coll.find_one_and_update({'_id': 1}, {'$set': {'n': 6}},
+                                    return_document=ReturnDocument.AFTER) == {'_id': 1, 'n': 6}
+    assert coll.find_one_and_replace({'_id': 2}, {'x': 1}, projection={'_id': 0}) == {'n': 2}
+    assert coll.find_one({'_id': 2}) == {'_id': 2, 'x': 1}
+    assert coll.find_one_and_update({'_id': 42}, {'$set': {'n': 1}}, upsert=True,
+                                    return_document=ReturnDocument.AFTER) == {'_id': 42, 'n': 1}
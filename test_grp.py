@@ -0,0 +1,39 @@
+import io
+from subprocess import CalledProcessError
+
+import pytest
+
+from test.mock.grp import MockGrp, read_group
+
+GROUP = '''sonar:x:981:sonarw,sonargd
+wheel:x:10:alice
+users:x:100:
+admins:x:1000:alice,sonarw
+'''
+
+
+def test_lookups_and_membership():
+    grp = MockGrp.from_file(io.StringIO(GROUP))
+    assert grp.getgrnam('users').gr_mem == []
+    assert grp.getgrgid(10).gr_name == 'wheel'
+    with pytest.raises(KeyError):
+        grp.getgrgid(11)
+    assert [g.gr_name for g in grp.groups_of('alice')] == ['wheel', 'admins']
+    assert grp.getgrouplist('sonarw', 981) == [981, 1000]
+    assert grp.getgrouplist('nobody', 100) == [100]
+
+    grp.add_member('users', 'alice')
+    grp.add_member('users', 'alice')
+    assert grp.getgrnam('users').gr_mem == ['alice']
+    assert grp.getgrouplist('alice', 100) == [100, 10, 1000]
+
+
+def test_groupadd():
+    grp = MockGrp.from_file(io.StringIO(GROUP))
+    grp.groupadd('devs', None)
+    assert grp.getgrnam('devs').gr_gid == 1001
+    with pytest.raises(CalledProcessError):
+        grp.groupadd('other', '10')
+    with pytest.raises(CalledProcessError):
+        grp.groupadd('devs', None)
+    assert [g.gr_name for g in read_group(io.StringIO(GROUP))][-1] == 'admins'
@@ -0,0 +1,193 @@
+import pytest
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+from test.mock import mongo
+from test.mock.mongo import MockCollection
+
+
+def test_create_index_lookup():
+    coll = MockCollection([{'_id': i, 'host': f'host{i % 10}', 'port': i % 3} for i in range(100)])
+    assert coll.create_index('host') == 'host_1'
+    assert coll.create_index([('host', 1), ('port', 1)]) == 'host_1_port_1'
+
+    assert coll.count({'host': 'host3'}) == 10
+    assert coll._candidates({'host': 'host3', 'port': 0}) == list(coll.find({'host': 'host3', 'port': 0}))
+    assert [d['_id'] for d in coll.find({'host': 'host3', 'port': 0})] == [3, 33, 63, 93]
+
+
+def test_index_follows_writes():
+    coll = MockCollection()
+    coll.create_index('host')
+    coll.insert_many([{'_id': 1, 'host': 'a'}, {'_id': 2, 'host': 'b'}])
+
+    coll.update_one({'_id': 1}, {'$set': {'host': 'b'}})
+    coll.delete_one({'_id': 2})
+    assert list(coll.find({'host': 'a'})) == []
+    assert list(coll.find({'host': 'b'})) == [{'_id': 1, 'host': 'b'}]
+
+
+def test_unique_index():
+    coll = MockCollection([{'_id': 1, 'name': 'a'}, {'_id': 2, 'name': 'b'}])
+    coll.create_index('name', unique=True)
+
+    with pytest.raises(DuplicateKeyError):
+        coll.insert_one({'_id': 3, 'name': 'a'})
+    with pytest.raises(DuplicateKeyError):
+        coll.update_one({'_id': 2}, {'$set': {'name': 'a'}})
+    assert coll.find_one({'name': 'b'}) == {'_id': 2, 'name': 'b'}
+    with pytest.raises(DuplicateKeyError):
+        MockCollection([{'_id': 1, 'x': 1}, {'_id': 2, 'x': 1}]).create_index('x', unique=True)
+
+
+def test_index_information_and_drop():
+    coll = MockCollection()
+    coll.create_index('a', unique=True)
+    assert coll.index_information() == {'_id_': {'v': 2, 'key': [('_id', 1)]},
+                                        'a_1': {'v': 2, 'key': [('a', 1)], 'unique': True}}
+    coll.drop_index([('a', 1)])
+    assert list(coll.index_information()) == ['_id_']
+    with pytest.raises(OperationFailure):
+        coll.drop_index('a_1')
+
+
+def test_gid_indexes():
+    db = mongo.MockMongoClient(None).get_default_database()
+    assert list(db.gid.find({'gmachine_id': '3'})) == db.gid._candidates({'gmachine_id': '3'})
+    assert [d['hostname'] for d in db.gid.find({'gmachine_id': '3'})] == ['host3', 'host4']
+
+
+def test_range_queries_use_the_index():
+    coll = MockCollection([{'_id': i, 'n': i % 50, 'tag': 'abcde'[i % 5]} for i in range(1, 1001)])
+    coll.create_index('n')
+
+    assert coll.count_documents({'n': {'$gte': 10, '$lt': 20}}) == 200
+    assert coll.count_documents({'n': {'$gt': 48}}) == 20
+    assert coll.count_documents({'n': {'$gt': 20, '$lt': 10}}) == 0
+    assert coll.count_documents({'n': {'$lte': 'x'}}) == 0
+    plan = coll.find({'n': {'$gt': 48}}).explain()
+    assert plan['queryPlanner']['winningPlan']['inputStage']['stage'] == 'IXSCAN'
+    assert plan['executionStats']['totalKeysExamined'] == 20
+    assert plan['executionStats']['totalDocsExamined'] == 20
+
+    assert coll.delete_many({'n': {'$lt': 5}}).deleted_count == 100
+    assert coll.find_one({'n': {'$lte': 5}}, sort=[('n', 1)])['n'] == 5
+
+
+def test_sort_from_index():
+    coll = MockCollection([{'_id': i, 'host': f'host{i % 4}', 'port': i} for i in range(1, 401)])
+    coll.create_index([('host', 1), ('port', -1)])
+
+    cursor = coll.find({'host': 'host1'}).sort('port', -1).limit(3)
+    assert [d['port'] for d in cursor] == [397, 393, 389]
+    plan = coll.find({'host': 'host1'}).sort('port', -1).limit(3).explain()
+    assert plan['queryPlanner']['winningPlan']['stage'] == 'LIMIT'
+    assert plan['executionStats']['totalKeysExamined'] == 3
+
+    ascending = [d['port'] for d in coll.find({'host': 'host2', 'port': {'$gte': 390}}).sort('port')]
+    assert ascending == [390, 394, 398]
+
+    coll.update_one({'host': 'host1', 'port': 5}, {'$set': {'port': 1000}})
+    assert coll.find_one({'host': 'host1'}, sort=[('port', -1)])['port'] == 1000
+
+
+def test_range_index_matches_collection_scan():
+    docs = [{'_id': i, 'a': (i * 37) % 23, 'b': [i % 3, i % 7] if i % 5 else None}
+            for i in range(1, 301)]
+    indexed, plain = MockCollection(docs), MockCollection(docs)
+    indexed.create_index('a')
+    indexed.create_index([('b', 1), ('a', -1)])
+
+    for _filter, sort in [({'a': {'$gt': 3, '$lte': 11}}, None),
+                          ({'a': {'$gte': 20}}, [('a', -1)]),
+                          ({'b': 2, 'a': {'$lt': 5}}, [('a', 1)]),
+                          ({'b': {'$gte': 4}}, [('_id', 1)]),
+                          ({'b': None}, [('a', 1), ('_id', 1)]),
+                          ({}, [('a', 1), ('_id', -1)])]:
+        found = list(indexed.find(_filter, sort=sort))
+        if sort is None:
+            found.sort(key=lambda d: d['_id'])
+        assert found == list(plain.find(_filter, sort=sort))
+
+
+def test_multikey_range_matches_collection_scan():
+    docs = [{'_id': 1, 'a': [1, 20]}, {'_id': 2, 'a': 7}, {'_id': 3, 'a': [30, 40]},
+            {'_id': 4, 'a': [2, 3]}]
+    indexed, plain = MockCollection(docs), MockCollection(docs)
+    indexed.create_index('a')
+
+    for _filter in [{'a': {'$gt': 5, '$lt': 10}},
+                    {'$and': [{'a': {'$gt': 5}}, {'a': {'$lt': 10}}]},
+                    {'a': {'$gte': 25, '$lte': 35}}]:
+        expected = list(plain.find(_filter))
+        assert sorted(indexed.find(_filter), key=lambda d: d['_id']) == expected
+        assert indexed.count_documents(_filter) == len(expected)
+    assert [d['_id'] for d in plain.find({'a': {'$gt': 5, '$lt': 10}})] == [1, 2]
+
+    indexed.delete_many({'a': {'$gt': 5, '$lt': 10}})
+    assert [d['_id'] for d in indexed.find()] == [3, 4]
+
+
+def test_booleans_are_not_numbers_with_or_without_an_index():
+    docs = [{'_id': 1, 'f': True}, {'_id': 2, 'f': 1}, {'_id': 3, 'f': [0, True]},
+            {'_id': 4, 'f': 1.0}, {'_id': 5, 'f': {'g': False}}, {'_id': 6, 'f': {'g': 0}}]
+    indexed, plain = MockCollection(docs), MockCollection(docs)
+    indexed.create_index('f')
+
+    for _filter, ids in [({'f': 1}, [2, 4]),
+                         ({'f': True}, [1, 3]),
+                         ({'f': {'$eq': 0}}, [3]),
+                         ({'f': {'$in': [True, 0]}}, [1, 3]),
+                         ({'f': {'$in': [1]}}, [2, 4]),
+                         ({'f': {'$ne': 1}}, [1, 3, 5, 6]),
+                         ({'f': {'$nin': [False, True]}}, [2, 4, 5, 6]),
+                         ({'f': {'g': 0}}, [6])]:
+        assert [d['_id'] for d in plain.find(_filter)] == ids, _filter
+        assert sorted(d['_id'] for d in indexed.find(_filter)) == ids, _filter
+        assert plain.count_documents(_filter) == indexed.count_documents(_filter) == len(ids)
+
+
+def test_counts_from_metadata():
+    client = mongo.MockMongoClient(None)
+    coll = client['db']['hosts']
+    coll.insert_many([{'_id': i, 'host': f'h{i % 10}', 'tags': [i % 2, 'x']} for i in range(1, 101)])
+    coll.create_index('host')
+    profiler = client.enable_profiling()
+
+    assert coll.count_documents({}) == coll.estimated_document_count() == 100
+    assert coll.count_documents({'host': 'h3'}) == 10
+    assert coll.count_documents({'host': {'$eq': 'h3'}}, skip=4, limit=5) == 5
+    assert coll.count_documents({'_id': 7}) == 1
+    assert coll.count_documents({'tags': 1}) == 50
+    assert coll.count_documents({'host': None}) == 0
+    summaries = [e['planSummary'] for e in profiler.entries]
+    assert summaries == ['RECORD_STORE_FAST_COUNT', 'RECORD_STORE_FAST_COUNT', 'COUNT_SCAN { host: 1 }',
+                         'COUNT_SCAN { host: 1 }', 'IDHACK', 'COLLSCAN', 'IXSCAN { host: 1 }']
+
+    coll.delete_many({'host': 'h3'})
+    assert coll.count_documents({'host': 'h3'}) == 0
+
+
+def test_distinct():
+    coll = MockCollection([{'_id': 1, 'a': 2, 'b': [{'c': 1}, {'c': 2}]},
+                           {'_id': 2, 'a': [1, 2, [3]], 'b': {'c': 2}},
+                           {'_id': 3, 'a': None},
+                           {'_id': 4}])
+    assert coll.distinct('a') == [2, 1, [3], None]
+    assert coll.distinct('b.c') == [1, 2]
+    assert coll.distinct('a', {'_id': {'$gt': 2}}) == [None]
+
+    coll.create_index([('a', -1), ('_id', 1)])
+    assert coll.distinct('a') == [[3], 2, 1, None]
+    assert coll.distinct('missing') == []
+    coll.create_index('b.c')
+    assert coll.distinct('b.c') == [1, 2]
+
+
+def test_sparse_index_keeps_explicit_nulls():
+    coll = MockCollection([{'_id': 1, 'a': 1}, {'_id': 2, 'a': None}, {'_id': 3}])
+    scanned = coll.distinct('a')
+    coll.create_index('a', sparse=True)
+    assert coll.distinct('a') == scanned == [1, None]
+    index = coll._indexes['a_1']
+    assert sorted(index.doc_keys(d) != () for d in coll.find()) == [False, True, True]
+    assert [d['_id'] for d in coll.find({'a': {'$gte': 1}})] == [1]
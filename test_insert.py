@@ -0,0 +1,35 @@
+import pytest
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from test.mock.mongo import MockCollection
+
+
+def test_insert_duplicate_id():
+    coll = MockCollection([{'_id': 1}])
+    coll.insert_one({'_id': 2})
+
+    with pytest.raises(DuplicateKeyError):
+        coll.insert_one({'_id': 2})
+    with pytest.raises(BulkWriteError):
+        coll.insert_many([{'_id': 3}, {'_id': 1}])
+    assert list(coll.find()) == [{'_id': 1}, {'_id': 2}, {'_id': 3}]
+
+
+def test_find_one_and_delete_by_id():
+    coll = MockCollection()
+    coll.insert_many([{'_id': i, 'v': i} for i in range(100)])
+
+    assert coll.find_one({'_id': 42}) == {'_id': 42, 'v': 42}
+    assert coll.delete_one({'_id': 42}).deleted_count == 1
+    assert coll.find_one({'_id': 42}) is None
+    coll.insert_one({'_id': 42, 'v': 'again'})
+    assert coll.find_one({'_id': 42}) == {'_id': 42, 'v': 'again'}
+
+
+def test_document_id():
+    coll = MockCollection()
+    coll.insert_one({'_id': {'host': 'a', 'port': 1}})
+
+    assert coll.find_one({'_id': {'host': 'a', 'port': 1}}) is not None
+    with pytest.raises(DuplicateKeyError):
+        coll.insert_one({'_id': {'host': 'a', 'port': 1}})
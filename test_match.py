@@ -1,3 +1,6 @@
+import pytest
+from pymongo.errors import OperationFailure
+
 from test.mock import mongo
 from test.mock.mongo import MockCollection
 
@@ -8,7 +11,7 @@ def test_match_nested_document_filter():
     coll.insert_one({'_id': 'a'})
     mongo_mock_client['db']['coll'] = coll
 
-    assert coll.find({"something": {'$exists': True}}) == []
+    assert list(coll.find({"something": {'$exists': True}})) == []
 
 
 def test_match_filter_key_not_dict():
@@ -17,4 +20,52 @@ def test_match_filter_key_not_dict():
     coll.insert_one({'_id': 'a'})
     mongo_mock_client['db']['coll'] = coll
 
-    assert coll.find({'_id': 'a'}) == [{'_id': 'a'}]
+    assert list(coll.find({'_id': 'a'})) == [{'_id': 'a'}]
+
+
+DOCS = [
+    {'_id': 1, 'n': 1, 'host': {'name': 'a', 'ports': [22, 80]}, 'tags': ['x', 'y']},
+    {'_id': 2, 'n': 5, 'host': {'name': 'b', 'ports': [443]}, 'tags': []},
+    {'_id': 3, 'n': 10, 'host': {'name': 'c'}},
+    {'_id': 4, 'n': None, 'items': [{'k': 'p'}, {'k': 'q'}]},
+]
+
+
+def _ids(_filter):
+    return [d['_id'] for d in MockCollection(DOCS).find(_filter)]
+
+
+def test_match_comparison_operators():
+    assert _ids({'n': {'$gt': 1, '$lte': 10}}) == [2, 3]
+    assert _ids({'n': {'$in': [1, 10]}}) == [1, 3]
+    assert _ids({'n': {'$nin': [1, 10]}}) == [2, 4]
+    assert _ids({'n': {'$ne': 5}}) == [1, 3, 4]
+    assert _ids({'n': {'$not': {'$gte': 5}}}) == [1, 4]
+    assert _ids({'n': {'$gte': 'a'}}) == []
+
+
+def test_match_logical_operators():
+    assert _ids({'$or': [{'n': 1}, {'n': 10}]}) == [1, 3]
+    assert _ids({'$and': [{'n': {'$gt': 1}}, {'n': {'$lt': 10}}]}) == [2]
+    assert _ids({'$nor': [{'n': 1}, {'n': None}]}) == [2, 3]
+
+
+def test_match_dotted_paths_and_arrays():
+    assert _ids({'host.name': 'b'}) == [2]
+    assert _ids({'host.ports': 80}) == [1]
+    assert _ids({'host.ports': {'$gt': 100}}) == [2]
+    assert _ids({'host.ports.0': 22}) == [1]
+    assert _ids({'items.k': 'q'}) == [4]
+    assert _ids({'tags': 'y'}) == [1]
+    assert _ids({'host.ports': {'$exists': False}}) == [3, 4]
+
+
+def test_match_unknown_operator():
+    with pytest.raises(OperationFailure):
+        list(MockCollection(DOCS).find({'n': {'$bogus': 1}}))
+
+
+def test_compiled_filter_shared_between_values():
+    assert mongo.match({'a': 1}, {'a': {'$in': [1, 2]}})
+    assert not mongo.match({'a': 3}, {'a': {'$in': [4, 5]}})
+    assert mongo.match({'a': 3}, {'a': 3, 'b': None})
@@ -0,0 +1,84 @@
+import asyncio
+
+from pymongo import ReturnDocument
+
+from test.mock.motor import MockMotorClient
+
+
+def test_crud():
+    async def run():
+        coll = MockMotorClient()['db']['coll']
+        await coll.insert_many([{'_id': i, 'n': i} for i in range(1, 6)])
+        await coll.insert_one({'_id': 6, 'n': 6})
+        assert (await coll.update_many({'n': {'$gt': 4}}, {'$inc': {'n': 10}})).modified_count == 2
+        assert await coll.find_one({'_id': 6}) == {'_id': 6, 'n': 16}
+        doc = await coll.find_one_and_update({'_id': 1}, {'$set': {'n': 0}},
+                                             return_document=ReturnDocument.AFTER)
+        assert doc == {'_id': 1, 'n': 0}
+        assert (await coll.delete_many({'n': {'$lt': 3}})).deleted_count == 2
+        assert await coll.count_documents({}) == 4
+        assert [d['_id'] async for d in coll.find().sort('n', -1).limit(2)] == [6, 5]
+        assert await coll.find({}, sort=[('n', 1)]).to_list(2) == [{'_id': 3, 'n': 3},
+                                                                   {'_id': 4, 'n': 4}]
+        assert await coll.aggregate([{'$count': 'n'}]).to_list(None) == [{'n': 4}]
+
+    asyncio.run(run())
+
+
+def test_long_scan_yields_to_the_event_loop():
+    async def run():
+        client = MockMotorClient(yield_every=10)
+        coll = client['db']['coll']
+        await coll.insert_many([{'_id': i} for i in range(1, 101)])
+        ticks = []
+
+        async def ticker():
+            while True:
+                ticks.append(len(ticks))
+                await asyncio.sleep(0)
+
+        task = asyncio.ensure_future(ticker())
+        await asyncio.sleep(0)
+        start = len(ticks)
+        docs = await coll.find().to_list(None)
+        task.cancel()
+        assert len(docs) == 100
+        assert len(ticks) - start >= 10
+
+    asyncio.run(run())
+
+
+def test_selective_scan_yields_to_the_event_loop():
+    async def run():
+        client = MockMotorClient(yield_every=100)
+        coll = client['db']['coll']
+        await coll.insert_many([{'_id': i, 'n': i % 1000} for i in range(1, 5001)])
+        ticks = []
+
+        async def ticker():
+            while True:
+                ticks.append(len(ticks))
+                await asyncio.sleep(0)
+
+        task = asyncio.ensure_future(ticker())
+        await asyncio.sleep(0)
+        start = len(ticks)
+        docs = await coll.find({'n': 7}).sort('_id', -1).skip(1).to_list(None)
+        during = len(ticks) - start
+        task.cancel()
+        assert [d['_id'] for d in docs] == [3007, 2007, 1007, 7]
+        # 5000 candidates examined in chunks of 100, returning only 5 of them
+        assert during >= 40
+
+    asyncio.run(run())
+
+
+def test_seeded_collections():
+    async def run():
+        client = MockMotorClient()
+        db = client.get_default_database()
+        assert await db.gid.count_documents({}) == 5
+        assert await db['gid'].find_one({'hostname': 'host2'}, {'_id': 0, 'gid': 1}) == {'gid': 2}
+        assert db.get_collection('system.ingest').delegate is client.delegate.db.system.ingest
+
+    asyncio.run(run())
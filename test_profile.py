@@ -0,0 +1,60 @@
+from test.mock import mongo
+
+
+def _client():
+    client = mongo.MockMongoClient(None)
+    client['db']['hosts'].insert_many([{'_id': i, 'host': f'h{i % 10}', 'n': i} for i in range(100)])
+    client['db']['hosts'].create_index('host')
+    return client
+
+
+def test_profiler_records_operations():
+    client = _client()
+    profiler = client.enable_profiling(capacity=5)
+    hosts = client['db']['hosts']
+
+    assert len(list(hosts.find({'host': 'h1'}).limit(3))) == 3
+    hosts.find_one({'n': 5})
+    hosts.update_many({'host': 'h2'}, {'$set': {'x': 1}})
+
+    query, find_one, update = profiler.entries
+    assert (query['op'], query['ns'], query['planSummary']) == ('query', 'db.hosts', 'IXSCAN { host: 1 }')
+    assert (query['keysExamined'], query['docsExamined'], query['nreturned']) == (10, 3, 3)
+    assert find_one['filter'] == {'n': '?'}
+    assert (find_one['planSummary'], find_one['docsExamined']) == ('COLLSCAN', 6)
+    assert (update['op'], update['nreturned']) == ('update', 10)
+
+    totals = profiler.totals['db.hosts']
+    assert (totals['ops'], totals['collscans']) == (3, 1)
+    assert sum(profiler.histogram('db.hosts', 'query').values()) == 2
+
+    for i in range(10):
+        hosts.find_one({'_id': i})
+    assert len(profiler.entries) == 5
+    assert profiler.repeated_queries(min_count=5) == [
+        {'ns': 'db.hosts', 'op': 'query', 'filter': "{'_id': '?'}", 'count': 5}]
+
+
+def test_disabled_profiler_records_nothing():
+    client = _client()
+    profiler = client.enable_profiling()
+    client.disable_profiling()
+    client['db']['hosts'].find_one({'n': 1})
+    assert not profiler.entries
+
+
+def test_explain():
+    hosts = _client()['db']['hosts']
+    explain = hosts.find({'host': 'h3', 'n': {'$gt': 50}}).sort('n', -1).limit(2).explain()
+    assert explain['queryPlanner']['winningPlan'] == {
+        'stage': 'SORT', 'sortPattern': {'n': -1}, 'limitAmount': 2, 'inputStage': {
+            'stage': 'FETCH', 'inputStage': {'stage': 'IXSCAN', 'indexName': 'host_1',
+                                             'keyPattern': {'host': 1}}}}
+    assert explain['executionStats']['totalDocsExamined'] == 10
+    assert hosts.find({'n': 1}).explain()['queryPlanner']['winningPlan'] == {'stage': 'COLLSCAN'}
+
+    explain = hosts.aggregate([{'$match': {'host': 'h3'}}, {'$count': 'n'}], explain=True)
+    cursor = explain['stages'][0]['$cursor']
+    assert cursor['queryPlanner']['winningPlan']['inputStage']['indexName'] == 'host_1'
+    assert cursor['executionStats']['nReturned'] == 1
+    assert explain['stages'][1:] == [{'$count': 'n'}]
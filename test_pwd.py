@@ -0,0 +1,53 @@
+import io
+from subprocess import CalledProcessError
+
+import pytest
+
+from test.mock.pwd import MockPwd, read_passwd
+
+PASSWD = '''# comment
+root:x:0:0:root:/root:/bin/bash
+
+sonarw:x:981:981:jsonar system user:/home/sonarw:/bin/bash
+alice:x:1000:1000:Alice,admin:/home/alice:/bin/sh
+root:x:5:5:shadowed root:/root:/bin/sh
+'''
+
+
+def test_lookups():
+    pwd = MockPwd.from_file(io.StringIO(PASSWD))
+    assert len(pwd.get_pwall()) == 4
+    assert pwd.getpwnam('alice').pw_gecos == 'Alice,admin'
+    assert pwd.getpwuid(981).pw_name == 'sonarw'
+    # the first of duplicate entries wins, like the real module
+    assert pwd.getpwnam('root').pw_uid == 0
+    assert pwd.getpwuid(5).pw_gecos == 'shadowed root'
+    with pytest.raises(KeyError):
+        pwd.getpwuid(4)
+    with pytest.raises(KeyError):
+        pwd.getpwnam('bob')
+
+
+def test_useradd():
+    pwd = MockPwd()
+    pwd.useradd('bob', None, None)
+    assert pwd.getpwnam('bob').pw_uid == 982
+    pwd.useradd('carol', '2000', None)
+    pwd.useradd('dave', None, None)
+    assert pwd.getpwuid(2001).pw_name == 'dave'
+    with pytest.raises(CalledProcessError):
+        pwd.useradd('eve', '981', None)
+    with pytest.raises(CalledProcessError):
+        pwd.useradd('bob', None, None)
+
+    pwd.db.append(pwd.getpwnam('bob')._replace(pw_name='frank', pw_uid=3000))
+    assert pwd.getpwnam('frank').pw_uid == 3000
+    pwd.useradd('grace', None, None)
+    assert pwd.getpwnam('grace').pw_uid == 3001
+
+
+def test_read_passwd(tmp_path):
+    path = tmp_path / 'passwd'
+    path.write_text(PASSWD)
+    assert [u.pw_name for u in read_passwd(path)] == ['root', 'sonarw', 'alice', 'root']
+    assert MockPwd([]).load(read_passwd(str(path))).getpwnam('alice').pw_dir == '/home/alice'
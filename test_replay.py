@@ -0,0 +1,83 @@
+import io
+
+import pytest
+from bson import json_util
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from test.mock import mongo
+from test.mock.mongo_replay import load_journal, percentile, replay
+
+
+def _workload(client):
+    hosts = client['db']['hosts']
+    hosts.insert_many({'_id': i, 'n': i} for i in range(1, 11))
+    hosts.update_many({'n': {'$gt': 5}}, {'$inc': {'n': 1}})
+    assert len(list(hosts.find({'n': {'$gt': 3}}, {'n': 1}).sort('n', -1).limit(3))) == 3
+    hosts.find_one({'_id': 2})
+    hosts.bulk_write([InsertOne({'_id': 20}), UpdateOne({'_id': 20}, {'$set': {'x': 1}})])
+    assert list(hosts.aggregate([{'$match': {'n': 1}}])) == [{'_id': 1, 'n': 1}]
+    client['other']['log'].insert_one({'_id': 1, 'at': json_util.loads('{"$date": 0}')})
+
+
+def test_recorder_journals_operations(tmp_path):
+    client = mongo.MockMongoClient(None)
+    recorder = client.enable_recording(tmp_path / 'journal.jsonl')
+    _workload(client)
+    client.disable_recording()
+    client['db']['hosts'].delete_many({})
+
+    entries = list(load_journal(tmp_path / 'journal.jsonl'))
+    assert recorder.entries == len(entries) == 7
+    assert [(e['db'], e['coll'], e['op'], e['n']) for e in entries] == [
+        ('db', 'hosts', 'insert_many', 10), ('db', 'hosts', 'update_many', 5),
+        ('db', 'hosts', 'find', 3), ('db', 'hosts', 'find_one', 1), ('db', 'hosts', 'bulk_write', 2),
+        ('db', 'hosts', 'aggregate', 1), ('other', 'log', 'insert_one', 1)]
+    assert entries[1]['args'] == {'_filter': {'n': {'$gt': 5}}, 'update_doc': {'$inc': {'n': 1}}}
+    assert entries[2]['args']['sort'] == [['n', -1]] and entries[2]['args']['limit'] == 3
+    assert all(e['ts'] >= 0 and e['micros'] > 0 for e in entries)
+    assert [e['ts'] for e in entries] == sorted(e['ts'] for e in entries)
+
+
+def test_replay_reproduces_the_workload():
+    client, journal = mongo.MockMongoClient(None), io.StringIO()
+    client.enable_recording(journal)
+    _workload(client)
+    with pytest.raises(DuplicateKeyError):
+        client['db']['hosts'].insert_one({'_id': 1})
+    client.disable_recording()
+    assert json_util.loads(journal.getvalue().splitlines()[-1])['error'] == 'DuplicateKeyError'
+
+    journal.seek(0)
+    target = mongo.MockMongoClient(None)
+    report = replay(journal, target)
+    assert (report['ops'], report['errors']) == (8, 1)
+    assert list(target['db']['hosts'].find()) == list(client['db']['hosts'].find())
+    assert target['other']['log'].find_one() == client['other']['log'].find_one()
+    assert report['by_op']['insert_one']['count'] == 2
+    assert report['throughput'] > 0 and report['latency']['p50'] <= report['latency']['max']
+
+    journal.seek(0)
+    report = replay(journal, threads=4, rate=1000)
+    assert (report['ops'], report['errors']) == (8, 1)
+    assert report['seconds'] >= 0.007
+
+
+def test_replay_on_the_default_database():
+    client, journal = mongo.MockMongoClient(None), io.StringIO()
+    client.enable_recording(journal)
+    client.db.gid.update_one({'hostname': 'host2'}, {'$set': {'version': 11}})
+    client.db['hosts'].insert_one({'_id': 1})
+    client.disable_recording()
+
+    journal.seek(0)
+    target = mongo.MockMongoClient(None)
+    assert replay(journal, target)['errors'] == 0
+    assert target.db.gid.find_one({'hostname': 'host2'})['version'] == 11
+    assert target.db['hosts'].find_one() == {'_id': 1}
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert [percentile(values, p) for p in (0, 50, 90, 99, 100)] == [1, 50, 90, 99, 100]
+    assert percentile([], 50) == 0
@@ -0,0 +1,106 @@
+import pytest
+from pymongo import MongoClient, ReturnDocument, UpdateOne, InsertOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+
+from test.mock.mongo import MockMongoClient
+from test.mock.mongo_server import MockMongoServer
+
+
+@pytest.fixture
+def server():
+    with MockMongoServer() as server:
+        yield server
+
+
+@pytest.fixture
+def client(server):
+    client = MongoClient(server.uri, serverSelectionTimeoutMS=2000)
+    yield client
+    client.close()
+
+
+def test_crud_through_pymongo(server, client):
+    coll = client['db']['coll']
+    coll.insert_many([{'_id': i, 'n': i % 3} for i in range(1, 301)])
+    assert server.client['db']['coll'].count_documents({}) == 300
+
+    docs = list(coll.find({'n': 1}).sort('_id', -1).batch_size(10))
+    assert len(docs) == 100 and docs[0]['_id'] == 298
+    assert coll.find_one({'_id': 5}, {'_id': 0}) == {'n': 2}
+    assert coll.count_documents({'n': 0}) == 100
+
+    assert coll.update_many({'n': 0}, {'$set': {'zero': True}}).modified_count == 100
+    result = coll.update_one({'_id': 1000}, {'$set': {'n': 9}}, upsert=True)
+    assert result.upserted_id == 1000
+    assert coll.replace_one({'_id': 1000}, {'n': 10}).modified_count == 1
+    assert coll.find_one_and_update({'_id': 1000}, {'$inc': {'n': 1}},
+                                    return_document=ReturnDocument.AFTER) == {'_id': 1000, 'n': 11}
+    assert coll.delete_many({'zero': True}).deleted_count == 100
+    assert coll.delete_one({'_id': 1000}).deleted_count == 1
+
+    assert list(coll.aggregate([{'$match': {'n': 1}}, {'$count': 'c'}])) == [{'c': 100}]
+
+
+def test_errors_and_indexes(client):
+    coll = client['db']['coll']
+    coll.create_index('name', unique=True)
+    assert 'name_1' in coll.index_information()
+    coll.insert_one({'_id': 1, 'name': 'a'})
+    with pytest.raises(DuplicateKeyError):
+        coll.insert_one({'_id': 2, 'name': 'a'})
+    with pytest.raises(BulkWriteError) as e:
+        coll.bulk_write([InsertOne({'_id': 3, 'name': 'b'}),
+                         UpdateOne({'_id': 3}, {'$set': {'name': 'a'}})])
+    assert e.value.details['nInserted'] == 1
+    assert e.value.details['writeErrors'][0]['code'] == 11000
+    with pytest.raises(OperationFailure):
+        coll.find_one({'name': {'$bogus': 1}})
+    coll.drop_index('name_1')
+    assert list(coll.index_information()) == ['_id_']
+    assert client['db'].list_collection_names() == ['coll']
+    client['db'].drop_collection('coll')
+    assert client['db'].list_collection_names() == []
+
+
+def test_shared_dataset_and_custom_commands():
+    shared = MockMongoClient(None, thread_safe=True)
+    shared['db']['coll'].insert_one({'_id': 1})
+    with MockMongoServer(shared) as server:
+        clients = [MongoClient(server.uri, maxPoolSize=4) for _ in range(2)]
+        clients[0]['db']['coll'].insert_one({'_id': 2})
+        assert [d['_id'] for d in clients[1]['db']['coll'].find()] == [1, 2]
+        db = clients[0].get_database('mock_db')
+        assert db.command('getParameter', 1, featureFlag=1) == {'ok': 1, 'featureFlag': 0}
+        assert db.gid.find_one({'hostname': 'host2'})['gid'] == 2
+        for c in clients:
+            c.close()
+    assert server.commands['insert'] == 1
+
+
+def test_find_and_modify_and_abandoned_cursors(server):
+    def run(name, value, **cmd):
+        return server.run_command({name: value, **cmd, '$db': 'db'})
+
+    run('insert', 'coll', documents=[{'_id': i} for i in range(10)])
+    for new in (False, True):
+        ret = run('findAndModify', 'coll', query={'_id': 1}, update={'$set': {'new': new}},
+                  upsert=True, new=new)
+        assert ret['lastErrorObject'] == {'n': 1, 'updatedExisting': True}
+        ret = run('findAndModify', 'coll', query={'_id': 20 + new}, update={'$set': {'x': 1}},
+                  upsert=True, new=new)
+        assert ret['lastErrorObject'] == {'n': 1, 'updatedExisting': False}
+        assert (ret['value'] is not None) == new
+    ret = run('findAndModify', 'coll', query={'_id': 30}, update={'x': 1})
+    assert ret['lastErrorObject'] == {'n': 0, 'updatedExisting': False}
+    assert server.client['db']['coll'].count_documents({}) == 12
+
+    server.max_cursors = 2
+    ids = [run('find', 'coll', batchSize=1)['cursor']['id'] for _ in range(3)]
+    assert list(server.cursors) == ids[1:]
+    assert run('getMore', ids[0], collection='coll')['code'] == 43
+    ret = run('getMore', ids[1], collection='coll', batchSize=1)
+    assert ret['cursor']['nextBatch'] == [{'_id': 1, 'new': True}]
+    assert list(server.cursors) == [ids[2], ids[1]]
+    server.cursor_timeout = 0
+    assert run('getMore', ids[2], collection='coll')['code'] == 43
+    assert not server.cursors
@@ -0,0 +1,85 @@
+import os
+import stat
+from time import perf_counter
+
+import pytest
+
+from test.mock.paramiko import MockSFTPClient
+from test.mock.paramiko_fs import MemoryFS
+
+
+@pytest.fixture
+def sftp():
+    return MockSFTPClient(MemoryFS())
+
+
+def test_tree(sftp):
+    sftp.mkdir('/data')
+    sftp.chdir('/data')
+    sftp.mkdir('dump', 0o700)
+    with sftp.open('dump/coll.bson', 'w') as f:
+        f.write(b'abc')
+    with sftp.open('dump/coll.bson', 'a') as f:
+        f.write(b'def')
+    with sftp.open('/data/dump/coll.bson') as f:
+        assert f.read(2) == b'ab' and f.read() == b'cdef'
+    assert sftp.stat('dump/coll.bson').st_size == 6
+    assert stat.S_IMODE(sftp.stat('dump').st_mode) == 0o700
+    assert [(a.filename, stat.S_ISDIR(a.st_mode)) for a in sftp.listdir_attr()] == [('dump', True)]
+
+    with pytest.raises(FileNotFoundError):
+        sftp.stat('missing')
+    with pytest.raises(FileExistsError):
+        sftp.mkdir('dump')
+    with pytest.raises(OSError):
+        sftp.rmdir('dump')
+    with pytest.raises(NotADirectoryError):
+        sftp.chdir('dump/coll.bson')
+
+    with sftp.open('other', 'w') as f:
+        f.write(b'x')
+    sftp.posix_rename('other', 'dump/coll.bson')
+    assert sftp.listdir('dump') == ['coll.bson'] and sftp.stat('dump/coll.bson').st_size == 1
+    with pytest.raises(FileExistsError):
+        sftp.rename('dump', 'dump/coll.bson')
+    with pytest.raises(OSError):
+        sftp.posix_rename('/data', '/data/dump/inside')
+    sftp.rename('dump', 'moved')
+    sftp.unlink('moved/coll.bson')
+    sftp.rmdir('moved')
+    assert sftp.listdir('.') == []
+
+
+def test_clients_keep_their_own_cwd(tmp_path):
+    fs = MemoryFS()
+    one, two = MockSFTPClient(fs), MockSFTPClient(fs)
+    one.mkdir('/a')
+    one.chdir('/a')
+    with one.open('f', 'w') as f:
+        f.write(b'1')
+    assert two.getcwd() == '/' and two.listdir('a') == ['f']
+
+    cwd = os.getcwd()
+    local = MockSFTPClient()
+    local.chdir(str(tmp_path))
+    (tmp_path / 'x').write_bytes(b'123')
+    assert [a.filename for a in local.listdir_attr()] == ['x']
+    assert local.stat('x').st_size == 3 and os.getcwd() == cwd
+
+
+def test_transfers_and_shaping(sftp, tmp_path):
+    payload = os.urandom(200000)
+    (tmp_path / 'in').write_bytes(payload)
+    assert sftp.put(str(tmp_path / 'in'), '/blob').st_size == len(payload)
+    sftp.get('/blob', str(tmp_path / 'out'))
+    assert (tmp_path / 'out').read_bytes() == payload
+
+    shaped = MockSFTPClient(sftp.fs, bandwidth=1000000, latency=0.01)
+    start = perf_counter()
+    with open(tmp_path / 'out', 'wb') as f:
+        assert shaped.getfo('/blob', f) == len(payload)
+    assert perf_counter() - start >= 0.2
+    start = perf_counter()
+    for _ in range(5):
+        shaped.stat('/blob')
+    assert perf_counter() - start >= 0.05
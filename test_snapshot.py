@@ -0,0 +1,57 @@
+from test.mock import mongo
+from test.mock.mongo import MockCollection
+
+
+def test_collection_snapshot_restore():
+    coll = MockCollection([{'_id': i, 'n': i, 'sub': {'v': i}} for i in range(1, 6)])
+    coll.create_index('n')
+    snapshot = coll.snapshot()
+
+    coll.insert_one({'_id': 6, 'n': 6})
+    coll.delete_one({'_id': 1})
+    coll.update_one({'_id': 2}, {'$set': {'sub.v': 'changed', 'n': 20}})
+    coll.replace_one({'_id': 3}, {'n': 30})
+    assert coll.find_one({'n': 20})['sub'] == {'v': 'changed'}
+
+    coll.restore(snapshot)
+    assert [d['_id'] for d in coll.find()] == [1, 2, 3, 4, 5]
+    assert coll.find_one({'_id': 2}) == {'_id': 2, 'n': 2, 'sub': {'v': 2}}
+    assert coll.find_one({'n': 20}) is None
+    assert coll.find_one({'n': 3}) == {'_id': 3, 'n': 3, 'sub': {'v': 3}}
+
+    coll.update_many({}, {'$inc': {'n': 1}})
+    coll.restore(snapshot)
+    assert [d['n'] for d in coll.find()] == [1, 2, 3, 4, 5]
+
+
+def test_fork_is_independent():
+    coll = MockCollection([{'_id': 1, 'n': 1}])
+    fork = coll.fork()
+    fork.update_one({'_id': 1}, {'$set': {'n': 2}})
+    coll.insert_one({'_id': 2})
+    assert list(coll.find()) == [{'_id': 1, 'n': 1}, {'_id': 2}]
+    assert list(fork.find()) == [{'_id': 1, 'n': 2}]
+
+
+def test_client_snapshot_restore():
+    client = mongo.MockMongoClient(None)
+    coll = client['db']['coll']
+    coll.insert_one({'_id': 1})
+    snapshot = client.snapshot()
+
+    coll.insert_one({'_id': 2})
+    client['db']['other'].insert_one({'_id': 1})
+    client['db2']['coll'].insert_one({'_id': 1})
+    client.db.gid.delete_many({})
+
+    client.restore(snapshot)
+    assert list(client['db'].list_collection_names()) == ['coll']
+    assert list(client['db']['coll'].find()) == [{'_id': 1}]
+    assert client['db']['coll'] is coll
+    assert list(client.databases) == ['db']
+    assert client.db.gid.count_documents({}) == 5
+
+    fork = client.fork()
+    fork['db']['coll'].insert_one({'_id': 3})
+    assert coll.count_documents({}) == 1
+    assert fork['db']['coll'].db is fork['db']
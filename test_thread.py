@@ -0,0 +1,98 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from pymongo.errors import OperationFailure
+
+from test.mock import mongo
+from test.mock.mongo import MockCollection
+
+
+def test_concurrent_writers_and_readers():
+    coll = MockCollection(thread_safe=True)
+    coll.create_index('worker')
+
+    def work(worker):
+        for i in range(200):
+            coll.insert_one({'_id': worker * 1000 + i + 1, 'worker': worker, 'n': 0})
+            coll.update_one({'_id': worker * 1000 + i + 1}, {'$inc': {'n': 1}})
+            assert len(list(coll.find({'worker': worker}))) == i + 1
+            # a scan running next to writers sees each document whole
+            for doc in coll.find({'n': {'$gte': 0}}):
+                assert set(doc) == {'_id', 'worker', 'n'}
+
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(work, range(8)))
+
+    assert coll.count_documents({}) == 1600
+    assert coll.count_documents({'n': 1}) == 1600
+    stats = coll.contention()
+    assert stats['writes'] == 3200 + 1
+    assert stats['reads'] > 0
+
+
+def test_readers_do_not_block_each_other():
+    coll = MockCollection([{'_id': 1}], thread_safe=True)
+    with coll._lock.reading():
+        found = []
+        reader = threading.Thread(target=lambda: found.append(coll.find_one({'_id': 1})))
+        reader.start()
+        reader.join(5)
+        assert found == [{'_id': 1}]
+    assert coll.contention().get('read_waits', 0) == 0
+
+
+def test_writer_waits_for_readers():
+    coll = MockCollection([{'_id': 1, 'n': 1}], thread_safe=True)
+    before = coll.find_one({'_id': 1})
+    with coll._lock.reading():
+        writer = threading.Thread(target=lambda: coll.update_one({'_id': 1}, {'$set': {'n': 2}}))
+        writer.start()
+        writer.join(0.1)
+        assert writer.is_alive()
+        assert coll.find_one({'_id': 1})['n'] == 1
+    writer.join(5)
+    assert coll.contention()['write_waits'] == 1
+    # the document held by an earlier reader is not changed under it
+    assert before == {'_id': 1, 'n': 1}
+    assert coll.find_one({'_id': 1}) == {'_id': 1, 'n': 2}
+
+
+def test_nested_operations_reenter_the_lock():
+    client = mongo.MockMongoClient(None, thread_safe=True)
+    coll = client['db']['coll']
+    assert coll.thread_safe
+    coll.replace_one({'_id': 1}, {'n': 1}, upsert=True)
+    assert coll.find_one_and_update({'_id': 1}, {'$inc': {'n': 1}}, return_document=True) == \
+        {'_id': 1, 'n': 2}
+
+
+def test_failed_update_leaves_document_whole():
+    coll = MockCollection([{'_id': 1, 'a': 1, 's': 'x'}], thread_safe=True)
+    doc = coll.find_one({'_id': 1})
+    try:
+        coll.update_one({'_id': 1}, {'$set': {'a': 2}, '$inc': {'s': 1}})
+    except Exception:
+        pass
+    assert coll.find_one({'_id': 1}) is doc
+    assert doc == {'_id': 1, 'a': 1, 's': 'x'}
+
+
+def test_raise_on_next_command_raises_once():
+    coll = MockCollection([{'_id': 1}], thread_safe=True)
+    coll.raise_on_next_command = OperationFailure('boom')
+    barrier = threading.Barrier(8)
+    failures = []
+
+    def work():
+        barrier.wait()
+        try:
+            coll.find_one({'_id': 1})
+        except OperationFailure:
+            failures.append(1)
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert failures == [1]
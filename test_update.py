@@ -1,3 +1,6 @@
+import pytest
+from pymongo.errors import InvalidOperation, WriteError
+
 from test.mock import mongo
 from test.mock.mongo import MockCollection
 
@@ -13,8 +16,8 @@ def test_one_matched_none_modified():
     update_result = coll.update_one({"something": {'$exists': True}}, {'$set': {'something': 'something2'}})
     assert update_result.matched_count == 1
     assert update_result.modified_count == 1
-    assert mongo_mock_client['db']['coll'].find() == [{'_id': 1, 'something': 'something2'},
-                                                      {'_id': 2, 'something_else': 'something_else'}]
+    assert list(mongo_mock_client['db']['coll'].find()) == [{'_id': 1, 'something': 'something2'},
+                                                            {'_id': 2, 'something_else': 'something_else'}]
 
 
 def test_none_matched_none_modified():
@@ -26,7 +29,7 @@ def test_none_matched_none_modified():
     update_result = coll.update_one({"something_": {'$exists': True}}, {'$set': {'something': 'something2'}})
     assert update_result.matched_count == 0
     assert update_result.modified_count == 0
-    assert mongo_mock_client['db']['coll'].find() == SAMPLE_LIST
+    assert list(mongo_mock_client['db']['coll'].find()) == SAMPLE_LIST
 
 
 def test_update_many():
@@ -38,5 +41,88 @@ def test_update_many():
     update_result = coll.update_many({"something": {'$exists': True}}, {'$set': {'something': 'something2'}})
     assert update_result.matched_count == 2
     assert update_result.modified_count == 2
-    assert mongo_mock_client['db']['coll'].find() == [{'_id': 1, 'something': 'something2'},
-                                                      {'_id': 2, 'something': 'something2'}]
+    assert list(mongo_mock_client['db']['coll'].find()) == [{'_id': 1, 'something': 'something2'},
+                                                            {'_id': 2, 'something': 'something2'}]
+
+
+def test_update_operators():
+    coll = MockCollection([{'_id': 1, 'n': 1, 'host': {'name': 'a'}, 'tags': ['x'], 'old': 1}])
+    result = coll.update_one({'_id': 1}, {
+        '$set': {'host.port': 22},
+        '$inc': {'n': 2, 'hits': 1},
+        '$mul': {'scale': 3},
+        '$max': {'top': 5},
+        '$push': {'tags': {'$each': ['y', 'z'], '$slice': -2}},
+        '$addToSet': {'set': {'$each': [1, 1, 2]}},
+        '$rename': {'old': 'new'},
+        '$setOnInsert': {'created': True},
+    })
+    assert result.modified_count == 1
+    assert coll.find_one({'_id': 1}) == {'_id': 1, 'n': 3, 'host': {'name': 'a', 'port': 22},
+                                         'tags': ['y', 'z'], 'hits': 1, 'scale': 0, 'top': 5,
+                                         'set': [1, 2], 'new': 1}
+
+    coll.update_one({'_id': 1}, {'$pull': {'tags': 'y', 'set': {'$gte': 2}}, '$unset': {'host.name': ''},
+                                 '$min': {'top': 1}})
+    assert coll.find_one({'_id': 1}, sort=[('_id', 1)])['tags'] == ['z']
+    assert coll.find_one({'_id': 1})['set'] == [1]
+    assert coll.find_one({'_id': 1})['host'] == {'port': 22}
+    assert coll.find_one({'_id': 1})['top'] == 1
+
+
+def test_update_unchanged_not_modified():
+    coll = MockCollection()
+    coll.insert_many([{'_id': 1, 'v': 1}, {'_id': 2, 'v': 2}])
+    result = coll.update_many({}, {'$set': {'v': 2}})
+    assert (result.matched_count, result.modified_count) == (2, 1)
+    assert coll.update_one({'_id': 1}, {'$addToSet': {'a': 1}}).modified_count == 1
+    assert coll.update_one({'_id': 1}, {'$addToSet': {'a': 1}}).modified_count == 0
+
+
+def test_upsert_document():
+    coll = MockCollection()
+    result = coll.update_one({'_id': 7, 'kind': 'a', 'n': {'$gt': 1}},
+                             {'$set': {'x': 1}, '$setOnInsert': {'created': True}, '$inc': {'hits': 1}},
+                             upsert=True)
+    assert result.upserted_id == 7
+    assert coll.find_one({'_id': 7}) == {'_id': 7, 'kind': 'a', 'x': 1, 'created': True, 'hits': 1}
+
+
+def test_update_errors():
+    coll = MockCollection([{'_id': 1, 's': 'x'}])
+    with pytest.raises(WriteError):
+        coll.update_one({'_id': 1}, {'$inc': {'s': 1}})
+    with pytest.raises(WriteError):
+        coll.update_one({'_id': 1}, {'$set': {'_id': 2}})
+    with pytest.raises(WriteError):
+        coll.update_one({'_id': 1}, {'$set': {'a': 1}, '$inc': {'a.b': 1}})
+    with pytest.raises(InvalidOperation):
+        coll.update_one({'_id': 1}, {'s': 'y'})
+
+
+def test_failed_update_leaves_document_unchanged():
+    coll = MockCollection([{'_id': 1, 's': 'x', 'n': {'a': 1}}])
+    with pytest.raises(WriteError):
+        coll.update_one({'_id': 1}, {'$set': {'a': 1, 'n.b': 2}, '$unset': {'s': ''},
+                                     '$inc': {'n.a': 'one', 'z': 1}})
+    with pytest.raises(WriteError):
+        coll.update_one({'_id': 1}, {'$set': {'a': 1}, '$inc': {'s': 1}})
+    with pytest.raises(WriteError):
+        coll.update_many({}, {'$rename': {'s': 't'}, '$push': {'n': 1}})
+    doc = coll.find_one({'_id': 1})
+    assert doc == {'_id': 1, 's': 'x', 'n': {'a': 1}} and list(doc) == ['_id', 's', 'n']
+
+    coll.update_one({'_id': 1}, {'$set': {'arr': [0, {'b': 1}]}})
+    with pytest.raises(WriteError):
+        coll.update_one({'_id': 1}, {'$set': {'arr.3.c': 1, 'arr.1.d': 2}, '$unset': {'arr.1.b': 1},
+                                     '$inc': {'s': 1}})
+    assert coll.find_one({'_id': 1})['arr'] == [0, {'b': 1}]
+
+
+def test_add_to_set_and_pull_tell_booleans_from_numbers():
+    coll = MockCollection([{'_id': 1, 'a': [1, 0]}])
+    coll.update_one({'_id': 1}, {'$addToSet': {'a': {'$each': [True, 1, False, True]}}})
+    assert [type(v) for v in coll.find_one()['a']] == [int, int, bool, bool]
+    coll.update_one({'_id': 1}, {'$pull': {'a': True}})
+    assert [type(v) for v in coll.find_one()['a']] == [int, int, bool]
+    assert coll.update_one({'_id': 1}, {'$pull': {'a': 2}}).modified_count == 0
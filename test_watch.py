@@ -0,0 +1,80 @@
+import pytest
+from pymongo.errors import OperationFailure
+
+from test.mock import mongo
+from test.mock.mongo import MockCollection
+
+
+def test_collection_stream():
+    coll = MockCollection()
+    coll.insert_one({'_id': 1, 'n': 1})
+    stream = coll.watch()
+    assert stream.try_next() is None
+    coll.insert_one({'_id': 2, 'n': 2})
+    coll.update_one({'_id': 2}, {'$set': {'n': 3}, '$unset': {'x': 1}})
+    coll.update_one({'_id': 1}, {'$unset': {'n': 1}})
+    coll.replace_one({'_id': 1}, {'m': 1})
+    coll.delete_one({'_id': 2})
+
+    change = stream.try_next()
+    assert change['operationType'] == 'insert'
+    assert change['fullDocument'] == {'_id': 2, 'n': 2}
+    assert change['documentKey'] == {'_id': 2}
+    change = stream.try_next()
+    assert change['operationType'] == 'update'
+    assert change['updateDescription']['updatedFields'] == {'n': 3}
+    assert 'fullDocument' not in change
+    change = stream.try_next()
+    assert change['updateDescription']['removedFields'] == ['n']
+    assert [stream.try_next()['operationType'] for _ in range(2)] == ['replace', 'delete']
+    assert stream.try_next() is None
+    assert stream.lag == 0
+
+
+def test_pipeline_full_document_and_resume():
+    client = mongo.MockMongoClient(None)
+    coll = client['db']['coll']
+    other = client['db']['other']
+    stream = client['db'].watch([{'$match': {'operationType': 'update'}}],
+                                full_document='updateLookup')
+    coll.insert_one({'_id': 1, 'n': 1})
+    other.insert_one({'_id': 1, 'n': 1})
+    coll.update_one({'_id': 1}, {'$inc': {'n': 1}})
+    other.update_one({'_id': 1}, {'$inc': {'n': 5}})
+    coll.update_one({'_id': 1}, {'$inc': {'n': 1}})
+
+    change = next(stream)
+    assert change['ns'] == {'db': 'db', 'coll': 'coll'}
+    assert change['fullDocument'] == {'_id': 1, 'n': 3}
+    token = stream.resume_token
+
+    resumed = client.watch(resume_after=token)
+    assert [c['ns']['coll'] for c in iter(resumed.try_next, None)] == ['other', 'coll']
+    assert client['elsewhere'].watch().try_next() is None
+
+
+def test_bounded_oplog():
+    client = mongo.MockMongoClient(None)
+    client.enable_oplog(capacity=10)
+    coll = client['db']['coll']
+    stream = coll.watch()
+    coll.insert_many([{'_id': i} for i in range(1, 101)])
+    assert len(client.oplog.entries) == 10
+    assert stream.lag == 100
+    with pytest.raises(OperationFailure) as e:
+        stream.try_next()
+    assert e.value.code == 286
+    assert coll.watch(start_after={'_data': f'{95:016X}'}).try_next()['documentKey'] == {'_id': 96}
+
+
+def test_drop_invalidates_collection_stream():
+    client = mongo.MockMongoClient(None)
+    coll = client['db']['coll']
+    stream = coll.watch()
+    db_stream = client['db'].watch()
+    coll.insert_one({'_id': 1})
+    coll.drop()
+    assert stream.try_next()['operationType'] == 'insert'
+    assert stream.try_next()['operationType'] == 'invalidate'
+    assert not stream.alive
+    assert [c['operationType'] for c in iter(db_stream.try_next, None)] == ['insert', 'drop']